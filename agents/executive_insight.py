@@ -4,11 +4,14 @@ Senior CRO/CFO Advisor - Executive-Level Insight Extraction
 """
 import time
 import json
-from typing import Dict, Tuple
+from typing import Awaitable, Callable, Dict, List, Optional, Tuple
 import logging
 
 logger = logging.getLogger(__name__)
 
+# Bump whenever prompts or the output schema change; cached results of other versions are not reused
+PROMPT_VERSION = "2"
+
 EXECUTIVE_INSIGHT_PERSONA = """Anda adalah **Senior Chief Risk Officer (CRO) & CFO Advisor** dengan pengalaman 20+ tahun di bidang enterprise risk management dan financial oversight.
 
 ## Profil Keahlian Anda:
@@ -109,6 +112,36 @@ Ekstrak insight eksekutif dari dokumen audit/laporan berikut untuk keperluan das
 7. Jika dokumen bukan laporan audit/risiko, tetap ekstrak insight yang relevan dari konten yang ada"""
 
 
+RISK_LEVEL_ORDER = {"CRITICAL": 0, "HIGH": 1, "MEDIUM": 2, "LOW": 3}
+TABLE_KIND_ORDER = {"risk_register": 0, "audit_plan": 1}
+
+
+def render_tables(tables: List[Dict], max_chars: int) -> str:
+    """
+    Render structured sheet rows as compact lines, risk registers first and
+    highest risk levels first, stopping at max_chars
+    """
+    lines: List[str] = []
+    used = 0
+    for table in sorted(tables, key=lambda t: TABLE_KIND_ORDER.get(t.get("kind"), 2)):
+        rows = table.get("rows") or []
+        if table.get("kind") == "risk_register":
+            rows = sorted(rows, key=lambda r: RISK_LEVEL_ORDER.get(str(r.get("inherent_risk_level")).upper(), 4))
+        block = [f"=== Sheet: {table.get('sheet_name', '')} ({table.get('kind')}) ==="] + [
+            " | ".join(
+                f"{field}: {value}" for field, value in row.items()
+                if field != "extra" and value not in ("", None)
+            )
+            for row in rows
+        ]
+        for line in block:
+            if used + len(line) + 1 > max_chars:
+                return "\n".join(lines)
+            lines.append(line)
+            used += len(line) + 1
+    return "\n".join(lines)
+
+
 class ExecutiveInsightAnalyzer:
     """
     Executive Insight Analyzer Agent
@@ -118,13 +151,16 @@ class ExecutiveInsightAnalyzer:
     def __init__(self):
         self.persona = EXECUTIVE_INSIGHT_PERSONA
         self.system_prompt = EXECUTIVE_INSIGHT_SYSTEM_PROMPT
+        self.prompt_version = PROMPT_VERSION
         logger.info("Executive Insight Analyzer Agent initialized")
 
     async def analyze_document(
         self,
         document_text: str,
         document_metadata: Dict,
-        analysis_type: str = "full"
+        analysis_type: str = "full",
+        tables: Optional[List[Dict]] = None,
+        progress: Callable[..., Awaitable[None]] = None
     ) -> Tuple[Dict, int, int]:
         """
         Analyze document and extract executive-level insights
@@ -133,11 +169,14 @@ class ExecutiveInsightAnalyzer:
             document_text: Full text content of the document
             document_metadata: Document metadata (filename, type, etc.)
             analysis_type: Type of analysis (full, quick, risk_focus)
+            tables: Structured spreadsheet tables of the document, if any
+            progress: Optional callback(stage, fraction) for job progress
 
         Returns:
             Tuple of (insight_result, execution_time_ms, tokens_used)
         """
         from backend.llm_client import llm_client
+        from backend.usage_tracker import usage_tracker
 
         start_time = time.time()
 
@@ -146,7 +185,8 @@ class ExecutiveInsightAnalyzer:
             analysis_prompt = self._build_analysis_prompt(
                 document_text,
                 document_metadata,
-                analysis_type
+                analysis_type,
+                tables
             )
 
             messages = [
@@ -161,19 +201,23 @@ class ExecutiveInsightAnalyzer:
                 "risk_focus": 2500
             }
 
+            if progress is not None:
+                await progress("analyzing", 0.1)
+
             # Generate analysis with JSON mode
-            response = await llm_client.generate_completion(
-                messages=messages,
-                temperature=0.3,  # Lower temperature for factual analysis
-                max_tokens=max_tokens_map.get(analysis_type, 4000),
-                json_mode=True
-            )
+            with usage_tracker.labels(agent="executive_insight"), usage_tracker.collect() as usage:
+                response = await llm_client.generate_completion(
+                    messages=messages,
+                    temperature=0.3,  # Lower temperature for factual analysis
+                    max_tokens=max_tokens_map.get(analysis_type, 4000),
+                    json_mode=True
+                )
 
             # Parse JSON response
             insight_result = json.loads(response)
 
             execution_time = int((time.time() - start_time) * 1000)
-            tokens_used = llm_client.count_tokens(response)
+            tokens_used = usage["total_tokens"]
 
             logger.info(f"Executive insight analysis completed in {execution_time}ms")
             return insight_result, execution_time, tokens_used
@@ -181,7 +225,7 @@ class ExecutiveInsightAnalyzer:
         except json.JSONDecodeError as e:
             logger.error(f"JSON parsing error in executive insight: {str(e)}")
             execution_time = int((time.time() - start_time) * 1000)
-            return self._generate_fallback_response(str(e)), execution_time, 0
+            return self._generate_fallback_response(str(e)), execution_time, usage["total_tokens"]
 
         except Exception as e:
             logger.error(f"Error in executive insight analysis: {str(e)}")
@@ -192,7 +236,8 @@ class ExecutiveInsightAnalyzer:
         self,
         document_text: str,
         metadata: Dict,
-        analysis_type: str
+        analysis_type: str,
+        tables: Optional[List[Dict]] = None
     ) -> str:
         """Build the analysis prompt with document context and dynamic truncation"""
 
@@ -204,10 +249,17 @@ class ExecutiveInsightAnalyzer:
         }
         max_chars = max_chars_map.get(analysis_type, 15000)
 
+        # Structured rows come first; the flattened text fills what is left
+        table_text = render_tables(tables or [], max_chars)
+        max_chars -= len(table_text)
+
         if len(document_text) > max_chars:
             document_text = document_text[:max_chars] + \
                 "\n\n[... dokumen terpotong karena keterbatasan panjang ...]"
 
+        if table_text:
+            document_text = f"### Tabel Terstruktur:\n{table_text}\n\n### Teks Dokumen:\n{document_text}"
+
         analysis_instructions = {
             "full": "Lakukan analisis LENGKAP mencakup semua aspek: executive summary, "
                    "top 3 risks dengan detail, financial exposure, sentiment analysis, dan executive card summary.",
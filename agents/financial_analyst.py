@@ -2,13 +2,22 @@
 Financial Analyst Agent for RAG Komite Audit System
 Senior Expert Financial Analyst
 """
+import asyncio
 import time
 import json
-from typing import Dict, List, Tuple, Optional
+from collections import Counter
+from typing import Any, Awaitable, Callable, Dict, List, Tuple, Optional
 import logging
+from backend.context_packer import build_windows
 
 logger = logging.getLogger(__name__)
 
+# Bump whenever prompts or the output schema change; cached results of other versions are not reused
+PROMPT_VERSION = "2"
+
+SEVERITY_ORDER = {"LOW": 0, "MEDIUM": 1, "HIGH": 2, "CRITICAL": 3}
+MAX_MERGED_ITEMS = 10
+
 FINANCIAL_ANALYST_PERSONA = """Anda adalah **Senior Expert Financial Analyst** dengan pengalaman 15+ tahun di bidang konsultansi keuangan dan audit.
 
 ## Profil Keahlian Anda:
@@ -98,6 +107,115 @@ Analisis dokumen keuangan berikut dan berikan laporan analisis komprehensif.
 4. Gunakan bahasa Indonesia profesional
 5. Output HARUS valid JSON"""
 
+REDUCE_SYSTEM_PROMPT = FINANCIAL_ANALYST_PERSONA + """
+
+## Tugas Anda Saat Ini:
+Anda menerima hasil analisis per bagian dari satu dokumen keuangan yang panjang.
+Susun executive summary untuk dokumen secara keseluruhan.
+
+## Format Output (WAJIB dalam JSON):
+{
+    "overview": "Ringkasan kondisi keuangan perusahaan dalam 2-3 paragraf",
+    "key_findings": ["Temuan utama 1", "Temuan utama 2", "Temuan utama 3"],
+    "overall_assessment": "STRONG/MODERATE/WEAK/CRITICAL",
+    "confidence_level": "HIGH/MEDIUM/LOW",
+    "overall_risk_level": "LOW/MEDIUM/HIGH/CRITICAL"
+}"""
+
+
+def _has_value(entry: Any) -> bool:
+    """Whether a ratio entry carries an actual figure"""
+    if not isinstance(entry, dict):
+        return False
+    value = str(entry.get("value") or "").strip()
+    return bool(value) and not value.upper().startswith("N/A")
+
+
+def _merge_lists(lists: List[Any], limit: Optional[int] = MAX_MERGED_ITEMS) -> List:
+    """Concatenate lists keeping the first occurrence of each (case-insensitive) item"""
+    seen = set()
+    merged = []
+    for items in lists:
+        for item in items if isinstance(items, list) else []:
+            key = json.dumps(item, sort_keys=True).lower() if not isinstance(item, str) else item.strip().lower()
+            if key and key not in seen:
+                seen.add(key)
+                merged.append(item)
+    return merged[:limit] if limit else merged
+
+
+def _most_common(values: List[Any], default: str) -> str:
+    values = [value for value in values if isinstance(value, str) and value]
+    return Counter(values).most_common(1)[0][0] if values else default
+
+
+def _highest_level(values: List[Any], default: str) -> str:
+    levels = [value for value in values if value in SEVERITY_ORDER]
+    return max(levels, key=SEVERITY_ORDER.get) if levels else default
+
+
+def merge_partial_analyses(partials: List[Dict]) -> Dict:
+    """
+    Merge per-window analyses into the single-analysis output schema
+    Ratios keep the first window that reports a figure; lists are deduplicated;
+    risk levels take the highest level reported by any window
+    """
+    def section(partial: Dict, name: str) -> Dict:
+        value = partial.get(name)
+        return value if isinstance(value, dict) else {}
+
+    summaries = [section(p, "executive_summary") for p in partials]
+    risks = [section(p, "risk_assessment") for p in partials]
+    recommendations = [section(p, "recommendations") for p in partials]
+    quality = [section(p, "data_quality_notes") for p in partials]
+
+    ratios: Dict[str, Dict] = {"profitability": {}, "liquidity": {}, "solvency": {}, "efficiency": {}}
+    for partial in partials:
+        for group, entries in section(partial, "financial_ratios").items():
+            if not isinstance(entries, dict):
+                continue
+            target = ratios.setdefault(group, {})
+            for name, entry in entries.items():
+                if name not in target or (not _has_value(target[name]) and _has_value(entry)):
+                    target[name] = entry
+
+    red_flags: List[Dict] = []
+    seen_flags = set()
+    for risk in risks:
+        for flag in risk.get("red_flags") or []:
+            if not isinstance(flag, dict):
+                continue
+            key = str(flag.get("description", "")).strip().lower()
+            if key and key not in seen_flags:
+                seen_flags.add(key)
+                red_flags.append(flag)
+    red_flags.sort(key=lambda flag: SEVERITY_ORDER.get(flag.get("severity"), -1), reverse=True)
+
+    return {
+        "executive_summary": {
+            "overview": "\n\n".join(s["overview"] for s in summaries if isinstance(s.get("overview"), str)),
+            "key_findings": _merge_lists([s.get("key_findings") for s in summaries]),
+            "overall_assessment": _most_common([s.get("overall_assessment") for s in summaries], "UNKNOWN"),
+            "confidence_level": _most_common([s.get("confidence_level") for s in summaries], "LOW")
+        },
+        "financial_ratios": ratios,
+        "risk_assessment": {
+            "overall_risk_level": _highest_level([r.get("overall_risk_level") for r in risks], "UNKNOWN"),
+            "red_flags": red_flags,
+            "positive_indicators": _merge_lists([r.get("positive_indicators") for r in risks]),
+            "areas_of_concern": _merge_lists([r.get("areas_of_concern") for r in risks])
+        },
+        "recommendations": {
+            key: _merge_lists([r.get(key) for r in recommendations])
+            for key in ("immediate_actions", "short_term", "long_term", "for_audit_committee")
+        },
+        "data_quality_notes": {
+            "completeness": _most_common([q.get("completeness") for q in quality], "LOW"),
+            "issues": _merge_lists([q.get("issues") for q in quality], limit=None),
+            "assumptions": _merge_lists([q.get("assumptions") for q in quality])
+        }
+    }
+
 
 class FinancialAnalyst:
     """
@@ -107,55 +225,72 @@ class FinancialAnalyst:
     def __init__(self):
         self.persona = FINANCIAL_ANALYST_PERSONA
         self.system_prompt = ANALYSIS_SYSTEM_PROMPT
+        self.prompt_version = PROMPT_VERSION
         logger.info("Financial Analyst Agent initialized")
 
     async def analyze_document(
         self,
         document_text: str,
         document_metadata: Dict,
-        analysis_type: str = "comprehensive"
+        analysis_type: str = "comprehensive",
+        progress: Callable[..., Awaitable[None]] = None
     ) -> Tuple[Dict, int, int]:
         """
         Analyze financial document and return structured analysis
+        Documents longer than one window are analysed window by window
+        (concurrently) and the partial results merged
 
         Args:
             document_text: Full text content of the document
             document_metadata: Document metadata (filename, type, etc.)
             analysis_type: Type of analysis (comprehensive, quick, ratio_only)
+            progress: Optional callback(stage, fraction, partial) for job progress
 
         Returns:
             Tuple of (analysis_result, execution_time_ms, tokens_used)
         """
         from backend.llm_client import llm_client
+        from backend.usage_tracker import usage_tracker
+        from config.config import settings
 
         start_time = time.time()
 
         try:
-            # Build the analysis prompt
-            analysis_prompt = self._build_analysis_prompt(
-                document_text,
-                document_metadata,
-                analysis_type
-            )
-
-            messages = [
-                {"role": "system", "content": self.system_prompt},
-                {"role": "user", "content": analysis_prompt}
-            ]
-
-            # Generate analysis with JSON mode
-            response = await llm_client.generate_completion(
-                messages=messages,
-                temperature=0.3,  # Lower temperature for factual analysis
-                max_tokens=4000,  # Longer response for comprehensive analysis
-                json_mode=True
-            )
-
-            # Parse JSON response
-            analysis_result = json.loads(response)
+            with usage_tracker.labels(agent="financial_analyst"), usage_tracker.collect() as usage:
+                windows = build_windows(document_text, settings.FINANCIAL_ANALYSIS_WINDOW_TOKENS)
+                if len(windows) > 1:
+                    analysis_result = await self._analyze_windows(
+                        windows, document_metadata, analysis_type, progress
+                    )
+                else:
+                    if progress is not None:
+                        await progress("analyzing", 0.1)
+
+                    # Build the analysis prompt
+                    analysis_prompt = self._build_analysis_prompt(
+                        document_text,
+                        document_metadata,
+                        analysis_type
+                    )
+
+                    messages = [
+                        {"role": "system", "content": self.system_prompt},
+                        {"role": "user", "content": analysis_prompt}
+                    ]
+
+                    # Generate analysis with JSON mode
+                    response = await llm_client.generate_completion(
+                        messages=messages,
+                        temperature=0.3,  # Lower temperature for factual analysis
+                        max_tokens=4000,  # Longer response for comprehensive analysis
+                        json_mode=True
+                    )
+
+                    # Parse JSON response
+                    analysis_result = json.loads(response)
 
             execution_time = int((time.time() - start_time) * 1000)
-            tokens_used = llm_client.count_tokens(response)
+            tokens_used = usage["total_tokens"]
 
             logger.info(f"Financial analysis completed in {execution_time}ms")
             return analysis_result, execution_time, tokens_used
@@ -163,13 +298,167 @@ class FinancialAnalyst:
         except json.JSONDecodeError as e:
             logger.error(f"JSON parsing error: {str(e)}")
             execution_time = int((time.time() - start_time) * 1000)
-            return self._generate_fallback_response(str(e)), execution_time, 0
+            return self._generate_fallback_response(str(e)), execution_time, usage["total_tokens"]
 
         except Exception as e:
             logger.error(f"Error in financial analysis: {str(e)}")
             execution_time = int((time.time() - start_time) * 1000)
             return self._generate_fallback_response(str(e)), execution_time, 0
 
+    async def _analyze_windows(
+        self,
+        windows: List[str],
+        metadata: Dict,
+        analysis_type: str,
+        progress: Callable[..., Awaitable[None]] = None
+    ) -> Dict:
+        """
+        Map: analyse each window concurrently; reduce: merge and summarise the partials
+        The merge of the windows finished so far is reported as a partial result
+        """
+        from backend.llm_client import llm_client
+        from config.config import settings
+
+        semaphore = asyncio.Semaphore(max(1, settings.FINANCIAL_ANALYSIS_CONCURRENCY))
+        finished: List[Optional[Dict]] = []
+
+        async def report(partial: Optional[Dict]):
+            finished.append(partial)
+            if progress is not None:
+                analyzed = [p for p in finished if p is not None]
+                await progress(
+                    f"analyzing window {len(finished)}/{len(windows)}",
+                    0.1 + 0.7 * len(finished) / len(windows),
+                    merge_partial_analyses(analyzed) if analyzed else None
+                )
+
+        async def analyze_window(index: int, window: str) -> Optional[Dict]:
+            async with semaphore:
+                try:
+                    response = await llm_client.generate_completion(
+                        messages=[
+                            {"role": "system", "content": self.system_prompt},
+                            {"role": "user", "content": self._build_window_prompt(
+                                window, index, len(windows), metadata, analysis_type
+                            )}
+                        ],
+                        temperature=0.3,
+                        max_tokens=settings.FINANCIAL_ANALYSIS_WINDOW_MAX_TOKENS,
+                        json_mode=True
+                    )
+                    partial = json.loads(response)
+                    partial = partial if isinstance(partial, dict) else None
+                except Exception as e:
+                    logger.warning(f"Analysis of section window {index + 1}/{len(windows)} failed: {str(e)}")
+                    partial = None
+            await report(partial)
+            return partial
+
+        partials = await asyncio.gather(*(analyze_window(i, window) for i, window in enumerate(windows)))
+        analyzed = [partial for partial in partials if partial is not None]
+        if not analyzed:
+            raise RuntimeError(f"All {len(windows)} section windows failed to analyse")
+
+        analysis_result = merge_partial_analyses(analyzed)
+        failed = [str(i + 1) for i, partial in enumerate(partials) if partial is None]
+        if failed:
+            analysis_result["data_quality_notes"]["issues"].append(
+                f"Bagian dokumen {', '.join(failed)} dari {len(windows)} tidak dapat dianalisis"
+            )
+
+        if progress is not None:
+            await progress("summarizing", 0.85)
+        summary = await self._summarize_windows(analysis_result, metadata)
+        if summary:
+            # The summary may raise the level merged from the windows, never lower it
+            overall_risk_level = summary.pop("overall_risk_level", None)
+            merged_level = analysis_result["risk_assessment"]["overall_risk_level"]
+            if overall_risk_level in SEVERITY_ORDER and \
+                    SEVERITY_ORDER[overall_risk_level] >= SEVERITY_ORDER.get(merged_level, -1):
+                analysis_result["risk_assessment"]["overall_risk_level"] = overall_risk_level
+            analysis_result["executive_summary"].update(
+                {k: v for k, v in summary.items() if k in analysis_result["executive_summary"] and v}
+            )
+        if failed:
+            analysis_result["executive_summary"]["confidence_level"] = "LOW"
+
+        analysis_result["analysis_coverage"] = {
+            "mode": "map_reduce",
+            "windows": len(windows),
+            "windows_analyzed": len(analyzed),
+            "partial_failure": bool(failed)
+        }
+        logger.info(f"Merged financial analysis of {len(analyzed)}/{len(windows)} section windows")
+        return analysis_result
+
+    async def _summarize_windows(self, merged: Dict, metadata: Dict) -> Optional[Dict]:
+        """Write one executive summary from the merged partial results (None on failure)"""
+        from backend.llm_client import llm_client
+        from backend.context_packer import truncate_to_tokens
+        from config.config import settings
+
+        summary = merged["executive_summary"]
+        red_flags = [
+            f"- [{flag.get('severity', '?')}] {flag.get('category', '?')}: {flag.get('description', '')}"
+            for flag in merged["risk_assessment"]["red_flags"]
+        ]
+        findings = "\n".join(f"- {finding}" for finding in summary["key_findings"])
+        digest = f"""## Ringkasan per Bagian:
+{summary["overview"]}
+
+## Temuan Utama:
+{findings}
+
+## Red Flags:
+{chr(10).join(red_flags) or "- Tidak ada"}"""
+
+        try:
+            response = await llm_client.generate_completion(
+                messages=[
+                    {"role": "system", "content": REDUCE_SYSTEM_PROMPT},
+                    {"role": "user", "content": f"""## Dokumen: {metadata.get('filename', 'Unknown')}
+
+{truncate_to_tokens(digest, settings.FINANCIAL_ANALYSIS_WINDOW_TOKENS)}
+
+Berikan output dalam format JSON sesuai template yang telah ditentukan."""}
+                ],
+                temperature=0.3,
+                max_tokens=1500,
+                json_mode=True
+            )
+            result = json.loads(response)
+            return result if isinstance(result, dict) else None
+        except Exception as e:
+            logger.warning(f"Executive summary of merged analysis failed, keeping merged summary: {str(e)}")
+            return None
+
+    def _build_window_prompt(
+        self,
+        window: str,
+        index: int,
+        total: int,
+        metadata: Dict,
+        analysis_type: str
+    ) -> str:
+        """Prompt for one section window of a long document"""
+        return f"""## Informasi Dokumen:
+- Nama File: {metadata.get('filename', 'Unknown')}
+- Tipe: {metadata.get('file_type', 'Unknown')}
+- Kategori: {metadata.get('category', 'Financial Document')}
+
+## Jenis Analisis: {analysis_type.upper()}
+Ini adalah BAGIAN {index + 1} dari {total} dokumen. Analisis hanya konten bagian ini;
+hasil semua bagian akan digabungkan. Isi rasio hanya jika angkanya tersedia di bagian
+ini, selain itu tulis "N/A - Data tidak tersedia". Jangan mengarang temuan di luar bagian ini.
+
+## Konten Bagian {index + 1}/{total}:
+---
+{window}
+---
+
+Berikan output dalam format JSON sesuai template yang telah ditentukan.
+Pastikan output adalah valid JSON yang bisa di-parse."""
+
     def _build_analysis_prompt(
         self,
         document_text: str,
@@ -2,17 +2,25 @@
 Multi-Agent System for RAG Komite Audit
 Implements specialized expert agents for different audit committee topics
 """
+import asyncio
 import time
-from typing import List, Dict, Optional, Tuple
+import numpy as np
+from typing import AsyncIterator, Awaitable, List, Dict, Optional, Tuple, TypeVar
 import logging
 from backend.llm_client import llm_client, glm_client
-from backend.embeddings import embedding_manager
+from backend.embeddings import embedding_service
+from backend.keyword_index import reciprocal_rank_fusion
+from backend.reranker import reranker
 from backend.database import db
+from backend.semantic_cache import semantic_cache
+from backend.usage_tracker import usage_tracker
 from config.config import settings, AGENT_ROLES, SYSTEM_PROMPTS
 
 logging.basicConfig(level=getattr(logging, settings.LOG_LEVEL))
 logger = logging.getLogger(__name__)
 
+T = TypeVar("T")
+
 class ExpertAgent:
     """Base class for expert agents"""
     
@@ -56,30 +64,51 @@ Format Jawaban:
     ) -> Tuple[str, int, int]:
         """
         Process query and return response
-        Returns: (response, execution_time_ms, tokens_used)
+        Returns: (response, execution_time_ms, tokens_used); tokens_used is
+        prompt + completion tokens as reported by the API
+        Raises on failure so the orchestrator records the agent as failed
+        instead of answering (and caching) the error text
         """
         start_time = time.time()
         
         try:
             system_prompt = self._build_system_prompt()
             
-            response = await llm_client.generate_with_context(
-                system_prompt=system_prompt,
-                user_query=query,
-                context=context,
-                conversation_history=conversation_history
-            )
+            with usage_tracker.labels(agent=self.agent_key), usage_tracker.collect() as usage:
+                response = await llm_client.generate_with_context(
+                    system_prompt=system_prompt,
+                    user_query=query,
+                    context=context,
+                    conversation_history=conversation_history
+                )
             
             execution_time = int((time.time() - start_time) * 1000)
-            tokens_used = llm_client.count_tokens(response)
+            tokens_used = usage["total_tokens"]
             
             logger.info(f"{self.name} processed query in {execution_time}ms")
             return response, execution_time, tokens_used
             
         except Exception as e:
             logger.error(f"Error in {self.name} processing: {str(e)}")
-            execution_time = int((time.time() - start_time) * 1000)
-            return f"Error processing query: {str(e)}", execution_time, 0
+            raise
+
+    async def stream_query(
+        self,
+        query: str,
+        context: List[str] = None,
+        conversation_history: List[Dict] = None,
+        usage: Dict[str, int] = None
+    ) -> AsyncIterator[str]:
+        """Stream response tokens as they arrive from the LLM (usage is filled at the end)"""
+        usage_tracker.set_labels(agent=self.agent_key)
+        async for token in llm_client.stream_with_context(
+            system_prompt=self._build_system_prompt(),
+            user_query=query,
+            context=context,
+            conversation_history=conversation_history,
+            usage=usage
+        ):
+            yield token
 
 class QueryRouter:
     """Routes queries to appropriate expert agents using GLM (with Groq fallback)"""
@@ -166,20 +195,56 @@ class AgentOrchestrator:
         filter_document_ids: List[str] = None
     ) -> Tuple[List[str], List[str], List[float]]:
         """
-        Retrieve relevant context from vector store
-        Returns: (contexts, document_ids, similarity_scores)
+        Retrieve relevant context from vector store, fused with BM25 keyword
+        hits (reciprocal rank fusion) when hybrid search is enabled, then
+        optionally reranked by a cross-encoder under a token budget
+        Returns: (contexts, document_ids, similarity_scores); keyword-only hits
+        are scored with the cosine similarity of their (cached) chunk embedding
         """
         try:
+            hybrid = db.use_keyword_index
+            rerank = settings.RERANK_ENABLED
+            candidates = top_k
+            if hybrid:
+                candidates = max(candidates, settings.HYBRID_CANDIDATES)
+            if rerank:
+                # Over-fetch with a looser threshold; the cross-encoder restores precision
+                candidates = max(candidates, settings.RERANK_CANDIDATES)
+                similarity_threshold = min(similarity_threshold, settings.RERANK_MIN_SIMILARITY)
+
             # Generate query embedding
-            query_embedding = embedding_manager.generate_embedding(query)
+            query_embedding = await embedding_service.embed(query)
 
             # Search similar chunks (with optional document filter)
             results = await db.similarity_search(
                 query_embedding=query_embedding,
                 match_threshold=similarity_threshold,
-                match_count=top_k,
+                match_count=candidates,
                 filter_document_ids=filter_document_ids
             )
+
+            if hybrid:
+                keyword_results = await db.keyword_search(
+                    query=query,
+                    match_count=candidates,
+                    filter_document_ids=filter_document_ids
+                )
+                results = reciprocal_rank_fusion(
+                    [results, keyword_results],
+                    k=settings.HYBRID_RRF_K
+                )
+            if rerank:
+                results = await reranker.rerank(
+                    query,
+                    results,
+                    top_n=top_k,
+                    max_tokens=settings.RERANK_MAX_CONTEXT_TOKENS,
+                    count_tokens=llm_client.count_tokens
+                )
+            else:
+                results = results[:top_k]
+            if hybrid:
+                await self._score_keyword_hits(query_embedding, results)
             
             if not results:
                 logger.warning("No context found for query")
@@ -192,7 +257,7 @@ class AgentOrchestrator:
             for result in results:
                 contexts.append(result["content"])
                 document_ids.append(result["document_id"])
-                similarity_scores.append(result["similarity"])
+                similarity_scores.append(result.get("similarity"))
             
             logger.info(f"Retrieved {len(contexts)} context chunks")
             return contexts, document_ids, similarity_scores
@@ -201,6 +266,208 @@ class AgentOrchestrator:
             logger.error(f"Error retrieving context: {str(e)}")
             return [], [], []
     
+    @staticmethod
+    async def _timed(stage: str, timings: Dict[str, int], awaitable: Awaitable[T]) -> T:
+        """Await a pipeline stage and record its wall-clock duration in ms"""
+        stage_start = time.time()
+        try:
+            return await awaitable
+        finally:
+            timings[stage] = int((time.time() - stage_start) * 1000)
+
+    async def _score_keyword_hits(self, query_embedding: np.ndarray, results: List[Dict]):
+        """Fill in the cosine similarity of keyword-only hits (vector hits already carry one)"""
+        keyword_only = [result for result in results if result.get("similarity") is None]
+        if not keyword_only:
+            return
+        # Chunk texts were embedded at ingestion, so these are embedding cache hits
+        vectors = await embedding_service.embed_many([result["content"] for result in keyword_only])
+        query = np.asarray(query_embedding, dtype=np.float32)
+        norms = np.maximum(np.linalg.norm(vectors, axis=1) * np.linalg.norm(query), 1e-12)
+        for result, similarity in zip(keyword_only, vectors @ query / norms):
+            result["similarity"] = float(similarity)
+
+    async def _run_agents(
+        self,
+        agent_keys: List[str],
+        query: str,
+        contexts: List[str],
+        conversation_history: List[Dict]
+    ) -> Tuple[Dict[str, str], List[Dict]]:
+        """
+        Query expert agents concurrently, each bounded by AGENT_TIMEOUT_SECONDS
+        Returns: (agent_responses, agent_logs) for agents that finished in time
+        """
+        agent_keys = [key for key in dict.fromkeys(agent_keys) if key in self.agents]
+        timeout = settings.AGENT_TIMEOUT_SECONDS
+
+        async def run_agent(agent: ExpertAgent) -> Tuple[str, int, int]:
+            return await asyncio.wait_for(
+                agent.process_query(
+                    query=query,
+                    context=contexts,
+                    conversation_history=conversation_history
+                ),
+                timeout=timeout
+            )
+
+        results = await asyncio.gather(
+            *(run_agent(self.agents[key]) for key in agent_keys),
+            return_exceptions=True
+        )
+
+        agent_responses = {}
+        agent_logs = []
+
+        for agent_key, result in zip(agent_keys, results):
+            agent = self.agents[agent_key]
+
+            if isinstance(result, asyncio.TimeoutError):
+                logger.warning(f"{agent.name} timed out after {timeout}s, skipping")
+                agent_logs.append({
+                    "agent_name": agent.name,
+                    "agent_key": agent_key,
+                    "execution_time_ms": int(timeout * 1000),
+                    "tokens_used": 0,
+                    "status": "timeout",
+                    "error_message": f"Timed out after {timeout}s"
+                })
+                continue
+
+            if isinstance(result, BaseException):
+                logger.error(f"{agent.name} failed: {str(result)}")
+                agent_logs.append({
+                    "agent_name": agent.name,
+                    "agent_key": agent_key,
+                    "execution_time_ms": 0,
+                    "tokens_used": 0,
+                    "status": "error",
+                    "error_message": str(result)
+                })
+                continue
+
+            response, exec_time, tokens = result
+            agent_responses[agent.name] = response
+            agent_logs.append({
+                "agent_name": agent.name,
+                "agent_key": agent_key,
+                "execution_time_ms": exec_time,
+                "tokens_used": tokens,
+                "status": "success"
+            })
+
+        return agent_responses, agent_logs
+
+    async def _serve_cached(
+        self,
+        cached: Dict,
+        query: str,
+        session_id: str,
+        start_time: float
+    ) -> Dict:
+        """Record a semantic cache hit as a conversation and return it"""
+        total_time = int((time.time() - start_time) * 1000)
+        metadata = cached.get("metadata", {})
+
+        conversation = await db.create_conversation(
+            session_id=session_id,
+            user_query=query,
+            agent_response=cached["response"],
+            agents_used=cached.get("agents_used", []),
+            context_documents=metadata.get("document_ids"),
+            similarity_scores=metadata.get("similarity_scores"),
+            processing_time_ms=total_time
+        )
+
+        logger.info(f"Query served from semantic cache in {total_time}ms")
+        return {
+            **cached,
+            "processing_time_ms": total_time,
+            "conversation_id": conversation["id"] if conversation else None
+        }
+
+    async def _prepare(
+        self,
+        query: str,
+        session_id: str,
+        use_context: bool,
+        max_agents: int,
+        filter_document_ids: Optional[List[str]],
+        stage_timings: Dict[str, int]
+    ) -> Dict:
+        """Route query, retrieve context and fetch history concurrently"""
+        prepare_start = time.time()
+
+        async def no_context() -> Tuple[List[str], List[str], List[float]]:
+            return [], [], []
+
+        routing, (contexts, document_ids, similarity_scores), conversation_history = await asyncio.gather(
+            self._timed("routing", stage_timings, self.router.route(query)),
+            self._timed(
+                "retrieval",
+                stage_timings,
+                self.retrieve_context(query, filter_document_ids=filter_document_ids)
+                if use_context else no_context()
+            ),
+            self._timed(
+                "history",
+                stage_timings,
+                db.get_conversation_history(session_id, limit=5)
+            )
+        )
+        stage_timings["prepare"] = int((time.time() - prepare_start) * 1000)
+
+        agents_to_query = [routing["primary_agent"]]
+        if routing.get("secondary_agents"):
+            agents_to_query.extend(routing["secondary_agents"][:max_agents-1])
+
+        return {
+            "routing": routing,
+            "contexts": contexts,
+            "document_ids": document_ids,
+            "similarity_scores": similarity_scores,
+            "conversation_history": conversation_history,
+            "agents_to_query": agents_to_query
+        }
+
+    async def _save_conversation(
+        self,
+        query: str,
+        session_id: str,
+        final_response: str,
+        agent_responses: Dict[str, str],
+        agent_logs: List[Dict],
+        document_ids: List[str],
+        similarity_scores: List[float],
+        total_time: int
+    ) -> Optional[Dict]:
+        """Save conversation and per-agent execution logs"""
+        conversation = await db.create_conversation(
+            session_id=session_id,
+            user_query=query,
+            agent_response=final_response,
+            agents_used=list(agent_responses.keys()),
+            context_documents=document_ids,
+            similarity_scores=similarity_scores,
+            processing_time_ms=total_time
+        )
+        
+        if conversation:
+            for log in agent_logs:
+                await db.log_agent_execution(
+                    conversation_id=conversation["id"],
+                    agent_name=log["agent_name"],
+                    agent_role=log["agent_key"],
+                    input_text=query,
+                    output_text=agent_responses.get(log["agent_name"], ""),
+                    execution_time_ms=log["execution_time_ms"],
+                    tokens_used=log["tokens_used"],
+                    status=log["status"],
+                    error_message=log.get("error_message")
+                )
+
+        return conversation
+
     async def process_query(
         self,
         query: str,
@@ -216,89 +483,78 @@ class AgentOrchestrator:
         Args:
             filter_document_ids: Optional list of document IDs to limit context search
         """
+        with usage_tracker.labels(session_id=session_id):
+            return await self._process_query(
+                query, session_id, use_context, max_agents, filter_document_ids
+            )
+
+    async def _process_query(
+        self,
+        query: str,
+        session_id: str,
+        use_context: bool,
+        max_agents: int,
+        filter_document_ids: Optional[List[str]]
+    ) -> Dict:
+        """Body of process_query, run with the session's usage labels set"""
         start_time = time.time()
 
         try:
-            # Step 1: Route query
             logger.info(f"Processing query: {query[:100]}...")
-            routing = await self.router.route(query)
+            stage_timings = {}
 
-            # Step 2: Retrieve context if enabled
-            contexts = []
-            document_ids = []
-            similarity_scores = []
+            # Step 0: Serve near-identical questions from the semantic answer cache
+            if settings.SEMANTIC_CACHE_ENABLED:
+                corpus_version = semantic_cache.corpus_version
+                cache_scope = semantic_cache.scope_key(filter_document_ids, use_context, max_agents)
+                query_embedding = await embedding_service.embed(query)
+                cached = semantic_cache.lookup(query_embedding, cache_scope)
+                if cached:
+                    return await self._serve_cached(cached, query, session_id, start_time)
 
-            if use_context:
-                contexts, document_ids, similarity_scores = await self.retrieve_context(
-                    query,
-                    filter_document_ids=filter_document_ids
-                )
-            
-            # Step 3: Get conversation history
-            conversation_history = await db.get_conversation_history(session_id, limit=5)
+            # Steps 1-3: Route query, retrieve context and fetch history concurrently
+            prepared = await self._prepare(
+                query, session_id, use_context, max_agents, filter_document_ids, stage_timings
+            )
+            routing = prepared["routing"]
+            contexts = prepared["contexts"]
+            document_ids = prepared["document_ids"]
+            similarity_scores = prepared["similarity_scores"]
             
             # Step 4: Query relevant agents
-            agents_to_query = [routing["primary_agent"]]
-            if routing.get("secondary_agents"):
-                agents_to_query.extend(routing["secondary_agents"][:max_agents-1])
-            
-            agent_responses = {}
-            agent_logs = []
-            
-            for agent_key in agents_to_query:
-                if agent_key in self.agents:
-                    agent = self.agents[agent_key]
-                    response, exec_time, tokens = await agent.process_query(
-                        query=query,
-                        context=contexts,
-                        conversation_history=conversation_history
-                    )
-                    agent_responses[agent.name] = response
-                    agent_logs.append({
-                        "agent_name": agent.name,
-                        "agent_key": agent_key,
-                        "execution_time_ms": exec_time,
-                        "tokens_used": tokens,
-                        "status": "success"
-                    })
+            agent_responses, agent_logs = await self._timed(
+                "agents",
+                stage_timings,
+                self._run_agents(
+                    prepared["agents_to_query"],
+                    query=query,
+                    contexts=contexts,
+                    conversation_history=prepared["conversation_history"]
+                )
+            )
             
             # Step 5: Synthesize responses if multiple agents
             if len(agent_responses) > 1:
-                final_response = await self.synthesizer.synthesize(query, agent_responses)
+                final_response = await self._timed(
+                    "synthesis",
+                    stage_timings,
+                    self.synthesizer.synthesize(query, agent_responses)
+                )
             else:
                 final_response = list(agent_responses.values())[0] if agent_responses else "Maaf, tidak dapat memproses pertanyaan."
             
             # Step 6: Calculate total processing time
             total_time = int((time.time() - start_time) * 1000)
             
-            # Step 7: Save to database
-            conversation = await db.create_conversation(
-                session_id=session_id,
-                user_query=query,
-                agent_response=final_response,
-                agents_used=list(agent_responses.keys()),
-                context_documents=document_ids,
-                similarity_scores=similarity_scores,
-                processing_time_ms=total_time
+            # Steps 7-8: Save conversation and log agent executions
+            conversation = await self._save_conversation(
+                query, session_id, final_response, agent_responses, agent_logs,
+                document_ids, similarity_scores, total_time
             )
             
-            # Step 8: Log agent executions
-            if conversation:
-                for log in agent_logs:
-                    await db.log_agent_execution(
-                        conversation_id=conversation["id"],
-                        agent_name=log["agent_name"],
-                        agent_role=log["agent_key"],
-                        input_text=query,
-                        output_text=agent_responses.get(log["agent_name"], ""),
-                        execution_time_ms=log["execution_time_ms"],
-                        tokens_used=log["tokens_used"],
-                        status=log["status"]
-                    )
-            
             logger.info(f"Query processed successfully in {total_time}ms")
             
-            return {
+            result = {
                 "success": True,
                 "response": final_response,
                 "agents_used": list(agent_responses.keys()),
@@ -309,9 +565,17 @@ class AgentOrchestrator:
                 "metadata": {
                     "document_ids": document_ids,
                     "similarity_scores": similarity_scores,
-                    "agent_responses": agent_responses if len(agent_responses) > 1 else None
+                    "agent_responses": agent_responses if len(agent_responses) > 1 else None,
+                    "stage_timings_ms": stage_timings
                 }
             }
+
+            if settings.SEMANTIC_CACHE_ENABLED and agent_logs and all(
+                log["status"] == "success" for log in agent_logs
+            ):
+                semantic_cache.store(query, query_embedding, cache_scope, result, corpus_version)
+
+            return result
             
         except Exception as e:
             logger.error(f"Error processing query: {str(e)}")
@@ -322,5 +586,168 @@ class AgentOrchestrator:
                 "error": str(e)
             }
 
+    async def stream_query(
+        self,
+        query: str,
+        session_id: str,
+        use_context: bool = True,
+        max_agents: int = 2,
+        filter_document_ids: List[str] = None
+    ) -> AsyncIterator[Dict]:
+        """
+        Stream query processing as events:
+        routing -> sources -> token (repeated) -> done (or error)
+
+        A single agent streams its own answer; with multiple agents the
+        agents run concurrently and the synthesis is streamed.
+        """
+        start_time = time.time()
+
+        try:
+            logger.info(f"Streaming query: {query[:100]}...")
+            stage_timings = {}
+            # Generator: labels are set for the rest of this request instead of a with-block
+            usage_tracker.set_labels(session_id=session_id)
+
+            if settings.SEMANTIC_CACHE_ENABLED:
+                corpus_version = semantic_cache.corpus_version
+                cache_scope = semantic_cache.scope_key(filter_document_ids, use_context, max_agents)
+                query_embedding = await embedding_service.embed(query)
+                cached = semantic_cache.lookup(query_embedding, cache_scope)
+                if cached:
+                    result = await self._serve_cached(cached, query, session_id, start_time)
+                    metadata = result.get("metadata", {})
+                    yield {"event": "routing", "data": {
+                        "agents": result.get("agents_used", []),
+                        "reasoning": result.get("routing_reasoning", "")
+                    }}
+                    yield {"event": "sources", "data": {
+                        "document_ids": metadata.get("document_ids", []),
+                        "similarity_scores": metadata.get("similarity_scores", []),
+                        "context_count": result.get("context_count", 0)
+                    }}
+                    yield {"event": "token", "data": {"text": result["response"]}}
+                    yield {"event": "done", "data": {
+                        "agents_used": result.get("agents_used", []),
+                        "processing_time_ms": result["processing_time_ms"],
+                        "conversation_id": result.get("conversation_id"),
+                        "cache": result.get("cache")
+                    }}
+                    return
+
+            prepared = await self._prepare(
+                query, session_id, use_context, max_agents, filter_document_ids, stage_timings
+            )
+            routing = prepared["routing"]
+            contexts = prepared["contexts"]
+            agent_keys = [key for key in dict.fromkeys(prepared["agents_to_query"]) if key in self.agents]
+
+            yield {"event": "routing", "data": {
+                "agents": [self.agents[key].name for key in agent_keys],
+                "reasoning": routing.get("reasoning", "")
+            }}
+            yield {"event": "sources", "data": {
+                "document_ids": prepared["document_ids"],
+                "similarity_scores": prepared["similarity_scores"],
+                "context_count": len(contexts)
+            }}
+
+            tokens: List[str] = []
+            agent_responses: Dict[str, str] = {}
+            agent_logs: List[Dict] = []
+            stream_start = time.time()
+
+            if len(agent_keys) == 1:
+                agent = self.agents[agent_keys[0]]
+                usage: Dict[str, int] = {}
+                async for token in agent.stream_query(
+                    query=query,
+                    context=contexts,
+                    conversation_history=prepared["conversation_history"],
+                    usage=usage
+                ):
+                    if not tokens:
+                        stage_timings["first_token"] = int((time.time() - start_time) * 1000)
+                    tokens.append(token)
+                    yield {"event": "token", "data": {"text": token}}
+
+                agent_responses[agent.name] = "".join(tokens)
+                agent_logs.append({
+                    "agent_name": agent.name,
+                    "agent_key": agent.agent_key,
+                    "execution_time_ms": int((time.time() - stream_start) * 1000),
+                    "tokens_used": usage.get("total_tokens", 0),
+                    "status": "success"
+                })
+            else:
+                agent_responses, agent_logs = await self._timed(
+                    "agents",
+                    stage_timings,
+                    self._run_agents(
+                        agent_keys,
+                        query=query,
+                        contexts=contexts,
+                        conversation_history=prepared["conversation_history"]
+                    )
+                )
+                if len(agent_responses) > 1:
+                    token_stream = llm_client.stream_synthesis(
+                        query=query,
+                        agent_responses=agent_responses,
+                        system_prompt=self.synthesizer.system_prompt
+                    )
+                    async for token in token_stream:
+                        if not tokens:
+                            stage_timings["first_token"] = int((time.time() - start_time) * 1000)
+                        tokens.append(token)
+                        yield {"event": "token", "data": {"text": token}}
+                else:
+                    fallback = list(agent_responses.values())[0] if agent_responses else "Maaf, tidak dapat memproses pertanyaan."
+                    tokens.append(fallback)
+                    yield {"event": "token", "data": {"text": fallback}}
+
+            final_response = "".join(tokens)
+            total_time = int((time.time() - start_time) * 1000)
+
+            conversation = await self._save_conversation(
+                query, session_id, final_response, agent_responses, agent_logs,
+                prepared["document_ids"], prepared["similarity_scores"], total_time
+            )
+            conversation_id = conversation["id"] if conversation else None
+
+            if settings.SEMANTIC_CACHE_ENABLED and agent_logs and all(
+                log["status"] == "success" for log in agent_logs
+            ):
+                semantic_cache.store(query, query_embedding, cache_scope, {
+                    "success": True,
+                    "response": final_response,
+                    "agents_used": list(agent_responses.keys()),
+                    "routing_reasoning": routing.get("reasoning", ""),
+                    "context_count": len(contexts),
+                    "processing_time_ms": total_time,
+                    "conversation_id": conversation_id,
+                    "metadata": {
+                        "document_ids": prepared["document_ids"],
+                        "similarity_scores": prepared["similarity_scores"],
+                        "agent_responses": agent_responses if len(agent_responses) > 1 else None,
+                        "stage_timings_ms": stage_timings
+                    }
+                }, corpus_version)
+
+            logger.info(f"Streamed query processed in {total_time}ms")
+            yield {"event": "done", "data": {
+                "agents_used": list(agent_responses.keys()),
+                "processing_time_ms": total_time,
+                "conversation_id": conversation_id,
+                "stage_timings_ms": stage_timings
+            }}
+
+        except Exception as e:
+            logger.error(f"Error streaming query: {str(e)}")
+            yield {"event": "error", "data": {
+                "error": str(e),
+                "response": f"Terjadi kesalahan dalam memproses pertanyaan: {str(e)}"
+            }}
+
 # Global orchestrator instance
 orchestrator = AgentOrchestrator()
@@ -2,13 +2,20 @@
 Risk-Audit Mapper Agent for RAG Komite Audit System
 Strategic Risk-to-Audit Mapping & Gap Analysis
 """
+import asyncio
 import time
 import json
-from typing import Dict, List, Tuple, Optional
+import re
+from typing import Awaitable, Callable, Dict, List, Optional, Tuple
+import numpy as np
 import logging
+from backend.context_packer import build_windows
 
 logger = logging.getLogger(__name__)
 
+# Bump whenever prompts or the output schema change; cached results of other versions are not reused
+PROMPT_VERSION = "3"
+
 RISK_AUDIT_MAPPER_PERSONA = """Anda adalah **Senior Risk & Audit Strategy Consultant** dengan pengalaman 20+ tahun di bidang internal audit, enterprise risk management, dan tata kelola perusahaan di Indonesia.
 
 ## Profil Keahlian Anda:
@@ -30,23 +37,8 @@ RISK_AUDIT_MAPPER_PERSONA = """Anda adalah **Senior Risk & Audit Strategy Consul
 3. **Priority-Driven**: Prioritas berdasarkan severity risiko dan ketersediaan sumber daya audit
 4. **Strategic Alignment**: Memastikan PKPT selaras dengan profil risiko organisasi"""
 
-RISK_MAPPING_SYSTEM_PROMPT = RISK_AUDIT_MAPPER_PERSONA + """
-
-## Tugas Anda Saat Ini:
-Analisis dokumen Risk Register dan PKPT (Program Kerja Pengawasan Tahunan) berikut, lalu petakan risiko terhadap program audit untuk mengidentifikasi gap strategis.
-
-## Format Output (WAJIB dalam JSON):
-{
-    "executive_summary": {
-        "overview": "Ringkasan hasil pemetaan risiko terhadap audit plan dalam 2-3 paragraf",
-        "total_risks_identified": 0,
-        "total_audit_programs": 0,
-        "coverage_percentage": "X%",
-        "critical_gaps_count": 0,
-        "overall_alignment": "STRONG/MODERATE/WEAK/CRITICAL",
-        "confidence_level": "HIGH/MEDIUM/LOW"
-    },
-    "risk_register_summary": [
+RISK_RECORD_SCHEMA = """{
+    "risks": [
         {
             "risk_id": "R-001",
             "risk_name": "Nama risiko",
@@ -57,8 +49,11 @@ Analisis dokumen Risk Register dan PKPT (Program Kerja Pengawasan Tahunan) berik
             "risk_owner": "Unit/departemen pemilik risiko",
             "existing_controls": "Deskripsi kontrol yang ada"
         }
-    ],
-    "audit_plan_summary": [
+    ]
+}"""
+
+AUDIT_RECORD_SCHEMA = """{
+    "audit_programs": [
         {
             "audit_id": "A-001",
             "audit_name": "Nama program audit",
@@ -68,50 +63,51 @@ Analisis dokumen Risk Register dan PKPT (Program Kerja Pengawasan Tahunan) berik
             "audit_objective": "Tujuan audit",
             "estimated_days": 0
         }
-    ],
-    "coverage_matrix": [
+    ]
+}"""
+
+# kind -> (what to extract, output schema, list key in the output)
+EXTRACTION_TARGETS = {
+    "risk": ("risiko dari Risk Register", RISK_RECORD_SCHEMA, "risks"),
+    "audit": ("program audit dari PKPT", AUDIT_RECORD_SCHEMA, "audit_programs")
+}
+
+# kind -> (id field, name field, prefix for generated ids)
+RECORD_FIELDS = {
+    "risk": ("risk_id", "risk_name", "R"),
+    "audit": ("audit_id", "audit_name", "A")
+}
+
+COVERAGE_SYSTEM_PROMPT = RISK_AUDIT_MAPPER_PERSONA + """
+
+## Tugas Anda Saat Ini:
+Untuk setiap risiko, nilai apakah program audit KANDIDAT yang diberikan benar-benar mencakup risiko tersebut.
+Hanya gunakan audit_id dari daftar kandidat risiko itu sendiri.
+
+## Format Output (WAJIB dalam JSON):
+{
+    "mappings": [
         {
             "risk_id": "R-001",
-            "risk_name": "Nama risiko",
-            "risk_level": "LOW/MEDIUM/HIGH/CRITICAL",
-            "mapped_audit_ids": ["A-001", "A-003"],
-            "mapped_audit_names": ["Audit X", "Audit Y"],
+            "mapped_audit_ids": ["A-001"],
             "coverage_status": "FULLY_COVERED/PARTIALLY_COVERED/NOT_COVERED",
             "coverage_quality": "DIRECT/INDIRECT/TANGENTIAL",
-            "coverage_notes": "Penjelasan bagaimana audit mencakup risiko ini"
+            "coverage_notes": "Penjelasan bagaimana audit mencakup risiko ini",
+            "coverage_gap": "Aspek risiko yang belum tercakup (kosong jika tercakup penuh)",
+            "potential_impact": "Dampak jika gap tidak ditangani",
+            "recommendation": "Rekomendasi program audit baru atau peningkatan cakupan"
         }
-    ],
-    "gap_analysis": {
-        "uncovered_risks": [
-            {
-                "risk_id": "R-005",
-                "risk_name": "Nama risiko",
-                "risk_level": "HIGH/CRITICAL",
-                "gap_severity": "CRITICAL/HIGH/MEDIUM/LOW",
-                "reason": "Penjelasan mengapa risiko ini tidak tercakup",
-                "potential_impact": "Dampak jika risiko tidak diaudit",
-                "recommended_audit_response": "Rekomendasi program audit yang perlu ditambahkan"
-            }
-        ],
-        "partially_covered_risks": [
-            {
-                "risk_id": "R-003",
-                "risk_name": "Nama risiko",
-                "risk_level": "HIGH",
-                "current_coverage": "Penjelasan cakupan saat ini",
-                "coverage_gap": "Aspek yang belum tercakup",
-                "recommended_enhancement": "Rekomendasi peningkatan cakupan"
-            }
-        ],
-        "over_audited_areas": [
-            {
-                "area": "Nama area/risiko",
-                "audit_count": 0,
-                "mapped_audits": ["A-001", "A-002"],
-                "recommendation": "Rekomendasi optimasi"
-            }
-        ]
-    },
+    ]
+}"""
+
+SUMMARY_SYSTEM_PROMPT = RISK_AUDIT_MAPPER_PERSONA + """
+
+## Tugas Anda Saat Ini:
+Berdasarkan hasil pemetaan risiko terhadap PKPT berikut, susun ringkasan eksekutif dan rekomendasi.
+
+## Format Output (WAJIB dalam JSON):
+{
+    "overview": "Ringkasan hasil pemetaan risiko terhadap audit plan dalam 2-3 paragraf",
     "recommendations": {
         "immediate_actions": [
             {
@@ -122,34 +118,115 @@ Analisis dokumen Risk Register dan PKPT (Program Kerja Pengawasan Tahunan) berik
                 "rationale": "Alasan prioritas"
             }
         ],
-        "pkpt_adjustments": [
-            "Rekomendasi penyesuaian PKPT"
-        ],
-        "resource_optimization": [
-            "Rekomendasi optimasi sumber daya audit"
-        ],
-        "for_audit_committee": [
-            "Rekomendasi spesifik untuk Komite Audit"
-        ]
-    },
-    "data_quality_notes": {
-        "risk_register_completeness": "HIGH/MEDIUM/LOW",
-        "audit_plan_completeness": "HIGH/MEDIUM/LOW",
-        "mapping_confidence": "HIGH/MEDIUM/LOW",
-        "issues": ["Catatan tentang keterbatasan data"],
-        "assumptions": ["Asumsi yang digunakan dalam analisis"]
+        "pkpt_adjustments": ["Rekomendasi penyesuaian PKPT"],
+        "resource_optimization": ["Rekomendasi optimasi sumber daya audit"],
+        "for_audit_committee": ["Rekomendasi spesifik untuk Komite Audit"]
     }
-}
+}"""
+
+LEVEL_ORDER = {"LOW": 0, "MEDIUM": 1, "HIGH": 2, "CRITICAL": 3}
+SCALE_SCORES = {"LOW": 1, "MEDIUM": 2, "HIGH": 3, "VERY_HIGH": 4}
+COVERAGE_STATUSES = ("FULLY_COVERED", "PARTIALLY_COVERED", "NOT_COVERED")
+# Risks whose judgment failed or was omitted; not a gap, excluded from coverage figures
+NOT_ASSESSED = "NOT_ASSESSED"
+OVER_AUDIT_THRESHOLD = 3
+
 
-## Instruksi Penting:
-1. Ekstrak SEMUA risiko dari Risk Register dan SEMUA program audit dari PKPT
-2. Petakan setiap risiko terhadap program audit yang relevan
-3. Identifikasi risiko yang tidak tercakup (terutama risiko HIGH dan CRITICAL)
-4. Perhatikan kualitas cakupan: langsung (direct) vs tidak langsung (indirect)
-5. Prioritaskan rekomendasi berdasarkan severity gap
-6. Jika data tidak lengkap, catat di data_quality_notes
-7. Gunakan bahasa Indonesia profesional
-8. Output HARUS valid JSON"""
+class NoRecordsError(ValueError):
+    """The risk register yields no records to map; rerunning will not change that"""
+
+
+def normalize_records(records: List[Dict], id_field: str, name_field: str, prefix: str) -> List[Dict]:
+    """
+    Deduplicate extracted records (windows overlap) by (id, name), or by name
+    for records without an id. Ids are not unique on their own: the LLM restarts
+    numbering per window and sheets restart their "No" column, so a record whose
+    id is already taken by a differently named record gets a fresh sequential
+    id, as do records without one
+    """
+    unique: List[Dict] = []
+    seen_pairs = set()
+    seen_names = set()
+    for record in records:
+        if not isinstance(record, dict):
+            continue
+        name = re.sub(r"\s+", " ", str(record.get(name_field) or "")).strip()
+        if not name:
+            continue
+        record_id = str(record.get(id_field) or "").strip()
+        name_key = name.lower()
+        if (record_id.upper(), name_key) in seen_pairs or (not record_id and name_key in seen_names):
+            continue
+        seen_pairs.add((record_id.upper(), name_key))
+        seen_names.add(name_key)
+        unique.append({**record, id_field: record_id, name_field: name})
+
+    # The first record keeps a shared id; later ones are renumbered
+    used_ids = set()
+    for record in unique:
+        if record[id_field].upper() in used_ids:
+            record[id_field] = ""
+        elif record[id_field]:
+            used_ids.add(record[id_field].upper())
+
+    counter = 0
+    for record in unique:
+        if record[id_field]:
+            continue
+        while True:
+            counter += 1
+            candidate = f"{prefix}-{counter:03d}"
+            if candidate.upper() not in used_ids:
+                break
+        record[id_field] = candidate
+        used_ids.add(candidate.upper())
+    return unique
+
+
+def risk_level(risk: Dict) -> str:
+    """Inherent risk level as given, else derived from likelihood x impact"""
+    level = str(risk.get("inherent_risk_level") or "").upper()
+    if level in LEVEL_ORDER:
+        return level
+    score = SCALE_SCORES.get(str(risk.get("likelihood") or "").upper(), 0) * \
+        SCALE_SCORES.get(str(risk.get("impact") or "").upper(), 0)
+    if not score:
+        return "MEDIUM"
+    if score >= 12:
+        return "CRITICAL"
+    if score >= 6:
+        return "HIGH"
+    return "MEDIUM" if score >= 3 else "LOW"
+
+
+def similarity_matrix(risk_vectors: np.ndarray, audit_vectors: np.ndarray) -> np.ndarray:
+    """Cosine similarity of every risk (rows) against every audit program (columns)"""
+    def normalize(vectors: np.ndarray) -> np.ndarray:
+        vectors = np.asarray(vectors, dtype=np.float32)
+        norms = np.linalg.norm(vectors, axis=1, keepdims=True)
+        return vectors / np.maximum(norms, 1e-12)
+
+    return normalize(risk_vectors) @ normalize(audit_vectors).T
+
+
+def candidate_pairs(
+    similarity: np.ndarray,
+    top_k: int,
+    min_similarity: float
+) -> List[List[Tuple[int, float]]]:
+    """For each risk, the top_k most similar audit programs above min_similarity (best first)"""
+    if similarity.size == 0 or top_k <= 0:
+        return [[] for _ in range(similarity.shape[0])]
+    k = min(top_k, similarity.shape[1])
+    top = np.argpartition(-similarity, k - 1, axis=1)[:, :k]
+    scores = np.take_along_axis(similarity, top, axis=1)
+    order = np.argsort(-scores, axis=1)
+    top = np.take_along_axis(top, order, axis=1)
+    scores = np.take_along_axis(scores, order, axis=1)
+    return [
+        [(int(j), float(score)) for j, score in zip(row, row_scores) if score >= min_similarity]
+        for row, row_scores in zip(top, scores)
+    ]
 
 
 class RiskAuditMapper:
@@ -160,7 +237,7 @@ class RiskAuditMapper:
 
     def __init__(self):
         self.persona = RISK_AUDIT_MAPPER_PERSONA
-        self.system_prompt = RISK_MAPPING_SYSTEM_PROMPT
+        self.prompt_version = PROMPT_VERSION
         logger.info("Risk Audit Mapper Agent initialized")
 
     async def analyze_mapping(
@@ -169,10 +246,15 @@ class RiskAuditMapper:
         audit_plan_text: str,
         risk_register_metadata: Dict,
         audit_plan_metadata: Dict,
-        mapping_type: str = "comprehensive"
+        mapping_type: str = "comprehensive",
+        risk_records: List[Dict] = None,
+        audit_records: List[Dict] = None,
+        progress: Callable[..., Awaitable[None]] = None
     ) -> Tuple[Dict, int, int]:
         """
         Analyze risk register against audit plan and return gap analysis
+        Both documents are extracted into records window by window; each risk is
+        only judged against its most similar audit programs, in concurrent batches
 
         Args:
             risk_register_text: Full text of risk register document
@@ -180,122 +262,472 @@ class RiskAuditMapper:
             risk_register_metadata: Risk register document metadata
             audit_plan_metadata: Audit plan document metadata
             mapping_type: Type of mapping (comprehensive, quick, gap_only)
+            risk_records: Structured risk register rows; skips LLM extraction of the risk register
+            audit_records: Structured PKPT rows; skips LLM extraction of the audit plan
+            progress: Optional callback(stage, fraction, partial) for job progress
 
         Returns:
             Tuple of (mapping_result, execution_time_ms, tokens_used)
         """
-        from backend.llm_client import llm_client
+        from backend.usage_tracker import usage_tracker
+        from config.config import settings
 
         start_time = time.time()
+        issues: List[str] = []
 
-        try:
-            analysis_prompt = self._build_mapping_prompt(
-                risk_register_text,
-                audit_plan_text,
-                risk_register_metadata,
-                audit_plan_metadata,
-                mapping_type
-            )
-
-            messages = [
-                {"role": "system", "content": self.system_prompt},
-                {"role": "user", "content": analysis_prompt}
-            ]
-
-            max_tokens_map = {
-                "comprehensive": 4000,
-                "quick": 2000,
-                "gap_only": 2500
-            }
-
-            response = await llm_client.generate_completion(
-                messages=messages,
-                temperature=0.3,
-                max_tokens=max_tokens_map.get(mapping_type, 4000),
-                json_mode=True
-            )
+        async def report(stage: str, fraction: float, partial: Dict = None):
+            if progress is not None:
+                await progress(stage, fraction, partial)
 
-            mapping_result = json.loads(response)
+        try:
+            with usage_tracker.labels(agent="risk_audit_mapper"), usage_tracker.collect() as usage:
+                await report("extracting records", 0.05)
+                semaphore = asyncio.Semaphore(max(1, settings.RISK_MAPPING_CONCURRENCY))
+                risks, audits = await asyncio.gather(
+                    self._records(
+                        "risk", risk_records, risk_register_text, risk_register_metadata, semaphore, issues
+                    ),
+                    self._records(
+                        "audit", audit_records, audit_plan_text, audit_plan_metadata, semaphore, issues
+                    )
+                )
+                if not risks:
+                    if issues:
+                        # Extraction calls failed; a later attempt may succeed
+                        raise RuntimeError("Risk register extraction failed")
+                    raise NoRecordsError("No risks could be extracted from the risk register")
+
+                in_scope = risks
+                if mapping_type == "quick":
+                    in_scope = [risk for risk in risks if risk_level(risk) in ("HIGH", "CRITICAL")] or risks
+
+                await report("finding candidates", 0.35, {"risk_register_summary": risks, "audit_plan_summary": audits})
+                candidates = await self._find_candidates(in_scope, audits)
+                judgments = await self._judge_coverage(
+                    in_scope, audits, candidates, semaphore, issues,
+                    on_batch=lambda done, total: report(f"judging coverage {done}/{total}", 0.4 + 0.4 * done / total)
+                )
+                mapping_result = self._assemble(risks, audits, in_scope, judgments, mapping_type, issues)
+                # The computed overview is complete apart from the LLM-written summary
+                await report("summarizing", 0.85, mapping_result)
+                await self._summarize(mapping_result, risk_register_metadata, audit_plan_metadata)
 
             execution_time = int((time.time() - start_time) * 1000)
-            tokens_used = llm_client.count_tokens(response)
+            tokens_used = usage["total_tokens"]
 
-            logger.info(f"Risk-audit mapping completed in {execution_time}ms")
+            logger.info(
+                f"Risk-audit mapping of {len(risks)} risks x {len(audits)} audit programs "
+                f"completed in {execution_time}ms"
+            )
             return mapping_result, execution_time, tokens_used
 
-        except json.JSONDecodeError as e:
-            logger.error(f"JSON parsing error in risk mapping: {str(e)}")
+        except NoRecordsError as e:
+            logger.error(f"Risk-audit mapping has no input: {str(e)}")
             execution_time = int((time.time() - start_time) * 1000)
-            return self._generate_fallback_response(str(e)), execution_time, 0
+            return self._generate_fallback_response(str(e), retryable=False), execution_time, 0
 
         except Exception as e:
             logger.error(f"Error in risk-audit mapping: {str(e)}")
             execution_time = int((time.time() - start_time) * 1000)
             return self._generate_fallback_response(str(e)), execution_time, 0
 
-    def _build_mapping_prompt(
+    async def _records(
         self,
-        risk_register_text: str,
-        audit_plan_text: str,
-        risk_metadata: Dict,
-        audit_metadata: Dict,
-        mapping_type: str
-    ) -> str:
-        """Build the mapping analysis prompt with both document contexts"""
-
-        max_chars_map = {
-            "comprehensive": 12000,
-            "quick": 5000,
-            "gap_only": 7000
-        }
-        max_chars_per_doc = max_chars_map.get(mapping_type, 12000)
-        if len(risk_register_text) > max_chars_per_doc:
-            risk_register_text = risk_register_text[:max_chars_per_doc] + \
-                "\n\n[... dokumen terpotong karena keterbatasan panjang ...]"
-        if len(audit_plan_text) > max_chars_per_doc:
-            audit_plan_text = audit_plan_text[:max_chars_per_doc] + \
-                "\n\n[... dokumen terpotong karena keterbatasan panjang ...]"
-
-        mapping_instructions = {
-            "comprehensive": "Lakukan pemetaan LENGKAP mencakup semua aspek: executive summary, "
-                           "coverage matrix, gap analysis, dan rekomendasi detail.",
-            "quick": "Lakukan pemetaan CEPAT dengan fokus pada risiko HIGH/CRITICAL yang tidak "
-                   "tercakup. Summary dan rekomendasi boleh ringkas.",
-            "gap_only": "Fokus pada IDENTIFIKASI GAP saja. Tampilkan hanya risiko yang "
-                      "NOT_COVERED dan PARTIALLY_COVERED."
-        }
-
-        prompt = f"""## Dokumen 1: Risk Register
-- Nama File: {risk_metadata.get('filename', 'Unknown')}
-- Tipe: {risk_metadata.get('file_type', 'Unknown')}
-- Kategori: {risk_metadata.get('category', 'Risk Register')}
+        kind: str,
+        structured: Optional[List[Dict]],
+        text: Optional[str],
+        metadata: Dict,
+        semaphore: asyncio.Semaphore,
+        issues: List[str]
+    ) -> List[Dict]:
+        """Structured table rows when the document has them, else records extracted from its text"""
+        if structured:
+            records = normalize_records(structured, *RECORD_FIELDS[kind])
+            logger.info(f"Using {len(records)} structured {kind} rows from {metadata.get('filename', 'document')}")
+            return records
+        if not text:
+            return []
+        return await self._extract_records(kind, text, metadata, semaphore, issues)
+
+    async def _extract_records(
+        self,
+        kind: str,
+        text: str,
+        metadata: Dict,
+        semaphore: asyncio.Semaphore,
+        issues: List[str]
+    ) -> List[Dict]:
+        """Extract risk or audit program records from every window of a document"""
+        from backend.llm_client import llm_client
+        from config.config import settings
 
-### Konten Risk Register:
----
-{risk_register_text}
----
+        items, schema, key = EXTRACTION_TARGETS[kind]
+        system_prompt = RISK_AUDIT_MAPPER_PERSONA + f"""
 
-## Dokumen 2: PKPT (Program Kerja Pengawasan Tahunan)
-- Nama File: {audit_metadata.get('filename', 'Unknown')}
-- Tipe: {audit_metadata.get('file_type', 'Unknown')}
-- Kategori: {audit_metadata.get('category', 'Audit Plan')}
+## Tugas Anda Saat Ini:
+Ekstrak SEMUA {items} dari potongan dokumen berikut menjadi record terstruktur.
+Jangan meringkas, menggabungkan, atau melewatkan baris. Jika suatu field tidak tersedia, isi dengan "".
 
-### Konten PKPT:
+## Format Output (WAJIB dalam JSON):
+{schema}"""
+        windows = build_windows(text, settings.RISK_MAPPING_WINDOW_TOKENS)
+
+        async def extract(index: int, window: str) -> List[Dict]:
+            async with semaphore:
+                try:
+                    response = await llm_client.generate_completion(
+                        messages=[
+                            {"role": "system", "content": system_prompt},
+                            {"role": "user", "content": f"""## Dokumen: {metadata.get('filename', 'Unknown')} (bagian {index + 1}/{len(windows)})
 ---
-{audit_plan_text}
+{window}
 ---
 
-## Jenis Pemetaan: {mapping_type.upper()}
-{mapping_instructions.get(mapping_type, mapping_instructions['comprehensive'])}
+Berikan output dalam format JSON sesuai template yang telah ditentukan."""}
+                        ],
+                        temperature=0.1,
+                        max_tokens=settings.RISK_MAPPING_EXTRACT_MAX_TOKENS,
+                        json_mode=True
+                    )
+                    records = json.loads(response).get(key) or []
+                    return records if isinstance(records, list) else []
+                except Exception as e:
+                    logger.warning(f"Extracting {kind} records from window {index + 1}/{len(windows)} failed: {str(e)}")
+                    issues.append(
+                        f"Bagian {index + 1}/{len(windows)} dari {metadata.get('filename', 'dokumen')} gagal diekstrak"
+                    )
+                    return []
+
+        extracted = await asyncio.gather(*(extract(i, window) for i, window in enumerate(windows)))
+        records = normalize_records([r for rs in extracted for r in rs], *RECORD_FIELDS[kind])
+        logger.info(f"Extracted {len(records)} {kind} records from {len(windows)} windows")
+        return records
+
+    async def _find_candidates(self, risks: List[Dict], audits: List[Dict]) -> List[List[Tuple[int, float]]]:
+        """Embed both record sets and keep each risk's most similar audit programs"""
+        from backend.embeddings import embedding_service
+        from config.config import settings
+
+        if not audits:
+            return [[] for _ in risks]
+
+        risk_texts = [
+            f"{r['risk_name']}. {r.get('risk_category', '')}. {r.get('existing_controls', '')} {r.get('risk_owner', '')}"
+            for r in risks
+        ]
+        audit_texts = [
+            f"{a['audit_name']}. {a.get('auditable_entity', '')}. {a.get('audit_objective', '')}"
+            for a in audits
+        ]
+        risk_vectors = await embedding_service.embed_many(risk_texts)
+        audit_vectors = await embedding_service.embed_many(audit_texts)
+        return candidate_pairs(
+            similarity_matrix(risk_vectors, audit_vectors),
+            settings.RISK_MAPPING_CANDIDATES_PER_RISK,
+            settings.RISK_MAPPING_MIN_SIMILARITY
+        )
+
+    async def _judge_coverage(
+        self,
+        risks: List[Dict],
+        audits: List[Dict],
+        candidates: List[List[Tuple[int, float]]],
+        semaphore: asyncio.Semaphore,
+        issues: List[str],
+        on_batch: Callable[[int, int], Awaitable[None]] = None
+    ) -> Dict[str, Dict]:
+        """
+        Ask the LLM which candidate audits cover each risk; returns judgments by risk_id
+        on_batch(done, total) is awaited as each batch finishes
+        """
+        from backend.llm_client import llm_client
+        from config.config import settings
+
+        judgments: Dict[str, Dict] = {}
+        pending = []
+        for risk, pairs in zip(risks, candidates):
+            if pairs:
+                pending.append((risk, pairs))
+            else:
+                judgments[risk["risk_id"]] = {
+                    "mapped_audit_ids": [],
+                    "coverage_status": "NOT_COVERED",
+                    "coverage_quality": "",
+                    "coverage_notes": "Tidak ada program audit di PKPT yang relevan dengan risiko ini",
+                    "coverage_gap": "Risiko belum memiliki program audit"
+                }
+
+        batch_size = max(1, settings.RISK_MAPPING_BATCH_RISKS)
+        batches = [pending[i:i + batch_size] for i in range(0, len(pending), batch_size)]
+        judged = []
+
+        async def judge(batch: List[Tuple[Dict, List[Tuple[int, float]]]]):
+            blocks = []
+            for risk, pairs in batch:
+                candidate_lines = "\n".join(
+                    f"  - {audits[j]['audit_id']}: {audits[j]['audit_name']} "
+                    f"(entitas: {audits[j].get('auditable_entity', '')}; tujuan: {audits[j].get('audit_objective', '')})"
+                    for j, _ in pairs
+                )
+                blocks.append(
+                    f"### {risk['risk_id']}: {risk['risk_name']} (level: {risk_level(risk)})\n"
+                    f"Kategori: {risk.get('risk_category', '')}; Kontrol: {risk.get('existing_controls', '')}\n"
+                    f"Kandidat program audit:\n{candidate_lines}"
+                )
+            async with semaphore:
+                try:
+                    response = await llm_client.generate_completion(
+                        messages=[
+                            {"role": "system", "content": COVERAGE_SYSTEM_PROMPT},
+                            {"role": "user", "content": "\n\n".join(blocks) +
+                                "\n\nBerikan output dalam format JSON sesuai template yang telah ditentukan."}
+                        ],
+                        temperature=0.2,
+                        max_tokens=settings.RISK_MAPPING_JUDGE_MAX_TOKENS,
+                        json_mode=True
+                    )
+                    mappings = json.loads(response).get("mappings") or []
+                except Exception as e:
+                    logger.warning(f"Coverage judgment of {len(batch)} risks failed: {str(e)}")
+                    issues.append(f"Penilaian cakupan untuk {len(batch)} risiko gagal; kandidat belum dinilai")
+                    mappings = []
+
+            by_id = {str(m.get("risk_id")): m for m in mappings if isinstance(m, dict)}
+            omitted = 0
+            for risk, pairs in batch:
+                allowed = {audits[j]["audit_id"] for j, _ in pairs}
+                judgment = by_id.get(risk["risk_id"])
+                if judgment is None:
+                    omitted += 1
+                    judgments[risk["risk_id"]] = {
+                        "mapped_audit_ids": [],
+                        "coverage_status": NOT_ASSESSED,
+                        "coverage_quality": "",
+                        "coverage_notes": "Cakupan tidak dapat dinilai otomatis, perlu review manual",
+                        "coverage_gap": ""
+                    }
+                    continue
+                mapped = [a for a in judgment.get("mapped_audit_ids") or [] if a in allowed]
+                status = judgment.get("coverage_status")
+                if status not in COVERAGE_STATUSES or (status != "NOT_COVERED" and not mapped):
+                    status = "PARTIALLY_COVERED" if mapped else "NOT_COVERED"
+                judgments[risk["risk_id"]] = {**judgment, "mapped_audit_ids": mapped, "coverage_status": status}
+            if mappings and omitted:
+                issues.append(f"{omitted} risiko tidak dinilai oleh model; perlu review manual")
+            judged.append(batch)
+            if on_batch is not None:
+                await on_batch(len(judged), len(batches))
+
+        await asyncio.gather(*(judge(batch) for batch in batches))
+        logger.info(
+            f"Judged {len(pending)} risks with candidates in {len(batches)} batches; "
+            f"{len(risks) - len(pending)} risks had no candidate"
+        )
+        return judgments
+
+    def _assemble(
+        self,
+        risks: List[Dict],
+        audits: List[Dict],
+        in_scope: List[Dict],
+        judgments: Dict[str, Dict],
+        mapping_type: str,
+        issues: List[str]
+    ) -> Dict:
+        """Build the mapping output schema from records and coverage judgments"""
+        from config.config import settings
+
+        audit_names = {audit["audit_id"]: audit["audit_name"] for audit in audits}
+
+        coverage_matrix = []
+        uncovered, partial, over_audited, not_assessed = [], [], [], []
+        for risk in in_scope:
+            judgment = judgments[risk["risk_id"]]
+            level = risk_level(risk)
+            status = judgment["coverage_status"]
+            mapped = judgment["mapped_audit_ids"]
+            coverage_matrix.append({
+                "risk_id": risk["risk_id"],
+                "risk_name": risk["risk_name"],
+                "risk_level": level,
+                "mapped_audit_ids": mapped,
+                "mapped_audit_names": [audit_names[a] for a in mapped],
+                "coverage_status": status,
+                "coverage_quality": judgment.get("coverage_quality", ""),
+                "coverage_notes": judgment.get("coverage_notes", "")
+            })
+            if status == "NOT_COVERED":
+                uncovered.append({
+                    "risk_id": risk["risk_id"],
+                    "risk_name": risk["risk_name"],
+                    "risk_level": level,
+                    "gap_severity": level,
+                    "reason": judgment.get("coverage_gap") or judgment.get("coverage_notes", ""),
+                    "potential_impact": judgment.get("potential_impact", ""),
+                    "recommended_audit_response": judgment.get("recommendation", "")
+                })
+            elif status == NOT_ASSESSED:
+                not_assessed.append({
+                    "risk_id": risk["risk_id"],
+                    "risk_name": risk["risk_name"],
+                    "risk_level": level,
+                    "reason": judgment.get("coverage_notes", "")
+                })
+            elif status == "PARTIALLY_COVERED":
+                partial.append({
+                    "risk_id": risk["risk_id"],
+                    "risk_name": risk["risk_name"],
+                    "risk_level": level,
+                    "current_coverage": judgment.get("coverage_notes", ""),
+                    "coverage_gap": judgment.get("coverage_gap", ""),
+                    "recommended_enhancement": judgment.get("recommendation", "")
+                })
+            if len(mapped) >= OVER_AUDIT_THRESHOLD:
+                over_audited.append({
+                    "area": risk["risk_name"],
+                    "audit_count": len(mapped),
+                    "mapped_audits": mapped,
+                    "recommendation": "Pertimbangkan konsolidasi program audit yang mencakup risiko yang sama"
+                })
+        uncovered.sort(key=lambda item: LEVEL_ORDER.get(item["gap_severity"], -1), reverse=True)
+        partial.sort(key=lambda item: LEVEL_ORDER.get(item["risk_level"], -1), reverse=True)
+
+        not_assessed.sort(key=lambda item: LEVEL_ORDER.get(item["risk_level"], -1), reverse=True)
+
+        # Coverage figures only count risks that were actually assessed
+        assessed = [item for item in coverage_matrix if item["coverage_status"] != NOT_ASSESSED]
+        covered = len(assessed) - len(uncovered)
+        coverage_percentage = f"{round(100 * covered / len(assessed))}%" if assessed else "N/A"
+        key_risks = [item for item in assessed if item["risk_level"] in ("HIGH", "CRITICAL")] or assessed
+        key_covered = sum(item["coverage_status"] == "FULLY_COVERED" for item in key_risks) / max(1, len(key_risks))
+        overall_alignment = (
+            "UNKNOWN" if not key_risks else
+            "STRONG" if key_covered >= 0.8 else
+            "MODERATE" if key_covered >= 0.6 else
+            "WEAK" if key_covered >= 0.4 else
+            "CRITICAL"
+        )
+        confidence = "HIGH" if not issues else "MEDIUM" if len(issues) <= 2 else "LOW"
+
+        if mapping_type == "gap_only":
+            coverage_matrix = [item for item in coverage_matrix if item["coverage_status"] != "FULLY_COVERED"]
+
+        assumptions = [
+            f"Setiap risiko hanya dinilai terhadap maksimal {settings.RISK_MAPPING_CANDIDATES_PER_RISK} program audit "
+            f"yang paling mirip secara semantik",
+            "Level risiko yang tidak tersedia diturunkan dari likelihood x impact"
+        ]
+        if len(in_scope) < len(risks):
+            assumptions.append(f"Pemetaan QUICK hanya mencakup {len(in_scope)} risiko HIGH/CRITICAL dari {len(risks)} risiko")
+
+        overview = (
+            f"{len(risks)} risiko dipetakan terhadap {len(audits)} program audit dengan cakupan "
+            f"{coverage_percentage}; {len(uncovered)} risiko belum tercakup dan {len(partial)} tercakup sebagian."
+        )
+        if not_assessed:
+            overview += f" {len(not_assessed)} risiko belum dapat dinilai dan perlu review manual."
 
-Lakukan pemetaan risiko terhadap program audit berdasarkan kedua dokumen di atas.
-Berikan output dalam format JSON sesuai template yang telah ditentukan.
-Pastikan output adalah valid JSON yang bisa di-parse."""
+        return {
+            "executive_summary": {
+                "overview": overview,
+                "total_risks_identified": len(risks),
+                "total_audit_programs": len(audits),
+                "coverage_percentage": coverage_percentage,
+                "critical_gaps_count": sum(item["gap_severity"] in ("HIGH", "CRITICAL") for item in uncovered),
+                "not_assessed_count": len(not_assessed),
+                "overall_alignment": overall_alignment,
+                "confidence_level": confidence
+            },
+            "risk_register_summary": risks,
+            "audit_plan_summary": audits,
+            "coverage_matrix": coverage_matrix,
+            "gap_analysis": {
+                "uncovered_risks": uncovered,
+                "partially_covered_risks": partial,
+                "over_audited_areas": over_audited,
+                "not_assessed_risks": not_assessed
+            },
+            "recommendations": {
+                "immediate_actions": [
+                    {
+                        "priority": i + 1,
+                        "action": item["recommended_audit_response"] or f"Tambahkan program audit untuk {item['risk_name']}",
+                        "target_risk": item["risk_id"],
+                        "estimated_resources": "TBD",
+                        "rationale": f"Risiko {item['gap_severity']} belum tercakup PKPT"
+                    }
+                    for i, item in enumerate(uncovered[:5])
+                ],
+                "pkpt_adjustments": [],
+                "resource_optimization": [],
+                "for_audit_committee": []
+            },
+            "data_quality_notes": {
+                "risk_register_completeness": "HIGH" if not issues else "MEDIUM",
+                "audit_plan_completeness": "HIGH" if audits and not issues else "LOW" if not audits else "MEDIUM",
+                "mapping_confidence": confidence,
+                "issues": issues,
+                "assumptions": assumptions
+            },
+            # Set by code (not the LLM) so callers can tell failed extraction/judgment batches apart
+            "analysis_coverage": {
+                "risks_in_scope": len(in_scope),
+                "partial_failure": bool(issues)
+            }
+        }
 
-        return prompt
+    async def _summarize(self, mapping_result: Dict, risk_metadata: Dict, audit_metadata: Dict):
+        """Write the overview and recommendations from the assembled mapping (in place)"""
+        from backend.llm_client import llm_client
+        from backend.context_packer import truncate_to_tokens
+        from config.config import settings
+
+        summary = mapping_result["executive_summary"]
+        gaps = mapping_result["gap_analysis"]
+        digest = "\n".join([
+            f"Risk Register: {risk_metadata.get('filename', 'Unknown')}; PKPT: {audit_metadata.get('filename', 'Unknown')}",
+            f"Total risiko: {summary['total_risks_identified']}; total program audit: {summary['total_audit_programs']}",
+            f"Cakupan: {summary['coverage_percentage']}; gap kritis: {summary['critical_gaps_count']}; "
+            f"alignment: {summary['overall_alignment']}",
+            "",
+            "## Risiko tidak tercakup:",
+            *[f"- {g['risk_id']} [{g['gap_severity']}] {g['risk_name']}: {g['reason']}" for g in gaps["uncovered_risks"]],
+            "",
+            "## Risiko tercakup sebagian:",
+            *[f"- {g['risk_id']} [{g['risk_level']}] {g['risk_name']}: {g['coverage_gap']}" for g in gaps["partially_covered_risks"]],
+            "",
+            "## Area dengan audit berlebih:",
+            *[f"- {a['area']} ({a['audit_count']} audit)" for a in gaps["over_audited_areas"]],
+            "",
+            "## Risiko belum dinilai (bukan gap, perlu review manual):",
+            *[f"- {g['risk_id']} [{g['risk_level']}] {g['risk_name']}" for g in gaps["not_assessed_risks"]]
+        ])
 
-    def _generate_fallback_response(self, error: str) -> Dict:
-        """Generate fallback response when mapping fails"""
+        try:
+            response = await llm_client.generate_completion(
+                messages=[
+                    {"role": "system", "content": SUMMARY_SYSTEM_PROMPT},
+                    {"role": "user", "content": truncate_to_tokens(digest, settings.RISK_MAPPING_WINDOW_TOKENS) +
+                        "\n\nBerikan output dalam format JSON sesuai template yang telah ditentukan."}
+                ],
+                temperature=0.3,
+                max_tokens=2000,
+                json_mode=True
+            )
+            result = json.loads(response)
+        except Exception as e:
+            logger.warning(f"Risk mapping summary failed, keeping computed summary: {str(e)}")
+            return
+
+        summary["overview"] = result.get("overview") or summary["overview"]
+        recommendations = result.get("recommendations")
+        if isinstance(recommendations, dict):
+            for key, value in recommendations.items():
+                if key in mapping_result["recommendations"] and isinstance(value, list) and value:
+                    mapping_result["recommendations"][key] = value
+
+    def _generate_fallback_response(self, error: str, retryable: bool = True) -> Dict:
+        """Generate fallback response when mapping fails (retryable: whether a rerun could succeed)"""
         return {
             "executive_summary": {
                 "overview": "Pemetaan tidak dapat diselesaikan karena error teknis. "
@@ -313,7 +745,8 @@ Pastikan output adalah valid JSON yang bisa di-parse."""
             "gap_analysis": {
                 "uncovered_risks": [],
                 "partially_covered_risks": [],
-                "over_audited_areas": []
+                "over_audited_areas": [],
+                "not_assessed_risks": []
             },
             "recommendations": {
                 "immediate_actions": [],
@@ -330,7 +763,8 @@ Pastikan output adalah valid JSON yang bisa di-parse."""
                 "issues": [f"Error teknis: {error}"],
                 "assumptions": []
             },
-            "error": error
+            "error": error,
+            "retryable": retryable
         }
 
 
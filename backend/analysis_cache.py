@@ -0,0 +1,95 @@
+"""
+Analysis Result Cache for RAG Komite Audit System
+Reuses stored analysis results for unchanged documents, keyed by document
+content hash, analysis type, agent prompt version and model
+"""
+from typing import Dict, List, Optional
+import hashlib
+import json
+import logging
+from config.config import settings
+from backend.database import db
+
+logging.basicConfig(level=getattr(logging, settings.LOG_LEVEL))
+logger = logging.getLogger(__name__)
+
+
+class AnalysisCache:
+    """
+    Looks up prior results in the analysis tables (financial_analyses,
+    executive_insights, risk_audit_mappings) by their cache_key column
+    """
+
+    def __init__(self, enabled: bool = None):
+        self.enabled = settings.ANALYSIS_CACHE_ENABLED if enabled is None else enabled
+        self.hits = 0
+        self.misses = 0
+        logger.info(f"AnalysisCache initialized (enabled: {self.enabled})")
+
+    @staticmethod
+    def document_hash(chunk_hashes: List[Optional[str]]) -> Optional[str]:
+        """Content hash of a document from its ordered chunk hashes (None if any is missing)"""
+        if not chunk_hashes or not all(chunk_hashes):
+            return None
+        return hashlib.sha256("\n".join(chunk_hashes).encode("utf-8")).hexdigest()
+
+    @staticmethod
+    def make_key(document_hashes: List[str], analysis_type: str, prompt_version: str, model: str) -> str:
+        payload = json.dumps([document_hashes, analysis_type, prompt_version, model])
+        return hashlib.sha256(payload.encode("utf-8")).hexdigest()
+
+    @staticmethod
+    def is_cacheable(result: Dict) -> bool:
+        """
+        Only complete results are reused; fallbacks and partially failed runs are not
+        (data_quality_notes.issues is written by the LLM, so the agents' own
+        analysis_coverage.partial_failure flag is used instead)
+        """
+        if "error" in result:
+            return False
+        return not (result.get("analysis_coverage") or {}).get("partial_failure")
+
+    async def key(
+        self,
+        document_ids: List[str],
+        analysis_type: str,
+        prompt_version: str,
+        model: str
+    ) -> Optional[str]:
+        """
+        Cache key for an analysis of the given documents, or None when caching
+        is disabled or a document has chunks stored without content hashes
+        """
+        if not self.enabled:
+            return None
+        document_hashes = []
+        try:
+            for document_id in document_ids:
+                rows = await db.get_embedding_hashes(document_id)
+                document_hash = self.document_hash([row.get("content_hash") for row in rows])
+                if document_hash is None:
+                    return None
+                document_hashes.append(document_hash)
+        except Exception as e:
+            logger.warning(f"Could not hash documents {document_ids}: {str(e)}")
+            return None
+        return self.make_key(document_hashes, analysis_type, prompt_version, model)
+
+    async def get(self, table: str, cache_key: Optional[str]) -> Optional[Dict]:
+        """Most recent stored result row for a cache key"""
+        if cache_key is None:
+            return None
+        row = await db.get_cached_result(table, cache_key)
+        if row:
+            self.hits += 1
+            logger.info(f"Analysis cache hit in {table}")
+        else:
+            self.misses += 1
+        return row
+
+    def stats(self) -> Dict:
+        return {"enabled": self.enabled, "hits": self.hits, "misses": self.misses}
+
+
+# Global analysis cache instance
+analysis_cache = AnalysisCache()
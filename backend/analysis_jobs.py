@@ -0,0 +1,313 @@
+"""
+Analysis Jobs for RAG Komite Audit System
+Job queue handlers for financial analysis, risk-audit mapping and executive
+insight; results are saved to their tables and returned as the job result.
+Cache hits are answered by the endpoints directly, without queueing a job
+"""
+from typing import Any, Dict, Optional, Tuple
+import logging
+from config.config import settings
+from agents.financial_analyst import financial_analyst
+from agents.risk_audit_mapper import risk_audit_mapper
+from agents.executive_insight import executive_insight_analyzer
+from backend.analysis_cache import analysis_cache
+from backend.database import db
+from backend.job_queue import JobHandler, PermanentJobError, ProgressCallback
+from backend.rate_limiter import rate_limiter, PRIORITY_BATCH
+from backend.usage_tracker import usage_tracker
+
+logging.basicConfig(level=getattr(logging, settings.LOG_LEVEL))
+logger = logging.getLogger(__name__)
+
+# (result, processing_time_ms, tokens_used), as returned by the agents
+Outcome = Tuple[Dict, Optional[int], Optional[int]]
+
+
+async def _get_document(document_id: str) -> Dict:
+    document = await db.get_document(document_id)
+    if not document:
+        raise PermanentJobError(f"Document not found: {document_id}")
+    return document
+
+
+def _check_result(result: Dict):
+    """
+    Agents return a fallback response on failure; raise instead so the job
+    is retried, unless the agent marked the failure as not retryable
+    """
+    if "error" in result:
+        if result.get("retryable") is False:
+            raise PermanentJobError(result["error"])
+        raise RuntimeError(result["error"])
+
+
+async def _lookup(table: str, result_field: str, cache_key: Optional[str], payload: Dict) -> Optional[Tuple[Outcome, Dict]]:
+    """Stored (outcome, row) for a cache key, unless the request forces a refresh"""
+    if payload.get("force_refresh"):
+        return None
+    cached = await analysis_cache.get(table, cache_key)
+    if not cached:
+        return None
+    return (cached[result_field], cached.get("processing_time_ms"), cached.get("tokens_used")), cached
+
+
+def _cache_fields(cached: Optional[Dict]) -> Dict[str, Any]:
+    return {"cached": cached is not None, "cached_at": cached.get("created_at") if cached else None}
+
+
+# Financial analysis
+async def _financial_key(payload: Dict[str, Any]) -> Optional[str]:
+    return await analysis_cache.key(
+        [payload["document_id"]],
+        payload.get("analysis_type", "comprehensive"),
+        financial_analyst.prompt_version,
+        settings.GROQ_MODEL
+    )
+
+
+def _financial_response(
+    payload: Dict[str, Any],
+    document: Dict,
+    outcome: Outcome,
+    record: Optional[Dict],
+    cached: Optional[Dict] = None
+) -> Dict:
+    analysis_result, execution_time, tokens_used = outcome
+    return {
+        "success": True,
+        "document_id": payload["document_id"],
+        "document_name": document.get("filename"),
+        "analysis_type": payload.get("analysis_type", "comprehensive"),
+        "analysis": analysis_result,
+        "processing_time_ms": execution_time,
+        "tokens_used": tokens_used,
+        "analysis_id": record.get("id") if record else None,
+        **_cache_fields(cached)
+    }
+
+
+async def cached_financial_analysis(payload: Dict[str, Any], document: Dict) -> Optional[Dict]:
+    """/analyze response from a stored result, or None on a cache miss"""
+    hit = await _lookup("financial_analyses", "analysis_result", await _financial_key(payload), payload)
+    if not hit:
+        return None
+    outcome, cached = hit
+    return _financial_response(payload, document, outcome, cached, cached=cached)
+
+
+async def run_financial_analysis(payload: Dict[str, Any], progress: ProgressCallback) -> Dict:
+    """Job handler for /analyze"""
+    document_id = payload["document_id"]
+    analysis_type = payload.get("analysis_type", "comprehensive")
+    document = await _get_document(document_id)
+
+    await progress("loading document", 0.05)
+    document_text = await db.get_document_full_text(document_id)
+    if not document_text:
+        raise PermanentJobError("Document text not found. Document may not have been processed correctly.")
+
+    outcome = await financial_analyst.analyze_document(
+        document_text=document_text,
+        document_metadata=document,
+        analysis_type=analysis_type,
+        progress=progress
+    )
+    analysis_result, execution_time, tokens_used = outcome
+    _check_result(analysis_result)
+
+    await progress("saving", 0.95)
+    saved_analysis = await db.create_analysis(
+        document_id=document_id,
+        session_id=payload.get("session_id"),
+        analysis_type=analysis_type,
+        analysis_result=analysis_result,
+        processing_time_ms=execution_time,
+        tokens_used=tokens_used,
+        cache_key=await _financial_key(payload) if analysis_cache.is_cacheable(analysis_result) else None
+    )
+    return _financial_response(payload, document, outcome, saved_analysis)
+
+
+# Risk-audit mapping
+async def _risk_mapping_key(payload: Dict[str, Any]) -> Optional[str]:
+    # Candidate pairs depend on the embedding model as well as the LLM
+    return await analysis_cache.key(
+        [payload["risk_register_document_id"], payload["audit_plan_document_id"]],
+        payload.get("mapping_type", "comprehensive"),
+        risk_audit_mapper.prompt_version,
+        f"{settings.GROQ_MODEL}|{settings.EMBEDDING_MODEL}"
+    )
+
+
+def _risk_mapping_response(
+    payload: Dict[str, Any],
+    risk_doc: Dict,
+    audit_doc: Dict,
+    outcome: Outcome,
+    record: Optional[Dict],
+    cached: Optional[Dict] = None
+) -> Dict:
+    mapping_result, execution_time, tokens_used = outcome
+    return {
+        "success": True,
+        "risk_register_document_id": payload["risk_register_document_id"],
+        "risk_register_name": risk_doc.get("filename"),
+        "audit_plan_document_id": payload["audit_plan_document_id"],
+        "audit_plan_name": audit_doc.get("filename"),
+        "mapping_type": payload.get("mapping_type", "comprehensive"),
+        "mapping": mapping_result,
+        "processing_time_ms": execution_time,
+        "tokens_used": tokens_used,
+        "mapping_id": record.get("id") if record else None,
+        **_cache_fields(cached)
+    }
+
+
+async def cached_risk_mapping(payload: Dict[str, Any], risk_doc: Dict, audit_doc: Dict) -> Optional[Dict]:
+    """/risk-mapping response from a stored result, or None on a cache miss"""
+    hit = await _lookup("risk_audit_mappings", "mapping_result", await _risk_mapping_key(payload), payload)
+    if not hit:
+        return None
+    outcome, cached = hit
+    return _risk_mapping_response(payload, risk_doc, audit_doc, outcome, cached, cached=cached)
+
+
+async def run_risk_mapping(payload: Dict[str, Any], progress: ProgressCallback) -> Dict:
+    """Job handler for /risk-mapping"""
+    risk_id = payload["risk_register_document_id"]
+    audit_id = payload["audit_plan_document_id"]
+    mapping_type = payload.get("mapping_type", "comprehensive")
+    risk_doc = await _get_document(risk_id)
+    audit_doc = await _get_document(audit_id)
+
+    await progress("loading documents", 0.02)
+    # Structured spreadsheet rows when available, full text otherwise
+    risk_rows = await db.get_table_rows(risk_id, "risk_register")
+    risk_text = None
+    if not risk_rows:
+        risk_text = await db.get_document_full_text(risk_id)
+        if not risk_text:
+            raise PermanentJobError("Risk register text not found.")
+
+    audit_rows = await db.get_table_rows(audit_id, "audit_plan")
+    audit_text = None
+    if not audit_rows:
+        audit_text = await db.get_document_full_text(audit_id)
+        if not audit_text:
+            raise PermanentJobError("Audit plan text not found.")
+
+    outcome = await risk_audit_mapper.analyze_mapping(
+        risk_register_text=risk_text,
+        audit_plan_text=audit_text,
+        risk_register_metadata=risk_doc,
+        audit_plan_metadata=audit_doc,
+        mapping_type=mapping_type,
+        risk_records=risk_rows,
+        audit_records=audit_rows,
+        progress=progress
+    )
+    mapping_result, execution_time, tokens_used = outcome
+    _check_result(mapping_result)
+
+    await progress("saving", 0.95)
+    saved_mapping = await db.create_risk_mapping(
+        risk_register_document_id=risk_id,
+        audit_plan_document_id=audit_id,
+        session_id=payload.get("session_id"),
+        mapping_type=mapping_type,
+        mapping_result=mapping_result,
+        processing_time_ms=execution_time,
+        tokens_used=tokens_used,
+        cache_key=await _risk_mapping_key(payload) if analysis_cache.is_cacheable(mapping_result) else None
+    )
+    return _risk_mapping_response(payload, risk_doc, audit_doc, outcome, saved_mapping)
+
+
+# Executive insight
+async def _executive_insight_key(payload: Dict[str, Any]) -> Optional[str]:
+    return await analysis_cache.key(
+        [payload["document_id"]],
+        payload.get("analysis_type", "full"),
+        executive_insight_analyzer.prompt_version,
+        settings.GROQ_MODEL
+    )
+
+
+def _executive_insight_response(
+    payload: Dict[str, Any],
+    document: Dict,
+    outcome: Outcome,
+    record: Optional[Dict],
+    cached: Optional[Dict] = None
+) -> Dict:
+    insight_result, execution_time, tokens_used = outcome
+    return {
+        "success": True,
+        "document_id": payload["document_id"],
+        "document_name": document.get("filename"),
+        "analysis_type": payload.get("analysis_type", "full"),
+        "insight": insight_result,
+        "processing_time_ms": execution_time,
+        "tokens_used": tokens_used,
+        "insight_id": record.get("id") if record else None,
+        **_cache_fields(cached)
+    }
+
+
+async def cached_executive_insight(payload: Dict[str, Any], document: Dict) -> Optional[Dict]:
+    """/executive-insight response from a stored result, or None on a cache miss"""
+    hit = await _lookup("executive_insights", "insight_result", await _executive_insight_key(payload), payload)
+    if not hit:
+        return None
+    outcome, cached = hit
+    return _executive_insight_response(payload, document, outcome, cached, cached=cached)
+
+
+async def run_executive_insight(payload: Dict[str, Any], progress: ProgressCallback) -> Dict:
+    """Job handler for /executive-insight"""
+    document_id = payload["document_id"]
+    analysis_type = payload.get("analysis_type", "full")
+    document = await _get_document(document_id)
+
+    await progress("loading document", 0.05)
+    document_text = await db.get_document_full_text(document_id)
+    if not document_text:
+        raise PermanentJobError("Document text not found. Document may not have been processed correctly.")
+
+    outcome = await executive_insight_analyzer.analyze_document(
+        document_text=document_text,
+        document_metadata=document,
+        analysis_type=analysis_type,
+        tables=await db.get_document_tables(document_id),
+        progress=progress
+    )
+    insight_result, execution_time, tokens_used = outcome
+    _check_result(insight_result)
+
+    await progress("saving", 0.95)
+    saved_insight = await db.create_executive_insight(
+        document_id=document_id,
+        session_id=payload.get("session_id"),
+        analysis_type=analysis_type,
+        insight_result=insight_result,
+        processing_time_ms=execution_time,
+        tokens_used=tokens_used,
+        cache_key=await _executive_insight_key(payload) if analysis_cache.is_cacheable(insight_result) else None
+    )
+    return _executive_insight_response(payload, document, outcome, saved_insight)
+
+
+def _batch(endpoint: str, handler: JobHandler) -> JobHandler:
+    """Run a handler at batch LLM priority, with token usage attributed to the endpoint that queued it"""
+    async def run(payload: Dict[str, Any], progress: ProgressCallback) -> Dict:
+        with usage_tracker.labels(endpoint=endpoint), rate_limiter.priority(PRIORITY_BATCH):
+            return await handler(payload, progress)
+    return run
+
+
+# Job kind -> handler, registered on the job queue at startup
+ANALYSIS_JOBS = {
+    "financial_analysis": _batch("/analyze", run_financial_analysis),
+    "risk_mapping": _batch("/risk-mapping", run_risk_mapping),
+    "executive_insight": _batch("/executive-insight", run_executive_insight)
+}
@@ -0,0 +1,208 @@
+"""
+Context Packer for RAG Komite Audit System
+Fits system prompt, conversation history and retrieved context into a prompt token budget,
+and splits long documents into section-aligned windows for per-window LLM calls
+"""
+from typing import Dict, List, Optional, Tuple
+import logging
+import re
+import tiktoken
+from config.config import settings
+
+logging.basicConfig(level=getattr(logging, settings.LOG_LEVEL))
+logger = logging.getLogger(__name__)
+
+SENTENCE_SPLIT = re.compile(r"(?<=[.!?])\s+")
+TRUNCATION_MARKER = " …"
+
+# Runs of 3+ uppercase words ("CATATAN ATAS LAPORAN KEUANGAN", "5. KAS DAN SETARA KAS")
+# start a section; line breaks are gone after chunking, so headings are found inline
+SECTION_HEADING = re.compile(r"(?:\b\d{1,3}[a-z]?\.\s+)?\b[A-Z]{3,}(?:[ \t]+[A-Z0-9][A-Z0-9&/(),.-]*){2,}")
+
+# Allowance for the answer instructions and per-chunk "[Context n]" headers
+PROMPT_OVERHEAD_TOKENS = 150
+
+_encoding = None
+_encoding_failed = False
+
+
+def _get_encoding():
+    """Load the tokenizer once; None when it is unavailable (e.g. offline first run)"""
+    global _encoding, _encoding_failed
+    if _encoding is None and not _encoding_failed:
+        try:
+            _encoding = tiktoken.get_encoding(settings.TOKENIZER_ENCODING)
+        except Exception as e:
+            _encoding_failed = True
+            logger.warning(f"Tokenizer unavailable, estimating tokens from length: {str(e)}")
+    return _encoding
+
+
+def count_tokens(text: str) -> int:
+    """Token count with the configured tokenizer (characters/4 as a fallback)"""
+    if not text:
+        return 0
+    encoding = _get_encoding()
+    if encoding is None:
+        return len(text) // 4
+    return len(encoding.encode(text, disallowed_special=()))
+
+
+def truncate_to_tokens(text: str, max_tokens: int) -> str:
+    """Cut text to at most max_tokens tokens, marking the cut"""
+    if max_tokens <= 0:
+        return ""
+    if count_tokens(text) <= max_tokens:
+        return text
+    encoding = _get_encoding()
+    if encoding is None:
+        return text[:max_tokens * 4].rstrip() + TRUNCATION_MARKER
+    tokens = encoding.encode(text, disallowed_special=())
+    return encoding.decode(tokens[:max_tokens]).rstrip() + TRUNCATION_MARKER
+
+
+def _normalize_sentence(sentence: str) -> str:
+    return re.sub(r"\s+", " ", sentence).strip().rstrip(".").lower()
+
+
+def dedupe_chunks(chunks: List[str]) -> List[str]:
+    """
+    Drop sentences already present in an earlier (higher ranked) chunk
+    Consecutive chunks share overlap sentences; chunks with nothing new are dropped
+    """
+    seen = set()
+    deduped = []
+    for chunk in chunks:
+        sentences = [s for s in SENTENCE_SPLIT.split(chunk.strip()) if s.strip()]
+        fresh = []
+        for sentence in sentences:
+            key = _normalize_sentence(sentence)
+            if key and key not in seen:
+                seen.add(key)
+                fresh.append(sentence)
+        if fresh:
+            deduped.append(chunk if len(fresh) == len(sentences) else " ".join(fresh))
+    return deduped
+
+
+def pack_history(
+    conversation_history: List[Dict],
+    budget: int,
+    max_turns: int = 5,
+    turn_max_tokens: int = None
+) -> Tuple[List[Dict], int]:
+    """
+    Keep the most recent turns that fit the budget, shortening long answers
+    Turns are ordered by created_at, so the newest-first rows of
+    db.get_conversation_history can be passed as they come
+    Returns (turns in chronological order, tokens used)
+    """
+    turn_max_tokens = turn_max_tokens or settings.HISTORY_TURN_MAX_TOKENS
+    history = sorted(conversation_history or [], key=lambda turn: str(turn.get("created_at") or ""))
+    packed: List[Dict] = []
+    used = 0
+    for turn in reversed(history[-max_turns:]):
+        user_query = turn.get("user_query", "")
+        agent_response = truncate_to_tokens(turn.get("agent_response") or "", turn_max_tokens)
+        tokens = count_tokens(user_query) + count_tokens(agent_response)
+        if used + tokens > budget:
+            break
+        packed.append({"user_query": user_query, "agent_response": agent_response})
+        used += tokens
+    packed.reverse()
+    return packed, used
+
+
+def pack_context(
+    context: List[str],
+    budget: int,
+    min_partial_tokens: int = 100
+) -> Tuple[List[str], int]:
+    """
+    Deduplicate ranked chunks and keep them in order while they fit the budget;
+    the first chunk that does not fit is truncated if enough room is left
+    Returns (chunks, tokens used)
+    """
+    packed: List[str] = []
+    used = 0
+    for chunk in dedupe_chunks(context or []):
+        tokens = count_tokens(chunk)
+        if used + tokens <= budget:
+            packed.append(chunk)
+            used += tokens
+            continue
+        remaining = budget - used
+        if remaining >= min_partial_tokens:
+            truncated = truncate_to_tokens(chunk, remaining)
+            packed.append(truncated)
+            used += count_tokens(truncated)
+        break
+    return packed, used
+
+
+def pack_prompt(
+    system_prompt: str,
+    user_query: str,
+    context: List[str] = None,
+    conversation_history: List[Dict] = None,
+    budget: Optional[int] = None
+) -> Tuple[List[str], List[Dict]]:
+    """
+    Split the prompt budget: system prompt and question are fixed, history gets
+    up to HISTORY_TOKEN_BUDGET, and context fills what remains
+    Returns (context, history) to put in the prompt
+    """
+    budget = budget or settings.PROMPT_TOKEN_BUDGET
+    available = max(
+        0,
+        budget - PROMPT_OVERHEAD_TOKENS - count_tokens(system_prompt) - count_tokens(user_query)
+    )
+
+    history, history_tokens = pack_history(
+        conversation_history,
+        min(settings.HISTORY_TOKEN_BUDGET, available // 2)
+    )
+    packed_context, context_tokens = pack_context(context, available - history_tokens)
+
+    logger.debug(
+        f"Packed prompt: {len(packed_context)}/{len(context or [])} chunks ({context_tokens} tokens), "
+        f"{len(history)} history turns ({history_tokens} tokens), budget {budget}"
+    )
+    return packed_context, history
+
+
+def split_sections(text: str) -> List[str]:
+    """Split document text at inline section headings"""
+    starts = sorted({0, *(match.start() for match in SECTION_HEADING.finditer(text))})
+    sections = [text[start:end].strip() for start, end in zip(starts, starts[1:] + [len(text)])]
+    return [section for section in sections if section]
+
+
+def _split_to_fit(text: str, max_tokens: int) -> List[str]:
+    """Break an oversized section at paragraphs, then sentences, then characters"""
+    if count_tokens(text) <= max_tokens:
+        return [text]
+    for separator in ("\n\n", ". "):
+        parts = [part for part in text.split(separator) if part.strip()]
+        if len(parts) > 1:
+            return [piece for part in parts for piece in _split_to_fit(part, max_tokens)]
+    step = max_tokens * 3
+    return [text[i:i + step] for i in range(0, len(text), step)]
+
+
+def build_windows(text: str, max_tokens: int) -> List[str]:
+    """Pack whole sections into windows of at most max_tokens tokens, in document order"""
+    windows: List[str] = []
+    current: List[str] = []
+    used = 0
+    for section in split_sections(text):
+        for unit in _split_to_fit(section, max_tokens):
+            tokens = count_tokens(unit) + 2  # plus the paragraph separator
+            if current and used + tokens > max_tokens:
+                windows.append("\n\n".join(current))
+                current, used = [], 0
+            current.append(unit)
+            used += tokens
+    if current:
+        windows.append("\n\n".join(current))
+    return windows
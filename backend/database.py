@@ -1,12 +1,22 @@
 """
 Database Manager for RAG Komite Audit System
-Handles all Supabase database operations
+Handles all Supabase database operations (non-blocking, pooled async client)
 """
-from supabase import create_client, Client
+from supabase import acreate_client, AsyncClient
+from supabase.lib.client_options import AsyncClientOptions
+from postgrest import ReturnMethod
 from typing import List, Dict, Optional, Any
 from datetime import datetime
+import asyncio
+import httpx
 import json
+import numpy as np
 import logging
+import random
+import uuid
+from backend.keyword_index import keyword_index
+from backend.text_extraction import merge_table_rows
+from backend.vector_index import format_vectors, local_index
 from config.config import settings
 
 logging.basicConfig(level=getattr(logging, settings.LOG_LEVEL))
@@ -16,11 +26,128 @@ class DatabaseManager:
     """Manages database operations with Supabase"""
     
     def __init__(self):
-        self.client: Client = create_client(
-            settings.SUPABASE_URL,
-            settings.SUPABASE_SERVICE_KEY
+        self.client: Optional[AsyncClient] = None
+        self._http_client: Optional[httpx.AsyncClient] = None
+        self._connect_lock = asyncio.Lock()
+        # Caps concurrent embedding write batches across all ingestions
+        self._insert_writers = asyncio.Semaphore(max(1, settings.DB_INSERT_WRITERS))
+        logger.info("Database Manager initialized (client will connect on first use)")
+
+    async def connect(self) -> AsyncClient:
+        """Create the async Supabase client backed by a bounded HTTP connection pool"""
+        async with self._connect_lock:
+            if self.client is None:
+                self._http_client = httpx.AsyncClient(
+                    timeout=settings.DB_TIMEOUT_SECONDS,
+                    limits=httpx.Limits(
+                        max_connections=settings.DB_POOL_MAX_CONNECTIONS,
+                        max_keepalive_connections=settings.DB_POOL_MAX_KEEPALIVE
+                    )
+                )
+                self.client = await acreate_client(
+                    settings.SUPABASE_URL,
+                    settings.SUPABASE_SERVICE_KEY,
+                    options=AsyncClientOptions(httpx_client=self._http_client)
+                )
+                logger.info(
+                    f"Async Supabase client connected "
+                    f"(pool size: {settings.DB_POOL_MAX_CONNECTIONS})"
+                )
+        return self.client
+
+    async def close(self):
+        """Release pooled connections"""
+        if self._http_client is not None:
+            await self._http_client.aclose()
+        self.client = None
+        self._http_client = None
+        logger.info("Database Manager connections closed")
+
+    async def _get_client(self) -> AsyncClient:
+        """Return the connected client, connecting lazily if needed"""
+        if self.client is None:
+            return await self.connect()
+        return self.client
+
+    @property
+    def use_local_index(self) -> bool:
+        """Whether retrieval is served from the in-process vector index"""
+        return settings.VECTOR_SEARCH_BACKEND == "local"
+
+    @property
+    def use_keyword_index(self) -> bool:
+        """Whether the in-process BM25 index is maintained for hybrid retrieval"""
+        return settings.HYBRID_SEARCH_ENABLED
+
+    @property
+    def _mirrors(self) -> List[Any]:
+        """In-process indexes that mirror document and chunk changes"""
+        mirrors: List[Any] = []
+        if self.use_local_index:
+            mirrors.append(local_index)
+        if self.use_keyword_index:
+            mirrors.append(keyword_index)
+        return mirrors
+
+    async def _select_all(
+        self,
+        table: str,
+        columns: str,
+        page_size: int = 1000,
+        filters: Dict[str, Any] = None,
+        order: str = "id"
+    ) -> List[Dict]:
+        """Fetch every (matching) row of a table, paging past the PostgREST row limit"""
+        client = await self._get_client()
+        rows: List[Dict] = []
+        while True:
+            query = client.table(table).select(columns)
+            for column, value in (filters or {}).items():
+                query = query.eq(column, value)
+            response = await query\
+                .order(order)\
+                .range(len(rows), len(rows) + page_size - 1)\
+                .execute()
+            page = response.data or []
+            rows.extend(page)
+            if len(page) < page_size:
+                return rows
+
+    async def load_indexes(self) -> int:
+        """Load all document info and chunks into the enabled in-process indexes"""
+        mirrors = self._mirrors
+        if not mirrors:
+            return 0
+
+        documents = await self._select_all(
+            settings.DOCUMENTS_TABLE,
+            "id, filename, category, status"
         )
-        logger.info("Database Manager initialized")
+        for document in documents:
+            for index in mirrors:
+                index.set_document(
+                    document["id"],
+                    filename=document["filename"],
+                    category=document["category"],
+                    status=document["status"]
+                )
+
+        # Vectors are only fetched when the local vector index needs them
+        columns = "id, document_id, chunk_index, content, metadata"
+        if self.use_local_index:
+            columns += ", embedding"
+        embeddings = await self._select_all(settings.EMBEDDINGS_TABLE, columns, filters={"pending": False})
+        by_document: Dict[str, List[Dict]] = {}
+        for row in embeddings:
+            by_document.setdefault(row["document_id"], []).append(row)
+        for document_id, chunks in by_document.items():
+            for index in mirrors:
+                index.add_chunks(document_id, chunks)
+
+        for index in mirrors:
+            index.loaded = True
+        logger.info(f"In-process indexes loaded with {len(embeddings)} chunks")
+        return len(embeddings)
     
     # Document Management
     async def create_document(
@@ -34,6 +161,7 @@ class DatabaseManager:
     ) -> Dict:
         """Create a new document entry"""
         try:
+            client = await self._get_client()
             data = {
                 "filename": filename,
                 "file_type": file_type,
@@ -44,9 +172,18 @@ class DatabaseManager:
                 "status": "uploaded"
             }
             
-            response = self.client.table(settings.DOCUMENTS_TABLE).insert(data).execute()
+            response = await client.table(settings.DOCUMENTS_TABLE).insert(data).execute()
             logger.info(f"Document created: {filename}")
-            return response.data[0] if response.data else None
+            document = response.data[0] if response.data else None
+            if document:
+                for index in self._mirrors:
+                    index.set_document(
+                        document["id"],
+                        filename=filename,
+                        category=category,
+                        status=document.get("status")
+                    )
+            return document
             
         except Exception as e:
             logger.error(f"Error creating document: {str(e)}")
@@ -60,12 +197,15 @@ class DatabaseManager:
     ) -> bool:
         """Update document processing status"""
         try:
+            client = await self._get_client()
             data = {"status": status}
             if total_chunks is not None:
                 data["total_chunks"] = total_chunks
                 data["processed_date"] = datetime.now().isoformat()
             
-            response = self.client.table(settings.DOCUMENTS_TABLE).update(data).eq("id", document_id).execute()
+            response = await client.table(settings.DOCUMENTS_TABLE).update(data).eq("id", document_id).execute()
+            for index in self._mirrors:
+                index.set_document(document_id, status=status)
             logger.info(f"Document status updated: {document_id} -> {status}")
             return True
             
@@ -73,10 +213,60 @@ class DatabaseManager:
             logger.error(f"Error updating document status: {str(e)}")
             return False
     
+    async def update_document_metadata(
+        self,
+        document_id: str,
+        category: str = None,
+        tags: List[str] = None
+    ) -> bool:
+        """Update detected category and tags of a document"""
+        try:
+            client = await self._get_client()
+            data = {"category": category, "tags": tags or []}
+            await client.table(settings.DOCUMENTS_TABLE).update(data).eq("id", document_id).execute()
+            for index in self._mirrors:
+                index.set_document(document_id, category=category)
+            return True
+        except Exception as e:
+            logger.error(f"Error updating document metadata: {str(e)}")
+            return False
+    
+    async def update_document_file(
+        self,
+        document_id: str,
+        file_type: str,
+        file_size: int
+    ) -> bool:
+        """Record the file of a newly uploaded version of a document"""
+        try:
+            client = await self._get_client()
+            data = {"file_type": file_type, "file_size": file_size}
+            await client.table(settings.DOCUMENTS_TABLE).update(data).eq("id", document_id).execute()
+            return True
+        except Exception as e:
+            logger.error(f"Error updating document file: {str(e)}")
+            return False
+
+    async def find_document_by_filename(self, filename: str) -> Optional[Dict]:
+        """Get the most recently uploaded document with this filename"""
+        try:
+            client = await self._get_client()
+            response = await client.table(settings.DOCUMENTS_TABLE)\
+                .select("*")\
+                .eq("filename", filename)\
+                .order("upload_date", desc=True)\
+                .limit(1)\
+                .execute()
+            return response.data[0] if response.data else None
+        except Exception as e:
+            logger.error(f"Error finding document by filename: {str(e)}")
+            return None
+    
     async def get_document(self, document_id: str) -> Optional[Dict]:
         """Get document by ID"""
         try:
-            response = self.client.table(settings.DOCUMENTS_TABLE).select("*").eq("id", document_id).execute()
+            client = await self._get_client()
+            response = await client.table(settings.DOCUMENTS_TABLE).select("*").eq("id", document_id).execute()
             return response.data[0] if response.data else None
         except Exception as e:
             logger.error(f"Error getting document: {str(e)}")
@@ -90,14 +280,15 @@ class DatabaseManager:
     ) -> List[Dict]:
         """List documents with optional filters"""
         try:
-            query = self.client.table(settings.DOCUMENTS_TABLE).select("*")
+            client = await self._get_client()
+            query = client.table(settings.DOCUMENTS_TABLE).select("*")
             
             if category:
                 query = query.eq("category", category)
             if status:
                 query = query.eq("status", status)
             
-            response = query.order("upload_date", desc=True).limit(limit).execute()
+            response = await query.order("upload_date", desc=True).limit(limit).execute()
             return response.data
             
         except Exception as e:
@@ -107,8 +298,11 @@ class DatabaseManager:
     async def delete_document(self, document_id: str) -> bool:
         """Delete document and its embeddings"""
         try:
+            client = await self._get_client()
             # Embeddings will be deleted automatically via CASCADE
-            response = self.client.table(settings.DOCUMENTS_TABLE).delete().eq("id", document_id).execute()
+            response = await client.table(settings.DOCUMENTS_TABLE).delete().eq("id", document_id).execute()
+            for index in self._mirrors:
+                index.remove_document(document_id)
             logger.info(f"Document deleted: {document_id}")
             return True
         except Exception as e:
@@ -116,48 +310,271 @@ class DatabaseManager:
             return False
     
     # Embedding Management
-    async def insert_embeddings(
-        self,
-        document_id: str,
-        chunks: List[Dict[str, Any]]
-    ) -> bool:
-        """Insert multiple embeddings for a document"""
+    async def delete_document_embeddings(self, document_id: str) -> bool:
+        """Delete all embeddings of a document (keeps the document entry)"""
+        try:
+            client = await self._get_client()
+            await client.table(settings.EMBEDDINGS_TABLE).delete().eq("document_id", document_id).execute()
+            for index in self._mirrors:
+                index.clear_document(document_id)
+            return True
+        except Exception as e:
+            logger.error(f"Error deleting document embeddings: {str(e)}")
+            return False
+
+    # Structured Tables
+    async def replace_document_tables(self, document_id: str, tables: List[Dict[str, Any]]) -> bool:
+        """Store the structured tables of a document, replacing those of a previous version"""
         try:
-            embeddings_data = []
-            for chunk in chunks:
-                embeddings_data.append({
+            client = await self._get_client()
+            await client.table(settings.DOCUMENT_TABLES_TABLE).delete().eq("document_id", document_id).execute()
+            if tables:
+                await client.table(settings.DOCUMENT_TABLES_TABLE).insert([
+                    {
+                        "document_id": document_id,
+                        "table_index": table_index,
+                        "sheet_name": table["sheet_name"],
+                        "kind": table["kind"],
+                        "header_row": table["header_row"],
+                        "columns": table["columns"],
+                        "rows": table["rows"],
+                        "row_count": len(table["rows"])
+                    }
+                    for table_index, table in enumerate(tables)
+                ], returning=ReturnMethod.minimal).execute()
+            return True
+        except Exception as e:
+            logger.error(f"Error storing document tables: {str(e)}")
+            return False
+
+    async def get_document_tables(self, document_id: str, kind: str = None) -> List[Dict]:
+        """Get the structured tables of a document, optionally of one kind"""
+        try:
+            client = await self._get_client()
+            query = client.table(settings.DOCUMENT_TABLES_TABLE)\
+                .select("sheet_name, kind, header_row, columns, rows, row_count")\
+                .eq("document_id", document_id)
+            if kind:
+                query = query.eq("kind", kind)
+            response = await query.order("table_index").execute()
+            return response.data or []
+        except Exception as e:
+            logger.error(f"Error getting document tables: {str(e)}")
+            return []
+
+    async def get_table_rows(self, document_id: str, kind: str) -> List[Dict]:
+        """All rows of a document's tables of one kind, in sheet order (see merge_table_rows)"""
+        return merge_table_rows(await self.get_document_tables(document_id, kind), kind)
+
+    async def get_embedding_hashes(self, document_id: str) -> List[Dict]:
+        """List id, chunk_index and content_hash of a document's live chunks (raises on error)"""
+        return await self._select_all(
+            settings.EMBEDDINGS_TABLE,
+            "id, chunk_index, content_hash",
+            filters={"document_id": document_id, "pending": False},
+            order="chunk_index"
+        )
+
+    async def publish_embeddings(self, document_id: str) -> bool:
+        """Make the pending chunks of a document's new version searchable"""
+        try:
+            rows = []
+            if self._mirrors:
+                columns = "id, document_id, chunk_index, content, metadata"
+                if self.use_local_index:
+                    columns += ", embedding"
+                rows = await self._select_all(
+                    settings.EMBEDDINGS_TABLE,
+                    columns,
+                    filters={"document_id": document_id, "pending": True}
+                )
+            client = await self._get_client()
+            await client.table(settings.EMBEDDINGS_TABLE)\
+                .update({"pending": False})\
+                .eq("document_id", document_id)\
+                .eq("pending", True)\
+                .execute()
+            for index in self._mirrors:
+                index.add_chunks(document_id, rows)
+            return True
+        except Exception as e:
+            logger.error(f"Error publishing embeddings: {str(e)}")
+            return False
+
+    async def delete_pending_embeddings(self, document_id: str) -> bool:
+        """Discard the pending chunks of an unfinished new version (the live version is kept)"""
+        try:
+            client = await self._get_client()
+            await client.table(settings.EMBEDDINGS_TABLE)\
+                .delete()\
+                .eq("document_id", document_id)\
+                .eq("pending", True)\
+                .execute()
+            return True
+        except Exception as e:
+            logger.error(f"Error deleting pending embeddings: {str(e)}")
+            return False
+
+    async def delete_embeddings(self, document_id: str, embedding_ids: List[str]) -> bool:
+        """Delete specific chunks of a document"""
+        try:
+            client = await self._get_client()
+            batch_size = 100
+            for i in range(0, len(embedding_ids), batch_size):
+                await client.table(settings.EMBEDDINGS_TABLE)\
+                    .delete()\
+                    .eq("document_id", document_id)\
+                    .in_("id", embedding_ids[i:i + batch_size])\
+                    .execute()
+            for index in self._mirrors:
+                index.remove_chunks(document_id, embedding_ids)
+            return True
+        except Exception as e:
+            logger.error(f"Error deleting embeddings: {str(e)}")
+            return False
+
+    async def renumber_embeddings(self, document_id: str, chunks: List[Dict[str, Any]]) -> bool:
+        """
+        Move kept chunks to new chunk indexes without touching their vectors
+        chunks: dicts with id, chunk_index, content and content_hash
+        """
+        try:
+            client = await self._get_client()
+            rows = [
+                {
+                    "id": chunk["id"],
                     "document_id": document_id,
                     "chunk_index": chunk["chunk_index"],
                     "content": chunk["content"],
-                    "embedding": chunk["embedding"],
-                    "metadata": chunk.get("metadata", {})
-                })
-            
-            # Insert in batches of 100
-            batch_size = 100
-            for i in range(0, len(embeddings_data), batch_size):
-                batch = embeddings_data[i:i + batch_size]
-                self.client.table(settings.EMBEDDINGS_TABLE).insert(batch).execute()
-            
-            logger.info(f"Inserted {len(embeddings_data)} embeddings for document {document_id}")
+                    "content_hash": chunk["content_hash"]
+                }
+                for chunk in chunks
+            ]
+            await client.table(settings.EMBEDDINGS_TABLE).upsert(rows).execute()
+            chunk_indexes = {chunk["id"]: chunk["chunk_index"] for chunk in chunks}
+            for index in self._mirrors:
+                index.renumber_chunks(document_id, chunk_indexes)
             return True
-            
         except Exception as e:
-            logger.error(f"Error inserting embeddings: {str(e)}")
+            logger.error(f"Error renumbering embeddings: {str(e)}")
             return False
+
+    @staticmethod
+    def _split_by_payload(rows: List[Dict[str, Any]]) -> List[List[Dict[str, Any]]]:
+        """Group rows into write batches bounded by estimated payload bytes and row count"""
+        batches: List[List[Dict[str, Any]]] = []
+        batch: List[Dict[str, Any]] = []
+        batch_bytes = 0
+        for row in rows:
+            # Rough JSON size: text fields dominate, plus fixed per-row overhead
+            row_bytes = len(row["content"]) + len(row["embedding"]) + 256
+            if batch and (
+                batch_bytes + row_bytes > settings.DB_INSERT_MAX_BATCH_BYTES
+                or len(batch) >= settings.DB_INSERT_MAX_BATCH_ROWS
+            ):
+                batches.append(batch)
+                batch, batch_bytes = [], 0
+            batch.append(row)
+            batch_bytes += row_bytes
+        if batch:
+            batches.append(batch)
+        return batches
+
+    async def _write_embedding_batch(self, batch: List[Dict[str, Any]]):
+        """Upsert one batch by client-assigned id, retrying with backoff (idempotent)"""
+        client = await self._get_client()
+        for attempt in range(1, settings.DB_INSERT_RETRIES + 1):
+            try:
+                await client.table(settings.EMBEDDINGS_TABLE)\
+                    .upsert(batch, on_conflict="id", ignore_duplicates=True, returning=ReturnMethod.minimal)\
+                    .execute()
+                return
+            except Exception as e:
+                if attempt == settings.DB_INSERT_RETRIES:
+                    raise
+                delay = 0.5 * 2 ** (attempt - 1) * (1 + random.random())
+                logger.warning(
+                    f"Embedding batch of {len(batch)} rows failed (attempt {attempt}): {str(e)}; "
+                    f"retrying in {delay:.1f}s"
+                )
+                await asyncio.sleep(delay)
+
+    async def insert_embeddings(
+        self,
+        document_id: str,
+        chunks: List[Dict[str, Any]],
+        pending: bool = False
+    ) -> int:
+        """
+        Insert multiple embeddings for a document
+        Rows get client-side ids so a retried batch never duplicates rows; batches
+        are sized by payload bytes and written by several concurrent writers.
+        Pending rows stay out of search until publish_embeddings.
+        Returns the number of rows written; raises once a batch exhausts its retries.
+        """
+        if not chunks:
+            return 0
+
+        # Encode all vectors in one pass as compact pgvector literals
+        vectors = np.asarray([chunk["embedding"] for chunk in chunks], dtype=np.float32)
+        embeddings_data = []
+        for chunk, vector_text in zip(chunks, format_vectors(vectors)):
+            embeddings_data.append({
+                "id": chunk.get("id") or str(uuid.uuid4()),
+                "document_id": document_id,
+                "chunk_index": chunk["chunk_index"],
+                "content": chunk["content"],
+                "content_hash": chunk.get("content_hash"),
+                "embedding": vector_text,
+                "metadata": chunk.get("metadata", {}),
+                "pending": pending
+            })
+
+        batches = self._split_by_payload(embeddings_data)
+
+        async def write(batch: List[Dict[str, Any]]):
+            async with self._insert_writers:
+                await self._write_embedding_batch(batch)
+
+        try:
+            await asyncio.gather(*(write(batch) for batch in batches))
+        except Exception as e:
+            logger.error(f"Error inserting embeddings for document {document_id}: {str(e)}")
+            raise
+
+        if self._mirrors and not pending:
+            rows = [{**row, "embedding": vector} for row, vector in zip(embeddings_data, vectors)]
+            for index in self._mirrors:
+                index.add_chunks(document_id, rows)
+        logger.info(
+            f"Inserted {len(embeddings_data)} embeddings for document {document_id} "
+            f"in {len(batches)} batches"
+        )
+        return len(embeddings_data)
     
     async def similarity_search(
         self,
-        query_embedding: List[float],
+        query_embedding: Any,
         match_threshold: float = 0.7,
         match_count: int = 10,
         filter_category: str = None,
         filter_document_ids: List[str] = None
     ) -> List[Dict]:
-        """Perform similarity search using the database function"""
+        """Perform similarity search using the database function (or the local index)"""
         try:
+            if self.use_local_index and local_index.loaded:
+                results = local_index.search(
+                    query_embedding=query_embedding,
+                    match_threshold=match_threshold,
+                    match_count=match_count,
+                    filter_document_ids=filter_document_ids
+                )
+                logger.info(f"Local similarity search found {len(results)} results")
+                return results
+
+            client = await self._get_client()
             # Convert embedding to the format expected by pgvector
-            embedding_str = "[" + ",".join(map(str, query_embedding)) + "]"
+            embedding_str = format_vectors(query_embedding)[0]
 
             # Build RPC params
             rpc_params = {
@@ -171,7 +588,7 @@ class DatabaseManager:
                 rpc_params["filter_document_ids"] = filter_document_ids
 
             # Call the stored procedure
-            response = self.client.rpc(
+            response = await client.rpc(
                 "search_komite_audit_embeddings",
                 rpc_params
             ).execute()
@@ -183,6 +600,27 @@ class DatabaseManager:
         except Exception as e:
             logger.error(f"Error in similarity search: {str(e)}")
             return []
+
+    async def keyword_search(
+        self,
+        query: str,
+        match_count: int = 10,
+        filter_document_ids: List[str] = None
+    ) -> List[Dict]:
+        """BM25 keyword search over chunk content (empty when the index is disabled)"""
+        try:
+            if not (self.use_keyword_index and keyword_index.loaded):
+                return []
+            results = keyword_index.search(
+                query=query,
+                match_count=match_count,
+                filter_document_ids=filter_document_ids
+            )
+            logger.info(f"Keyword search found {len(results)} results")
+            return results
+        except Exception as e:
+            logger.error(f"Error in keyword search: {str(e)}")
+            return []
     
     # Conversation Management
     async def create_conversation(
@@ -197,6 +635,7 @@ class DatabaseManager:
     ) -> Dict:
         """Save conversation to database"""
         try:
+            client = await self._get_client()
             data = {
                 "session_id": session_id,
                 "user_query": user_query,
@@ -207,7 +646,7 @@ class DatabaseManager:
                 "processing_time_ms": processing_time_ms
             }
             
-            response = self.client.table(settings.CONVERSATIONS_TABLE).insert(data).execute()
+            response = await client.table(settings.CONVERSATIONS_TABLE).insert(data).execute()
             logger.info(f"Conversation saved for session: {session_id}")
             return response.data[0] if response.data else None
             
@@ -222,7 +661,8 @@ class DatabaseManager:
     ) -> List[Dict]:
         """Get conversation history for a session"""
         try:
-            response = self.client.table(settings.CONVERSATIONS_TABLE).select("*").eq("session_id", session_id).order("created_at", desc=True).limit(limit).execute()
+            client = await self._get_client()
+            response = await client.table(settings.CONVERSATIONS_TABLE).select("*").eq("session_id", session_id).order("created_at", desc=True).limit(limit).execute()
             return response.data or []
         except Exception as e:
             logger.error(f"Error getting conversation history: {str(e)}")
@@ -236,11 +676,12 @@ class DatabaseManager:
     ) -> bool:
         """Update conversation with user feedback"""
         try:
+            client = await self._get_client()
             data = {
                 "feedback_rating": rating,
                 "feedback_comment": comment
             }
-            self.client.table(settings.CONVERSATIONS_TABLE).update(data).eq("id", conversation_id).execute()
+            await client.table(settings.CONVERSATIONS_TABLE).update(data).eq("id", conversation_id).execute()
             logger.info(f"Feedback updated for conversation: {conversation_id}")
             return True
         except Exception as e:
@@ -262,6 +703,7 @@ class DatabaseManager:
     ) -> bool:
         """Log agent execution details"""
         try:
+            client = await self._get_client()
             data = {
                 "conversation_id": conversation_id,
                 "agent_name": agent_name,
@@ -274,7 +716,7 @@ class DatabaseManager:
                 "error_message": error_message
             }
             
-            self.client.table("agent_logs").insert(data).execute()
+            await client.table("agent_logs").insert(data).execute()
             return True
             
         except Exception as e:
@@ -285,7 +727,8 @@ class DatabaseManager:
     async def get_document_statistics(self) -> List[Dict]:
         """Get document statistics by category"""
         try:
-            response = self.client.table("document_statistics").select("*").execute()
+            client = await self._get_client()
+            response = await client.table("document_statistics").select("*").execute()
             return response.data or []
         except Exception as e:
             logger.error(f"Error getting document statistics: {str(e)}")
@@ -294,7 +737,8 @@ class DatabaseManager:
     async def get_agent_performance(self) -> List[Dict]:
         """Get agent performance metrics"""
         try:
-            response = self.client.table("agent_performance").select("*").execute()
+            client = await self._get_client()
+            response = await client.table("agent_performance").select("*").execute()
             return response.data or []
         except Exception as e:
             logger.error(f"Error getting agent performance: {str(e)}")
@@ -304,17 +748,19 @@ class DatabaseManager:
     async def get_document_full_text(self, document_id: str) -> Optional[str]:
         """Reconstruct full document text from embeddings chunks"""
         try:
-            response = self.client.table(settings.EMBEDDINGS_TABLE)\
-                .select("content, chunk_index")\
-                .eq("document_id", document_id)\
-                .order("chunk_index")\
-                .execute()
+            # Page through every chunk; long reports exceed the PostgREST row limit
+            rows = await self._select_all(
+                settings.EMBEDDINGS_TABLE,
+                "content, chunk_index",
+                filters={"document_id": document_id, "pending": False},
+                order="chunk_index"
+            )
 
-            if not response.data:
+            if not rows:
                 return None
 
             # Reconstruct text from ordered chunks
-            chunks = sorted(response.data, key=lambda x: x["chunk_index"])
+            chunks = sorted(rows, key=lambda x: x["chunk_index"])
             full_text = "\n\n".join([chunk["content"] for chunk in chunks])
 
             logger.info(f"Retrieved {len(chunks)} chunks for document {document_id}")
@@ -331,10 +777,12 @@ class DatabaseManager:
         analysis_type: str,
         analysis_result: Dict,
         processing_time_ms: int,
-        tokens_used: int = None
+        tokens_used: int = None,
+        cache_key: Optional[str] = None
     ) -> Optional[Dict]:
         """Save financial analysis to database"""
         try:
+            client = await self._get_client()
             data = {
                 "document_id": document_id,
                 "session_id": session_id,
@@ -346,7 +794,10 @@ class DatabaseManager:
                 "risk_level": analysis_result.get("risk_assessment", {}).get("overall_risk_level")
             }
 
-            response = self.client.table("financial_analyses").insert(data).execute()
+            if cache_key:
+                data["cache_key"] = cache_key
+
+            response = await client.table("financial_analyses").insert(data).execute()
             logger.info(f"Analysis saved for document: {document_id}")
             return response.data[0] if response.data else None
 
@@ -361,7 +812,8 @@ class DatabaseManager:
     ) -> List[Dict]:
         """Get analyses for a specific document"""
         try:
-            response = self.client.table("financial_analyses")\
+            client = await self._get_client()
+            response = await client.table("financial_analyses")\
                 .select("*, komite_audit_documents(filename, category)")\
                 .eq("document_id", document_id)\
                 .order("created_at", desc=True)\
@@ -379,18 +831,34 @@ class DatabaseManager:
     ) -> List[Dict]:
         """List all analyses with optional session filter"""
         try:
-            query = self.client.table("financial_analyses")\
+            client = await self._get_client()
+            query = client.table("financial_analyses")\
                 .select("*, komite_audit_documents(filename, category)")
 
             if session_id:
                 query = query.eq("session_id", session_id)
 
-            response = query.order("created_at", desc=True).limit(limit).execute()
+            response = await query.order("created_at", desc=True).limit(limit).execute()
             return response.data or []
         except Exception as e:
             logger.error(f"Error listing analyses: {str(e)}")
             return []
 
+    async def get_cached_result(self, table: str, cache_key: str) -> Optional[Dict]:
+        """Most recent analysis row of a result table stored under a cache key"""
+        try:
+            client = await self._get_client()
+            response = await client.table(table)\
+                .select("*")\
+                .eq("cache_key", cache_key)\
+                .order("created_at", desc=True)\
+                .limit(1)\
+                .execute()
+            return response.data[0] if response.data else None
+        except Exception as e:
+            logger.error(f"Error looking up cached result in {table}: {str(e)}")
+            return None
+
     # Risk-Audit Mapping Methods
     async def create_risk_mapping(
         self,
@@ -400,10 +868,12 @@ class DatabaseManager:
         mapping_type: str,
         mapping_result: Dict,
         processing_time_ms: int,
-        tokens_used: int = None
+        tokens_used: int = None,
+        cache_key: Optional[str] = None
     ) -> Optional[Dict]:
         """Save risk-audit mapping to database"""
         try:
+            client = await self._get_client()
             exec_summary = mapping_result.get("executive_summary", {})
             data = {
                 "risk_register_document_id": risk_register_document_id,
@@ -418,7 +888,10 @@ class DatabaseManager:
                 "critical_gaps_count": exec_summary.get("critical_gaps_count", 0)
             }
 
-            response = self.client.table("risk_audit_mappings").insert(data).execute()
+            if cache_key:
+                data["cache_key"] = cache_key
+
+            response = await client.table("risk_audit_mappings").insert(data).execute()
             logger.info(
                 f"Risk mapping saved for documents: "
                 f"{risk_register_document_id} vs {audit_plan_document_id}"
@@ -432,7 +905,8 @@ class DatabaseManager:
     async def get_risk_mapping(self, mapping_id: str) -> Optional[Dict]:
         """Get a specific risk-audit mapping by ID"""
         try:
-            response = self.client.table("risk_audit_mappings")\
+            client = await self._get_client()
+            response = await client.table("risk_audit_mappings")\
                 .select("*")\
                 .eq("id", mapping_id)\
                 .execute()
@@ -448,7 +922,8 @@ class DatabaseManager:
     ) -> List[Dict]:
         """List all risk-audit mappings with optional session filter"""
         try:
-            query = self.client.table("risk_audit_mappings")\
+            client = await self._get_client()
+            query = client.table("risk_audit_mappings")\
                 .select(
                     "*, "
                     "risk_doc:komite_audit_documents!risk_register_document_id(filename, category), "
@@ -458,7 +933,7 @@ class DatabaseManager:
             if session_id:
                 query = query.eq("session_id", session_id)
 
-            response = query.order("created_at", desc=True).limit(limit).execute()
+            response = await query.order("created_at", desc=True).limit(limit).execute()
             return response.data or []
         except Exception as e:
             logger.error(f"Error listing risk mappings: {str(e)}")
@@ -472,10 +947,12 @@ class DatabaseManager:
         analysis_type: str,
         insight_result: Dict,
         processing_time_ms: int,
-        tokens_used: int = None
+        tokens_used: int = None,
+        cache_key: Optional[str] = None
     ) -> Optional[Dict]:
         """Save executive insight analysis to database"""
         try:
+            client = await self._get_client()
             exec_summary = insight_result.get("executive_summary", {})
             card_summary = insight_result.get("executive_card_summary", {})
             exposure = insight_result.get("financial_exposure", {}).get("total_estimated_exposure", {})
@@ -496,7 +973,10 @@ class DatabaseManager:
                 "sentiment_score": sentiment.get("sentiment_score")
             }
 
-            response = self.client.table("executive_insights").insert(data).execute()
+            if cache_key:
+                data["cache_key"] = cache_key
+
+            response = await client.table("executive_insights").insert(data).execute()
             logger.info(f"Executive insight saved for document: {document_id}")
             return response.data[0] if response.data else None
 
@@ -507,7 +987,8 @@ class DatabaseManager:
     async def get_executive_insight(self, insight_id: str) -> Optional[Dict]:
         """Get a specific executive insight by ID"""
         try:
-            response = self.client.table("executive_insights")\
+            client = await self._get_client()
+            response = await client.table("executive_insights")\
                 .select("*, komite_audit_documents(filename, category)")\
                 .eq("id", insight_id)\
                 .execute()
@@ -524,7 +1005,8 @@ class DatabaseManager:
     ) -> List[Dict]:
         """List executive insights with optional filters"""
         try:
-            query = self.client.table("executive_insights")\
+            client = await self._get_client()
+            query = client.table("executive_insights")\
                 .select("*, komite_audit_documents(filename, category)")
 
             if session_id:
@@ -532,7 +1014,7 @@ class DatabaseManager:
             if risk_rating:
                 query = query.eq("overall_risk_rating", risk_rating)
 
-            response = query.order("created_at", desc=True).limit(limit).execute()
+            response = await query.order("created_at", desc=True).limit(limit).execute()
             return response.data or []
         except Exception as e:
             logger.error(f"Error listing executive insights: {str(e)}")
@@ -541,7 +1023,8 @@ class DatabaseManager:
     async def get_latest_executive_insights(self, limit: int = 5) -> List[Dict]:
         """Get latest executive insights for dashboard display"""
         try:
-            response = self.client.table("executive_insights")\
+            client = await self._get_client()
+            response = await client.table("executive_insights")\
                 .select("*, komite_audit_documents(filename, category)")\
                 .order("created_at", desc=True)\
                 .limit(limit)\
@@ -2,20 +2,25 @@
 Document Processor for RAG Komite Audit System
 Handles document upload, parsing, and processing
 """
-from typing import Dict, Optional, List
+from concurrent.futures import BrokenExecutor, ProcessPoolExecutor
+from typing import Any, AsyncIterator, Awaitable, Callable, Dict, Optional, List, Set, Tuple
+import asyncio
 import os
 import logging
 from pathlib import Path
-import PyPDF2
-from docx import Document
-import openpyxl
+from backend import text_extraction
 from backend.database import db
-from backend.embeddings import embedding_manager
-from config.config import UPLOAD_DIR, PROCESSED_DIR
+from backend.embeddings import ChunkBuilder, embedding_service
+from backend.job_queue import PermanentJobError
+from backend.semantic_cache import semantic_cache
+from config.config import settings, UPLOAD_DIR, PROCESSED_DIR
 
 logging.basicConfig(level=logging.INFO)
 logger = logging.getLogger(__name__)
 
+class DocumentRejectedError(ValueError):
+    """The document cannot be ingested as uploaded (unsupported, unreadable, without text or deleted)"""
+
 class DocumentProcessor:
     """Processes various document formats for RAG system"""
     
@@ -27,18 +32,63 @@ class DocumentProcessor:
         '.xlsx': 'Excel Spreadsheet',
         '.xls': 'Excel Spreadsheet'
     }
+
+    # Keywords for each category
+    CATEGORY_KEYWORDS = {
+        "Audit Committee Charter": ["charter", "komite audit", "audit committee", "tata kelola"],
+        "Audit Planning": ["perencanaan audit", "audit planning", "risk assessment", "program audit"],
+        "Financial Review": ["laporan keuangan", "financial statement", "auditor eksternal", "akuntan publik"],
+        "Regulatory": ["peraturan", "regulasi", "ojk", "pasar modal", "psak", "spap"],
+        "Banking": ["perbankan", "bank", "bi", "likuiditas", "kredit"],
+        "Reporting": ["laporan", "disclosure", "annual report", "pengungkapan"]
+    }
+
+    # Keywords for each tag
+    TAG_KEYWORDS = {
+        "governance": ["governance", "tata kelola", "pengelolaan"],
+        "risk": ["risk", "risiko", "risk management"],
+        "compliance": ["compliance", "kepatuhan", "regulasi"],
+        "audit": ["audit", "auditor", "pemeriksaan"],
+        "financial": ["keuangan", "financial", "laporan keuangan"],
+        "internal_control": ["pengendalian intern", "internal control"],
+        "ethics": ["etika", "ethics", "kode etik"],
+        "transparency": ["transparansi", "transparency", "keterbukaan"]
+    }
+
+    # Longest keyword; page tails this long are re-scanned so matches can span pages
+    KEYWORD_OVERLAP = max(
+        len(keyword)
+        for table in (CATEGORY_KEYWORDS, TAG_KEYWORDS)
+        for keywords in table.values()
+        for keyword in keywords
+    )
     
     def __init__(self):
+        self._executor: Optional[ProcessPoolExecutor] = None
         logger.info("Document Processor initialized")
+
+    @property
+    def executor(self) -> ProcessPoolExecutor:
+        """Lazily start the text extraction process pool"""
+        if self._executor is None:
+            workers = settings.EXTRACTION_WORKERS or os.cpu_count() or 1
+            self._executor = ProcessPoolExecutor(max_workers=workers)
+            logger.info(f"Extraction process pool started ({workers} workers)")
+        return self._executor
+
+    def close(self):
+        """Shut down the extraction process pool"""
+        if self._executor is not None:
+            self._executor.shutdown(wait=False, cancel_futures=True)
+            self._executor = None
     
     def extract_text_from_pdf(self, file_path: str) -> str:
         """Extract text from PDF file"""
         try:
-            text = ""
-            with open(file_path, 'rb') as file:
-                pdf_reader = PyPDF2.PdfReader(file)
-                for page in pdf_reader.pages:
-                    text += page.extract_text() + "\n"
+            pages = text_extraction.extract_pdf_pages(
+                file_path, 0, text_extraction.count_pdf_pages(file_path)
+            )
+            text = "".join(page + "\n" for page in pages)
             
             logger.info(f"Extracted {len(text)} characters from PDF")
             return text
@@ -49,8 +99,7 @@ class DocumentProcessor:
     def extract_text_from_docx(self, file_path: str) -> str:
         """Extract text from DOCX file"""
         try:
-            doc = Document(file_path)
-            text = "\n".join([paragraph.text for paragraph in doc.paragraphs])
+            text = text_extraction.extract_docx(file_path)
             
             logger.info(f"Extracted {len(text)} characters from DOCX")
             return text
@@ -61,8 +110,7 @@ class DocumentProcessor:
     def extract_text_from_txt(self, file_path: str) -> str:
         """Extract text from TXT file"""
         try:
-            with open(file_path, 'r', encoding='utf-8', errors='ignore') as file:
-                text = file.read()
+            text = text_extraction.extract_txt(file_path)
             
             logger.info(f"Extracted {len(text)} characters from TXT")
             return text
@@ -73,19 +121,7 @@ class DocumentProcessor:
     def extract_text_from_excel(self, file_path: str) -> str:
         """Extract text from Excel file"""
         try:
-            workbook = openpyxl.load_workbook(file_path, data_only=True)
-            text_parts = []
-            
-            for sheet_name in workbook.sheetnames:
-                sheet = workbook[sheet_name]
-                text_parts.append(f"\n=== Sheet: {sheet_name} ===\n")
-                
-                for row in sheet.iter_rows(values_only=True):
-                    row_text = " | ".join([str(cell) if cell is not None else "" for cell in row])
-                    if row_text.strip():
-                        text_parts.append(row_text)
-            
-            text = "\n".join(text_parts)
+            text = text_extraction.extract_excel(file_path)
             logger.info(f"Extracted {len(text)} characters from Excel")
             return text
         except Exception as e:
@@ -106,26 +142,73 @@ class DocumentProcessor:
             return self.extract_text_from_excel(file_path)
         else:
             raise ValueError(f"Unsupported file format: {file_ext}")
+
+    async def _extract(self, func: Callable, file_path: str, *args) -> Any:
+        """Run a parser on the process pool; a parser error means the file itself is unreadable"""
+        loop = asyncio.get_running_loop()
+        try:
+            return await loop.run_in_executor(self.executor, func, file_path, *args)
+        except BrokenExecutor:
+            raise
+        except Exception as e:
+            raise DocumentRejectedError(f"Could not read {Path(file_path).name}: {str(e)}") from e
+
+    async def extract_text_async(self, file_path: str, file_type: str) -> str:
+        """
+        Extract text of a non-PDF file on the process pool without blocking the
+        event loop (PDFs are streamed page by page by iter_pages_async)
+        """
+        file_ext = Path(file_path).suffix.lower()
+
+        try:
+            if file_ext in ['.docx', '.doc']:
+                text = await self._extract(text_extraction.extract_docx, file_path)
+            elif file_ext == '.txt':
+                text = await self._extract(text_extraction.extract_txt, file_path)
+            elif file_ext in ['.xlsx', '.xls']:
+                text = await self._extract(text_extraction.extract_excel, file_path)
+            else:
+                raise DocumentRejectedError(f"Unsupported file format: {file_ext}")
+
+            logger.info(f"Extracted {len(text)} characters from {file_ext}")
+            return text
+        except Exception as e:
+            logger.error(f"Error extracting text from {file_ext}: {str(e)}")
+            raise
     
-    def detect_category(self, text: str, filename: str) -> str:
-        """Detect document category based on content"""
+    async def extract_tables_async(self, file_path: str) -> List[Dict[str, Any]]:
+        """Structured risk register / PKPT tables of a spreadsheet ([] for other files or on failure)"""
+        if Path(file_path).suffix.lower() not in ['.xlsx', '.xlsm']:
+            return []
+        loop = asyncio.get_running_loop()
+        try:
+            tables = await loop.run_in_executor(self.executor, text_extraction.extract_excel_tables, file_path)
+            logger.info(
+                f"Extracted {len(tables)} structured tables "
+                f"({sum(len(table['rows']) for table in tables)} rows) from {Path(file_path).name}"
+            )
+            return tables
+        except Exception as e:
+            logger.warning(f"Structured table extraction failed, text only: {str(e)}")
+            return []
+
+    def match_keywords(self, text: str, found: Set[str]):
+        """Add every category/tag keyword that occurs in text to found"""
         text_lower = text.lower()
+        for table in (self.CATEGORY_KEYWORDS, self.TAG_KEYWORDS):
+            for keywords in table.values():
+                for keyword in keywords:
+                    if keyword not in found and keyword in text_lower:
+                        found.add(keyword)
+
+    def category_from_keywords(self, found: Set[str], filename: str) -> str:
+        """Pick the category with most matched keywords"""
         filename_lower = filename.lower()
         
-        # Define keywords for each category
-        category_keywords = {
-            "Audit Committee Charter": ["charter", "komite audit", "audit committee", "tata kelola"],
-            "Audit Planning": ["perencanaan audit", "audit planning", "risk assessment", "program audit"],
-            "Financial Review": ["laporan keuangan", "financial statement", "auditor eksternal", "akuntan publik"],
-            "Regulatory": ["peraturan", "regulasi", "ojk", "pasar modal", "psak", "spap"],
-            "Banking": ["perbankan", "bank", "bi", "likuiditas", "kredit"],
-            "Reporting": ["laporan", "disclosure", "annual report", "pengungkapan"]
-        }
-        
         # Count keyword matches
         category_scores = {}
-        for category, keywords in category_keywords.items():
-            score = sum(1 for keyword in keywords if keyword in text_lower or keyword in filename_lower)
+        for category, keywords in self.CATEGORY_KEYWORDS.items():
+            score = sum(1 for keyword in keywords if keyword in found or keyword in filename_lower)
             category_scores[category] = score
         
         # Return category with highest score
@@ -135,108 +218,268 @@ class DocumentProcessor:
                 return best_category[0]
         
         return "General"
+
+    def tags_from_keywords(self, found: Set[str]) -> List[str]:
+        """Tags whose keywords were matched"""
+        return [
+            tag for tag, keywords in self.TAG_KEYWORDS.items()
+            if any(keyword in found for keyword in keywords)
+        ]
+
+    def detect_category(self, text: str, filename: str) -> str:
+        """Detect document category based on content"""
+        found: Set[str] = set()
+        self.match_keywords(text, found)
+        return self.category_from_keywords(found, filename)
     
     def generate_tags(self, text: str) -> List[str]:
         """Generate tags based on content"""
-        tags = []
-        text_lower = text.lower()
-        
-        # Define tag keywords
-        tag_keywords = {
-            "governance": ["governance", "tata kelola", "pengelolaan"],
-            "risk": ["risk", "risiko", "risk management"],
-            "compliance": ["compliance", "kepatuhan", "regulasi"],
-            "audit": ["audit", "auditor", "pemeriksaan"],
-            "financial": ["keuangan", "financial", "laporan keuangan"],
-            "internal_control": ["pengendalian intern", "internal control"],
-            "ethics": ["etika", "ethics", "kode etik"],
-            "transparency": ["transparansi", "transparency", "keterbukaan"]
-        }
-        
-        for tag, keywords in tag_keywords.items():
-            if any(keyword in text_lower for keyword in keywords):
-                tags.append(tag)
-        
-        return tags
-    
+        found: Set[str] = set()
+        self.match_keywords(text, found)
+        return self.tags_from_keywords(found)
+
+    async def iter_pages_async(self, file_path: str) -> AsyncIterator[Tuple[str, int, int]]:
+        """
+        Yield (page_text, pages_done, page_count) in page order
+        PDF page ranges are extracted on the process pool with a bounded number
+        of ranges in flight; other formats yield their whole text as one page
+        """
+        file_ext = Path(file_path).suffix.lower()
+
+        if file_ext != '.pdf':
+            text = await self.extract_text_async(file_path, file_ext)
+            yield text, 1, 1
+            return
+
+        page_count = await self._extract(text_extraction.count_pdf_pages, file_path)
+        batch = max(1, settings.PDF_PAGES_PER_TASK)
+        window = max(1, settings.EXTRACTION_WORKERS or os.cpu_count() or 1)
+        starts = iter(range(0, page_count, batch))
+        pending: List[asyncio.Future] = []
+
+        def submit_next():
+            start = next(starts, None)
+            if start is not None:
+                pending.append(asyncio.ensure_future(
+                    self._extract(text_extraction.extract_pdf_pages, file_path, start, start + batch)
+                ))
+
+        try:
+            for _ in range(window):
+                submit_next()
+
+            pages_done = 0
+            while pending:
+                pages = await pending.pop(0)
+                submit_next()
+                for page in pages:
+                    pages_done += 1
+                    yield page, pages_done, page_count
+        finally:
+            for future in pending:
+                future.cancel()
+
     async def process_document(
         self,
         file_path: str,
         filename: str,
         file_type: str,
-        file_size: int
+        file_size: int,
+        document_id: str = None,
+        progress: Callable[..., Awaitable[None]] = None
     ) -> Dict:
         """
         Complete document processing pipeline:
-        1. Create database entry
-        2. Extract text
-        3. Detect category and generate tags
-        4. Chunk and embed text
-        5. Store embeddings
-        6. Update document status
+        1. Create database entry (unless document_id is given)
+        2. Stream pages -> chunks -> embedding batches -> insert batches,
+           with bounded queues between stages so memory stays flat and
+           several insert batches in flight
+        3. Detect category and generate tags from keywords seen along the way
+        4. Update document status
+        Chunks of a new document become searchable while it is still "processing".
+        With an existing document_id (re-upload or job retry) chunks are diffed
+        by content hash: unchanged chunks are kept (renumbered if they moved),
+        only new ones are embedded and inserted, and stale ones are deleted.
+        A new version of a processed document is built as pending chunks while
+        the previous version stays live; it replaces the previous version only
+        once every chunk is stored, and is discarded on failure.
         """
+        async def report(stage: str, fraction: float):
+            if progress is not None:
+                await progress(stage, fraction)
+
+        chunk_queue: asyncio.Queue = asyncio.Queue(maxsize=settings.INGEST_QUEUE_SIZE)
+        insert_queue: asyncio.Queue = asyncio.Queue(maxsize=settings.INGEST_QUEUE_SIZE)
+        batch_size = max(1, settings.INGEST_BATCH_SIZE)
+        writers = max(1, settings.DB_INSERT_WRITERS)
+        found_keywords: Set[str] = set()
+        totals = {"text_length": 0, "content_length": 0, "chunks": 0, "embedded": 0, "reused": 0}
+        existing: Dict[str, List[Dict]] = {}
+        stale_ids: List[str] = []
+        moved: List[Dict[str, Any]] = []
+        # Set for a new version of a processed document, which is staged as pending chunks
+        staged = False
+        published = False
+
+        async def produce_chunks():
+            builder = ChunkBuilder()
+            batch: List[Dict[str, Any]] = []
+            tail = ""
+
+            async for page, pages_done, page_count in self.iter_pages_async(file_path):
+                totals["text_length"] += len(page) + 1
+                totals["content_length"] += len(page.strip())
+                self.match_keywords(tail + page, found_keywords)
+                tail = page[-self.KEYWORD_OVERLAP:]
+
+                batch.extend(builder.add_text(page + "\n"))
+                while len(batch) >= batch_size:
+                    await chunk_queue.put(batch[:batch_size])
+                    batch = batch[batch_size:]
+                await report("ingesting", 0.1 + 0.8 * pages_done / page_count)
+
+            batch.extend(builder.finish())
+            if batch:
+                await chunk_queue.put(batch)
+            await chunk_queue.put(None)
+
+        async def embed_chunks():
+            while (batch := await chunk_queue.get()) is not None:
+                fresh, batch_moved = [], []
+                for chunk in batch:
+                    matches = existing.get(chunk["content_hash"])
+                    if not matches:
+                        fresh.append(chunk)
+                        continue
+                    row = matches.pop(0)
+                    totals["reused"] += 1
+                    if row["chunk_index"] != chunk["chunk_index"]:
+                        batch_moved.append({**chunk, "id": row["id"]})
+
+                embeddings = await embedding_service.embed_many(
+                    [chunk["content"] for chunk in fresh]
+                )
+                await insert_queue.put((batch_moved, [
+                    {
+                        "chunk_index": chunk["chunk_index"],
+                        "content": chunk["content"],
+                        "content_hash": chunk["content_hash"],
+                        "embedding": embedding,
+                        "metadata": {**chunk["metadata"], "filename": filename}
+                    }
+                    for chunk, embedding in zip(fresh, embeddings)
+                ], len(batch)))
+            for _ in range(writers):
+                await insert_queue.put(None)
+
+        async def store_chunks():
+            while (item := await insert_queue.get()) is not None:
+                batch_moved, fresh, count = item
+                if staged:
+                    # Live chunks keep their place until the new version is published
+                    moved.extend(batch_moved)
+                elif batch_moved and not await db.renumber_embeddings(document_id, batch_moved):
+                    raise RuntimeError("Failed to renumber embeddings")
+                if fresh:
+                    await db.insert_embeddings(document_id=document_id, chunks=fresh, pending=staged)
+                totals["embedded"] += len(fresh)
+                totals["chunks"] += count
+
         try:
             logger.info(f"Starting to process document: {filename}")
             
             # Step 1: Create document entry in database
-            document = await db.create_document(
-                filename=filename,
-                file_type=file_type,
-                file_size=file_size
-            )
-            document_id = document["id"]
-            
-            # Step 2: Extract text
-            logger.info("Extracting text from document...")
-            text = self.extract_text(file_path, file_type)
-            
-            if not text or len(text.strip()) < 50:
-                raise ValueError("Document contains insufficient text content")
-            
-            # Step 3: Detect category and generate tags
-            category = self.detect_category(text, filename)
-            tags = self.generate_tags(text)
+            if document_id is None:
+                document = await db.create_document(
+                    filename=filename,
+                    file_type=file_type,
+                    file_size=file_size
+                )
+                document_id = document["id"]
+            else:
+                document = await db.get_document(document_id)
+                if not document:
+                    raise DocumentRejectedError(f"Document not found: {document_id}")
+                staged = document.get("status") == "processed"
+                # Pending chunks left by an interrupted attempt are rebuilt from scratch
+                if staged and not await db.delete_pending_embeddings(document_id):
+                    raise RuntimeError("Failed to discard pending embeddings")
+                # Existing entry (new version or job retry): diff against its chunks
+                for row in await db.get_embedding_hashes(document_id):
+                    if row.get("content_hash"):
+                        existing.setdefault(row["content_hash"], []).append(row)
+                    else:
+                        stale_ids.append(row["id"])
+
+            if not staged:
+                await db.update_document_status(
+                    document_id=document_id,
+                    status="processing"
+                )
             
-            # Update document with category and tags
-            await db.update_document_status(
-                document_id=document_id,
-                status="processing"
-            )
+            # Step 2: Run extraction, embedding and storage as concurrent stages
+            logger.info("Streaming document through chunk/embed/store pipeline...")
+            await report("extracting", 0.1)
+            stages = [
+                asyncio.create_task(produce_chunks()),
+                asyncio.create_task(embed_chunks()),
+                *(asyncio.create_task(store_chunks()) for _ in range(writers))
+            ]
+            try:
+                done, _ = await asyncio.wait(stages, return_when=asyncio.FIRST_EXCEPTION)
+                for task in done:
+                    if task.exception() is not None:
+                        raise task.exception()
+            finally:
+                for task in stages:
+                    task.cancel()
+                await asyncio.gather(*stages, return_exceptions=True)
             
-            # Update category and tags in database
-            from config.config import settings
-            supabase_client = db.client
-            supabase_client.table(settings.DOCUMENTS_TABLE).update({
-                "category": category,
-                "tags": tags
-            }).eq("id", document_id).execute()
+            if totals["content_length"] < 50:
+                if not staged:
+                    await db.delete_document_embeddings(document_id)
+                raise DocumentRejectedError("Document contains insufficient text content")
+
+            # Swap in the new version: publish it, then drop chunks that no longer occur
+            if staged:
+                if not await db.publish_embeddings(document_id):
+                    raise RuntimeError("Failed to publish embeddings")
+                published = True
+            stale_ids.extend(row["id"] for rows in existing.values() for row in rows)
+            if stale_ids and not await db.delete_embeddings(document_id, stale_ids):
+                raise RuntimeError("Failed to delete stale embeddings")
+            if moved and not await db.renumber_embeddings(document_id, moved):
+                raise RuntimeError("Failed to renumber embeddings")
+
+            # Typed rows of risk register / PKPT sheets, kept next to the chunks
+            tables = await self.extract_tables_async(file_path)
+            if not await db.replace_document_tables(document_id, tables):
+                logger.warning(f"Structured tables of {filename} were not stored")
             
-            # Step 4: Process document for embedding (chunk and embed)
-            logger.info("Generating embeddings...")
-            processed_chunks = embedding_manager.process_document_for_embedding(
-                text=text,
-                document_metadata={
-                    "filename": filename,
-                    "category": category,
-                    "tags": tags
-                }
-            )
+            # Step 3: Category and tags from keywords matched while streaming
+            category = self.category_from_keywords(found_keywords, filename)
+            tags = self.tags_from_keywords(found_keywords)
             
-            # Step 5: Insert embeddings into database
-            logger.info(f"Storing {len(processed_chunks)} chunks in database...")
-            await db.insert_embeddings(
+            await db.update_document_metadata(
                 document_id=document_id,
-                chunks=processed_chunks
+                category=category,
+                tags=tags
             )
+            await db.update_document_file(document_id, file_type, file_size)
             
-            # Step 6: Update document status to processed
+            # Step 4: Update document status to processed
+            await report("finalizing", 0.95)
             await db.update_document_status(
                 document_id=document_id,
                 status="processed",
-                total_chunks=len(processed_chunks)
+                total_chunks=totals["chunks"]
             )
             
-            logger.info(f"Document processed successfully: {filename}")
+            semantic_cache.invalidate(f"after processing {filename}")
+            logger.info(
+                f"Document processed successfully: {filename} ({totals['chunks']} chunks, "
+                f"{totals['embedded']} embedded, {totals['reused']} reused, {len(stale_ids)} removed)"
+            )
             
             return {
                 "success": True,
@@ -244,15 +487,27 @@ class DocumentProcessor:
                 "filename": filename,
                 "category": category,
                 "tags": tags,
-                "total_chunks": len(processed_chunks),
-                "text_length": len(text)
+                "total_chunks": totals["chunks"],
+                "embedded_chunks": totals["embedded"],
+                "reused_chunks": totals["reused"],
+                "removed_chunks": len(stale_ids),
+                "tables": [
+                    {"sheet_name": table["sheet_name"], "kind": table["kind"], "row_count": len(table["rows"])}
+                    for table in tables
+                ],
+                "text_length": totals["text_length"]
             }
             
         except Exception as e:
             logger.error(f"Error processing document: {str(e)}")
             
-            # Update document status to error if document was created
-            if 'document_id' in locals():
+            if staged:
+                # The previous version stays live and keeps its status; once the new
+                # version is published, a retry diffs against it and finishes the swap
+                if not published:
+                    await db.delete_pending_embeddings(document_id)
+            elif document_id is not None:
+                # Update document status to error if document was created
                 await db.update_document_status(
                     document_id=document_id,
                     status="error"
@@ -261,8 +516,32 @@ class DocumentProcessor:
             return {
                 "success": False,
                 "error": str(e),
+                "retryable": not isinstance(e, DocumentRejectedError),
                 "filename": filename
             }
 
+    async def run_ingestion_job(
+        self,
+        payload: Dict[str, Any],
+        progress: Callable[..., Awaitable[None]]
+    ) -> Dict:
+        """
+        Job queue handler for document ingestion; raises so failures are retried,
+        except for documents that cannot be ingested as uploaded
+        """
+        result = await self.process_document(
+            file_path=payload["file_path"],
+            filename=payload["filename"],
+            file_type=payload["file_type"],
+            file_size=payload["file_size"],
+            document_id=payload.get("document_id"),
+            progress=progress
+        )
+        if not result.get("success"):
+            if result.get("retryable") is False:
+                raise PermanentJobError(result["error"])
+            raise RuntimeError(result.get("error", "Document processing failed"))
+        return result
+
 # Global document processor instance
 document_processor = DocumentProcessor()
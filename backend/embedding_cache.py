@@ -0,0 +1,141 @@
+"""
+Embedding Cache for RAG Komite Audit System
+Content-addressed cache of embeddings: in-process LRU in front of a SQLite store
+"""
+from collections import OrderedDict
+from pathlib import Path
+from typing import Dict, List, Optional
+import hashlib
+import logging
+import re
+import sqlite3
+import threading
+import numpy as np
+from config.config import settings
+
+logging.basicConfig(level=getattr(logging, settings.LOG_LEVEL))
+logger = logging.getLogger(__name__)
+
+# SQLite limits the number of bound parameters per statement
+_SQLITE_BATCH = 500
+
+
+class EmbeddingCache:
+    """Caches float32 embeddings keyed by (model name, normalized text)"""
+
+    def __init__(
+        self,
+        model_name: str,
+        path: Optional[Path] = None,
+        max_memory_items: int = 10000
+    ):
+        self.model_name = model_name
+        self.max_memory_items = max_memory_items
+        self._memory: "OrderedDict[str, np.ndarray]" = OrderedDict()
+        self._lock = threading.Lock()
+        self._conn: Optional[sqlite3.Connection] = None
+
+        self.memory_hits = 0
+        self.disk_hits = 0
+        self.misses = 0
+
+        if path is not None:
+            path.parent.mkdir(parents=True, exist_ok=True)
+            self._conn = sqlite3.connect(str(path), check_same_thread=False)
+            self._conn.execute("PRAGMA journal_mode=WAL")
+            self._conn.execute(
+                "CREATE TABLE IF NOT EXISTS embedding_cache ("
+                "key TEXT PRIMARY KEY, dim INTEGER NOT NULL, vector BLOB NOT NULL)"
+            )
+            self._conn.commit()
+
+        logger.info(
+            f"EmbeddingCache initialized (memory: {max_memory_items} items, "
+            f"disk: {path if path is not None else 'disabled'})"
+        )
+
+    @staticmethod
+    def normalize(text: str) -> str:
+        """Collapse whitespace so trivially different texts share a key"""
+        return re.sub(r"\s+", " ", text).strip()
+
+    def key(self, text: str) -> str:
+        """Content hash for a text under the current model"""
+        payload = f"{self.model_name}\0{self.normalize(text)}".encode("utf-8")
+        return hashlib.sha256(payload).hexdigest()
+
+    def _remember(self, key: str, embedding: np.ndarray):
+        """Insert into the LRU, evicting the oldest entries"""
+        self._memory[key] = embedding
+        self._memory.move_to_end(key)
+        while len(self._memory) > self.max_memory_items:
+            self._memory.popitem(last=False)
+
+    def get_many(self, texts: List[str]) -> List[Optional[np.ndarray]]:
+        """Look up embeddings; returns None for each cache miss"""
+        keys = [self.key(text) for text in texts]
+        results: List[Optional[np.ndarray]] = [None] * len(texts)
+
+        with self._lock:
+            pending: Dict[str, List[int]] = {}
+            for i, key in enumerate(keys):
+                embedding = self._memory.get(key)
+                if embedding is not None:
+                    self._memory.move_to_end(key)
+                    results[i] = embedding
+                    self.memory_hits += 1
+                else:
+                    pending.setdefault(key, []).append(i)
+
+            if pending and self._conn is not None:
+                pending_keys = list(pending.keys())
+                for start in range(0, len(pending_keys), _SQLITE_BATCH):
+                    batch = pending_keys[start:start + _SQLITE_BATCH]
+                    placeholders = ",".join("?" * len(batch))
+                    rows = self._conn.execute(
+                        f"SELECT key, vector FROM embedding_cache WHERE key IN ({placeholders})",
+                        batch
+                    ).fetchall()
+                    for key, blob in rows:
+                        embedding = np.frombuffer(blob, dtype=np.float32)
+                        self._remember(key, embedding)
+                        for i in pending.pop(key):
+                            results[i] = embedding
+                            self.disk_hits += 1
+
+            self.misses += sum(len(indices) for indices in pending.values())
+
+        return results
+
+    def put_many(self, texts: List[str], embeddings: List[np.ndarray]):
+        """Store embeddings for the given texts"""
+        rows = []
+        with self._lock:
+            for text, embedding in zip(texts, embeddings):
+                vector = np.asarray(embedding, dtype=np.float32)
+                key = self.key(text)
+                self._remember(key, vector)
+                rows.append((key, vector.shape[0], vector.tobytes()))
+
+            if self._conn is not None and rows:
+                try:
+                    self._conn.executemany(
+                        "INSERT OR REPLACE INTO embedding_cache (key, dim, vector) VALUES (?, ?, ?)",
+                        rows
+                    )
+                    self._conn.commit()
+                except sqlite3.Error as e:
+                    logger.error(f"Error writing embedding cache: {str(e)}")
+
+    def stats(self) -> Dict:
+        """Hit/miss counters for monitoring"""
+        lookups = self.memory_hits + self.disk_hits + self.misses
+        hits = self.memory_hits + self.disk_hits
+        return {
+            "model": self.model_name,
+            "memory_items": len(self._memory),
+            "memory_hits": self.memory_hits,
+            "disk_hits": self.disk_hits,
+            "misses": self.misses,
+            "hit_rate": round(hits / lookups, 4) if lookups else 0.0
+        }
@@ -3,20 +3,106 @@ Embedding Manager for RAG Komite Audit System
 Handles text embedding generation using Sentence Transformers
 """
 from sentence_transformers import SentenceTransformer
-from typing import List, Dict, Any
+from concurrent.futures import ThreadPoolExecutor
+from typing import List, Dict, Any, Optional, Tuple
+import asyncio
+import hashlib
 import numpy as np
-from config.config import settings
+from backend.embedding_cache import EmbeddingCache
+from config.config import settings, CACHE_DIR
 import logging
 
 logging.basicConfig(level=getattr(logging, settings.LOG_LEVEL))
 logger = logging.getLogger(__name__)
 
+def chunk_hash(content: str) -> str:
+    """Stable content hash used to diff chunks across re-ingests"""
+    return hashlib.sha256(content.encode("utf-8")).hexdigest()
+
+class ChunkBuilder:
+    """
+    Incremental sentence-based chunker
+    Text can be fed piece by piece (e.g. page by page); chunks are emitted as
+    soon as they are complete, so memory stays bounded by one chunk
+    """
+
+    def __init__(self, chunk_size: int = None, chunk_overlap: int = None):
+        self.chunk_size = chunk_size or settings.CHUNK_SIZE
+        self.chunk_overlap = chunk_overlap or settings.CHUNK_OVERLAP
+        self._carry = ""
+        self._current_chunk: List[str] = []
+        self._current_length = 0
+        self._chunk_index = 0
+
+    def _emit(self) -> Dict[str, Any]:
+        content = '. '.join(self._current_chunk) + '.'
+        chunk = {
+            "chunk_index": self._chunk_index,
+            "content": content,
+            "content_hash": chunk_hash(content),
+            "metadata": {
+                "word_count": self._current_length,
+                "sentence_count": len(self._current_chunk)
+            }
+        }
+        self._chunk_index += 1
+        return chunk
+
+    def _add_sentence(self, sentence: str, chunks: List[Dict[str, Any]]):
+        sentence = sentence.strip()
+        if not sentence:
+            return
+
+        sentence_length = len(sentence.split())
+
+        # If adding this sentence exceeds chunk_size, save current chunk
+        if self._current_length + sentence_length > self.chunk_size and self._current_chunk:
+            chunks.append(self._emit())
+
+            # Keep last few sentences for overlap
+            overlap_sentences = int(len(self._current_chunk) * (self.chunk_overlap / self.chunk_size))
+            self._current_chunk = self._current_chunk[-overlap_sentences:] if overlap_sentences > 0 else []
+            self._current_length = sum(len(s.split()) for s in self._current_chunk)
+
+        self._current_chunk.append(sentence)
+        self._current_length += sentence_length
+
+    def add_text(self, text: str) -> List[Dict[str, Any]]:
+        """Feed more text; returns chunks completed so far"""
+        # Split by sentences; the trailing fragment may continue in the next piece
+        sentences = (self._carry + text.replace('\n', ' ')).split('. ')
+        self._carry = sentences.pop()
+
+        chunks: List[Dict[str, Any]] = []
+        for sentence in sentences:
+            self._add_sentence(sentence, chunks)
+        return chunks
+
+    def finish(self) -> List[Dict[str, Any]]:
+        """Flush the trailing sentence and the last chunk"""
+        chunks: List[Dict[str, Any]] = []
+        self._add_sentence(self._carry, chunks)
+        self._carry = ""
+
+        if self._current_chunk:
+            chunks.append(self._emit())
+            self._current_chunk = []
+            self._current_length = 0
+        return chunks
+
 class EmbeddingManager:
     """Manages text embeddings using Sentence Transformers"""
 
     def __init__(self):
         self._model = None
         self.dimension = settings.VECTOR_DIMENSION
+        self.cache: Optional[EmbeddingCache] = None
+        if settings.EMBEDDING_CACHE_ENABLED:
+            self.cache = EmbeddingCache(
+                model_name=settings.EMBEDDING_MODEL,
+                path=CACHE_DIR / "embeddings.sqlite3" if settings.EMBEDDING_CACHE_PERSIST else None,
+                max_memory_items=settings.EMBEDDING_CACHE_MEMORY_ITEMS
+            )
         logger.info("EmbeddingManager initialized (model will load on first use)")
 
     @property
@@ -31,20 +117,73 @@ class EmbeddingManager:
     def generate_embedding(self, text: str) -> List[float]:
         """Generate embedding for a single text"""
         try:
-            embedding = self.model.encode(text, convert_to_numpy=True)
-            return embedding.tolist()
+            return self._encode_with_cache([text], show_progress_bar=False)[0].tolist()
         except Exception as e:
             logger.error(f"Error generating embedding: {str(e)}")
             raise
     
-    def generate_embeddings_batch(self, texts: List[str]) -> List[List[float]]:
+    def generate_embeddings_batch(
+        self,
+        texts: List[str],
+        show_progress_bar: bool = True
+    ) -> List[List[float]]:
         """Generate embeddings for multiple texts"""
+        return self.generate_embeddings_array(texts, show_progress_bar).tolist()
+
+    def generate_embeddings_array(
+        self,
+        texts: List[str],
+        show_progress_bar: bool = False
+    ) -> np.ndarray:
+        """Generate embeddings as one contiguous (n, dim) float32 matrix"""
         try:
-            embeddings = self.model.encode(texts, convert_to_numpy=True, show_progress_bar=True)
-            return embeddings.tolist()
+            if not texts:
+                return np.empty((0, settings.VECTOR_DIMENSION), dtype=np.float32)
+            embeddings = self._encode_with_cache(texts, show_progress_bar=show_progress_bar)
+            return np.ascontiguousarray(np.stack(embeddings), dtype=np.float32)
         except Exception as e:
             logger.error(f"Error generating batch embeddings: {str(e)}")
             raise
+
+    def _encode_with_cache(
+        self,
+        texts: List[str],
+        show_progress_bar: bool = False
+    ) -> List[np.ndarray]:
+        """Encode texts, serving cache hits and only running the model on misses"""
+        if self.cache is None:
+            return list(self.model.encode(
+                texts,
+                convert_to_numpy=True,
+                show_progress_bar=show_progress_bar
+            ))
+
+        embeddings = self.cache.get_many(texts)
+        missing: Dict[str, List[int]] = {}
+        for i, embedding in enumerate(embeddings):
+            if embedding is None:
+                missing.setdefault(texts[i], []).append(i)
+
+        if missing:
+            miss_texts = list(missing.keys())
+            encoded = self.model.encode(
+                miss_texts,
+                convert_to_numpy=True,
+                show_progress_bar=show_progress_bar and len(miss_texts) > 1
+            ).astype(np.float32)
+            self.cache.put_many(miss_texts, list(encoded))
+            for text, embedding in zip(miss_texts, encoded):
+                for i in missing[text]:
+                    embeddings[i] = embedding
+            logger.debug(f"Encoded {len(miss_texts)} of {len(texts)} texts (rest from cache)")
+
+        return embeddings
+
+    def cache_stats(self) -> Dict:
+        """Embedding cache hit/miss counters"""
+        if self.cache is None:
+            return {"enabled": False}
+        return {"enabled": True, **self.cache.stats()}
     
     def cosine_similarity(self, embedding1: List[float], embedding2: List[float]) -> float:
         """Calculate cosine similarity between two embeddings"""
@@ -70,99 +209,116 @@ class EmbeddingManager:
     ) -> List[Dict[str, Any]]:
         """
         Split text into overlapping chunks
-        Returns list of dicts with chunk_index, content, and metadata
+        Returns list of dicts with chunk_index, content, content_hash, and metadata
         """
-        chunk_size = chunk_size or settings.CHUNK_SIZE
-        chunk_overlap = chunk_overlap or settings.CHUNK_OVERLAP
-        
-        # Split by sentences first for better semantic chunks
-        sentences = text.replace('\n', ' ').split('. ')
-        
-        chunks = []
-        current_chunk = []
-        current_length = 0
-        chunk_index = 0
-        
-        for sentence in sentences:
-            sentence = sentence.strip()
-            if not sentence:
-                continue
-            
-            sentence_length = len(sentence.split())
-            
-            # If adding this sentence exceeds chunk_size, save current chunk
-            if current_length + sentence_length > chunk_size and current_chunk:
-                chunk_text = '. '.join(current_chunk) + '.'
-                chunks.append({
-                    "chunk_index": chunk_index,
-                    "content": chunk_text,
-                    "metadata": {
-                        "word_count": current_length,
-                        "sentence_count": len(current_chunk)
-                    }
-                })
-                chunk_index += 1
-                
-                # Keep last few sentences for overlap
-                overlap_sentences = int(len(current_chunk) * (chunk_overlap / chunk_size))
-                current_chunk = current_chunk[-overlap_sentences:] if overlap_sentences > 0 else []
-                current_length = sum(len(s.split()) for s in current_chunk)
-            
-            current_chunk.append(sentence)
-            current_length += sentence_length
-        
-        # Add the last chunk
-        if current_chunk:
-            chunk_text = '. '.join(current_chunk) + '.'
-            chunks.append({
-                "chunk_index": chunk_index,
-                "content": chunk_text,
-                "metadata": {
-                    "word_count": current_length,
-                    "sentence_count": len(current_chunk)
-                }
-            })
+        builder = ChunkBuilder(chunk_size, chunk_overlap)
+        chunks = builder.add_text(text) + builder.finish()
         
         logger.info(f"Text split into {len(chunks)} chunks")
         return chunks
-    
-    def process_document_for_embedding(
+
+class EmbeddingService:
+    """
+    Async front-end for EmbeddingManager
+    Runs inference in a dedicated executor and micro-batches concurrent
+    single-text requests into one encode call
+    """
+
+    def __init__(
         self,
-        text: str,
-        document_metadata: Dict = None
-    ) -> List[Dict[str, Any]]:
-        """
-        Process a document: chunk it and generate embeddings
-        Returns list of dicts with chunk_index, content, embedding, and metadata
-        """
-        try:
-            # Chunk the text
-            chunks = self.chunk_text(text)
-            
-            # Generate embeddings for all chunks
-            chunk_texts = [chunk["content"] for chunk in chunks]
-            embeddings = self.generate_embeddings_batch(chunk_texts)
-            
-            # Combine chunks with embeddings
-            processed_chunks = []
-            for i, chunk in enumerate(chunks):
-                processed_chunk = {
-                    "chunk_index": chunk["chunk_index"],
-                    "content": chunk["content"],
-                    "embedding": embeddings[i],
-                    "metadata": {
-                        **chunk["metadata"],
-                        **(document_metadata or {})
-                    }
-                }
-                processed_chunks.append(processed_chunk)
-            
-            logger.info(f"Processed document into {len(processed_chunks)} embedded chunks")
-            return processed_chunks
-            
-        except Exception as e:
-            logger.error(f"Error processing document for embedding: {str(e)}")
-            raise
+        manager: EmbeddingManager,
+        max_batch_size: int = None,
+        batch_window_ms: float = None,
+        workers: int = None
+    ):
+        self.manager = manager
+        self.max_batch_size = max_batch_size or settings.EMBEDDING_MAX_BATCH_SIZE
+        self.batch_window = (batch_window_ms or settings.EMBEDDING_BATCH_WINDOW_MS) / 1000
+        self._executor = ThreadPoolExecutor(
+            max_workers=workers or settings.EMBEDDING_WORKERS,
+            thread_name_prefix="embedding"
+        )
+        self._queue: Optional[asyncio.Queue] = None
+        self._batch_task: Optional[asyncio.Task] = None
+        logger.info(
+            f"EmbeddingService initialized (batch size: {self.max_batch_size}, "
+            f"window: {self.batch_window * 1000:.0f}ms)"
+        )
+
+    def _ensure_batch_task(self):
+        """Start the micro-batching loop on the running event loop"""
+        if self._batch_task is None or self._batch_task.done():
+            self._queue = asyncio.Queue()
+            self._batch_task = asyncio.get_running_loop().create_task(self._batch_loop())
+
+    async def _run(self, func, *args):
+        """Run a blocking call on the embedding executor"""
+        loop = asyncio.get_running_loop()
+        return await loop.run_in_executor(self._executor, func, *args)
+
+    async def _collect_batch(self) -> List[Tuple[str, asyncio.Future]]:
+        """Wait for one request, then gather more until the window closes or the batch is full"""
+        loop = asyncio.get_running_loop()
+        batch = [await self._queue.get()]
+        deadline = loop.time() + self.batch_window
+
+        while len(batch) < self.max_batch_size:
+            remaining = deadline - loop.time()
+            if remaining <= 0:
+                break
+            try:
+                batch.append(await asyncio.wait_for(self._queue.get(), remaining))
+            except asyncio.TimeoutError:
+                break
+
+        return batch
+
+    async def _batch_loop(self):
+        """Encode queued single-text requests in micro-batches"""
+        while True:
+            batch = await self._collect_batch()
+            texts = [text for text, _ in batch]
+
+            try:
+                embeddings = await self._run(
+                    self.manager.generate_embeddings_array, texts, False
+                )
+            except Exception as e:
+                logger.error(f"Error in embedding micro-batch: {str(e)}")
+                for _, future in batch:
+                    if not future.done():
+                        future.set_exception(e)
+                continue
+
+            for (_, future), embedding in zip(batch, embeddings):
+                if not future.done():
+                    future.set_result(embedding)
+
+    async def embed(self, text: str) -> np.ndarray:
+        """Embed a single text (float32 vector), sharing an encode call with concurrent requests"""
+        self._ensure_batch_task()
+        future = asyncio.get_running_loop().create_future()
+        await self._queue.put((text, future))
+        return await future
+
+    async def embed_many(
+        self,
+        texts: List[str],
+        show_progress_bar: bool = False
+    ) -> np.ndarray:
+        """Embed many texts in one encode call off the event loop; returns a (n, dim) float32 matrix"""
+        return await self._run(self.manager.generate_embeddings_array, texts, show_progress_bar)
+
+    async def close(self):
+        """Stop the batching loop and release the executor"""
+        if self._batch_task is not None:
+            self._batch_task.cancel()
+            self._batch_task = None
+        self._executor.shutdown(wait=False)
+        logger.info("EmbeddingService stopped")
 
 # Global embedding manager instance
 embedding_manager = EmbeddingManager()
+
+# Global async embedding service instance
+embedding_service = EmbeddingService(embedding_manager)
@@ -0,0 +1,240 @@
+"""
+Job Queue for RAG Komite Audit System
+Durable SQLite-backed job queue with a bounded asyncio worker pool
+"""
+from typing import Any, Awaitable, Callable, Dict, List, Optional
+from pathlib import Path
+import asyncio
+import json
+import logging
+import random
+import sqlite3
+import threading
+import time
+import uuid
+from config.config import settings, DATA_DIR
+
+logging.basicConfig(level=getattr(logging, settings.LOG_LEVEL))
+logger = logging.getLogger(__name__)
+
+# Job states
+QUEUED = "queued"
+RUNNING = "running"
+COMPLETED = "completed"
+FAILED = "failed"
+
+ProgressCallback = Callable[..., Awaitable[None]]
+
+
+class PermanentJobError(Exception):
+    """Raised by a handler for failures a retry cannot fix (bad input, nothing to process)"""
+
+
+JobHandler = Callable[[Dict[str, Any], ProgressCallback], Awaitable[Dict[str, Any]]]
+
+
+class JobQueue:
+    """
+    Persists jobs in SQLite so unfinished work survives restarts
+    Handlers are registered per job kind and receive (payload, progress)
+    """
+
+    def __init__(self, path: Path, workers: int = 2, max_attempts: int = 3):
+        self.path = path
+        self.workers = workers
+        self.max_attempts = max_attempts
+        self._handlers: Dict[str, JobHandler] = {}
+        self._queue: Optional[asyncio.Queue] = None
+        self._tasks: List[asyncio.Task] = []
+        self._lock = threading.Lock()
+
+        # Opened on first use, so importing the module creates no files
+        self._conn: Optional[sqlite3.Connection] = None
+
+    def _connect(self) -> sqlite3.Connection:
+        """The job database connection, creating the database on first use"""
+        if self._conn is None:
+            self.path.parent.mkdir(parents=True, exist_ok=True)
+            conn = sqlite3.connect(str(self.path), check_same_thread=False)
+            conn.row_factory = sqlite3.Row
+            conn.execute("PRAGMA journal_mode=WAL")
+            conn.execute("""
+                CREATE TABLE IF NOT EXISTS jobs (
+                    id TEXT PRIMARY KEY,
+                    kind TEXT NOT NULL,
+                    status TEXT NOT NULL,
+                    payload TEXT NOT NULL,
+                    stage TEXT,
+                    progress REAL DEFAULT 0,
+                    partial TEXT,
+                    result TEXT,
+                    error TEXT,
+                    attempts INTEGER DEFAULT 0,
+                    created_at REAL NOT NULL,
+                    updated_at REAL NOT NULL
+                )
+            """)
+            conn.execute("CREATE INDEX IF NOT EXISTS idx_jobs_status ON jobs(status)")
+            conn.commit()
+            self._conn = conn
+            logger.info(f"Job queue opened at {self.path} ({self.workers} workers)")
+        return self._conn
+
+    def register(self, kind: str, handler: JobHandler):
+        """Register the coroutine that executes jobs of a kind"""
+        self._handlers[kind] = handler
+
+    def _update(self, job_id: str, **fields):
+        fields["updated_at"] = time.time()
+        for key in ("payload", "partial", "result"):
+            if key in fields and fields[key] is not None:
+                fields[key] = json.dumps(fields[key], default=str)
+        columns = ", ".join(f"{key} = ?" for key in fields)
+        with self._lock:
+            conn = self._connect()
+            conn.execute(
+                f"UPDATE jobs SET {columns} WHERE id = ?",
+                [*fields.values(), job_id]
+            )
+            conn.commit()
+
+    def _row_to_job(self, row: sqlite3.Row) -> Dict:
+        job = dict(row)
+        for key in ("payload", "partial", "result"):
+            job[key] = json.loads(job[key]) if job[key] else None
+        return job
+
+    def get(self, job_id: str) -> Optional[Dict]:
+        """Get a job with its status, progress and result"""
+        with self._lock:
+            row = self._connect().execute("SELECT * FROM jobs WHERE id = ?", (job_id,)).fetchone()
+        return self._row_to_job(row) if row else None
+
+    def list(self, kind: str = None, status: str = None, limit: int = 50) -> List[Dict]:
+        """List recent jobs with optional filters"""
+        query = "SELECT * FROM jobs WHERE 1 = 1"
+        params: List[Any] = []
+        if kind:
+            query += " AND kind = ?"
+            params.append(kind)
+        if status:
+            query += " AND status = ?"
+            params.append(status)
+        query += " ORDER BY created_at DESC LIMIT ?"
+        params.append(limit)
+        with self._lock:
+            rows = self._connect().execute(query, params).fetchall()
+        return [self._row_to_job(row) for row in rows]
+
+    async def submit(self, kind: str, payload: Dict[str, Any]) -> str:
+        """Persist a new job and schedule it"""
+        if kind not in self._handlers:
+            raise ValueError(f"No handler registered for job kind: {kind}")
+
+        job_id = str(uuid.uuid4())
+        now = time.time()
+        with self._lock:
+            conn = self._connect()
+            conn.execute(
+                "INSERT INTO jobs (id, kind, status, payload, stage, created_at, updated_at) "
+                "VALUES (?, ?, ?, ?, ?, ?, ?)",
+                (job_id, kind, QUEUED, json.dumps(payload, default=str), QUEUED, now, now)
+            )
+            conn.commit()
+
+        if self._queue is not None:
+            await self._queue.put(job_id)
+        logger.info(f"Job {job_id} ({kind}) queued")
+        return job_id
+
+    async def start(self):
+        """Start workers and re-queue jobs left unfinished by a previous process"""
+        self._queue = asyncio.Queue()
+        with self._lock:
+            rows = self._connect().execute(
+                "SELECT id FROM jobs WHERE status IN (?, ?) ORDER BY created_at",
+                (QUEUED, RUNNING)
+            ).fetchall()
+        for row in rows:
+            self._update(row["id"], status=QUEUED, stage="resumed")
+            self._queue.put_nowait(row["id"])
+        if rows:
+            logger.info(f"Resumed {len(rows)} unfinished jobs")
+
+        self._tasks = [
+            asyncio.create_task(self._worker(i))
+            for i in range(self.workers)
+        ]
+
+    async def stop(self):
+        """Stop workers; running jobs are resumed on next start"""
+        for task in self._tasks:
+            task.cancel()
+        await asyncio.gather(*self._tasks, return_exceptions=True)
+        self._tasks = []
+        self._queue = None
+
+    async def _worker(self, worker_id: int):
+        while True:
+            job_id = await self._queue.get()
+            try:
+                await self._run(job_id)
+            except Exception as e:
+                logger.error(f"Worker {worker_id} failed on job {job_id}: {str(e)}")
+            finally:
+                self._queue.task_done()
+
+    async def _run(self, job_id: str):
+        job = self.get(job_id)
+        if not job or job["status"] not in (QUEUED, RUNNING):
+            return
+
+        handler = self._handlers.get(job["kind"])
+        if handler is None:
+            self._update(job_id, status=FAILED, error=f"Unknown job kind: {job['kind']}")
+            return
+
+        attempts = job["attempts"] + 1
+        self._update(job_id, status=RUNNING, stage="started", attempts=attempts)
+
+        async def progress(stage: str, fraction: float = None, partial: Dict = None):
+            fields: Dict[str, Any] = {"stage": stage}
+            if fraction is not None:
+                fields["progress"] = round(min(max(fraction, 0.0), 1.0), 4)
+            if partial is not None:
+                fields["partial"] = partial
+            self._update(job_id, **fields)
+
+        try:
+            result = await handler(job["payload"], progress)
+            self._update(job_id, status=COMPLETED, stage="completed", progress=1.0, result=result, error=None)
+            logger.info(f"Job {job_id} ({job['kind']}) completed")
+
+        except asyncio.CancelledError:
+            # Shutdown: leave as running so the next start resumes it
+            raise
+
+        except PermanentJobError as e:
+            logger.error(f"Job {job_id} failed permanently: {str(e)}")
+            self._update(job_id, status=FAILED, stage="failed", error=str(e))
+
+        except Exception as e:
+            if attempts < self.max_attempts:
+                delay = min(2 ** attempts, 60) + random.uniform(0, 1)
+                logger.warning(
+                    f"Job {job_id} attempt {attempts} failed: {str(e)}; retrying in {delay:.1f}s"
+                )
+                self._update(job_id, status=QUEUED, stage="retrying", error=str(e))
+                if self._queue is not None:
+                    asyncio.get_running_loop().call_later(delay, self._queue.put_nowait, job_id)
+            else:
+                logger.error(f"Job {job_id} failed after {attempts} attempts: {str(e)}")
+                self._update(job_id, status=FAILED, stage="failed", error=str(e))
+
+
+# Global job queue instance
+job_queue = JobQueue(
+    DATA_DIR / "jobs.sqlite3",
+    workers=settings.JOB_WORKERS,
+    max_attempts=settings.JOB_MAX_ATTEMPTS
+)
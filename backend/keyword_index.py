@@ -0,0 +1,209 @@
+"""
+Keyword Index for RAG Komite Audit System
+In-process BM25 inverted index over chunk content, fused with vector search so
+exact regulatory terms (e.g. "POJK 55/2015", "PSAK 71", "SPAP") are matched
+"""
+from typing import Any, Dict, Hashable, List, Set
+import math
+import re
+import threading
+import logging
+from backend.vector_index import SEARCHABLE_STATUSES
+from config.config import settings
+
+logging.basicConfig(level=getattr(logging, settings.LOG_LEVEL))
+logger = logging.getLogger(__name__)
+
+# Words joined by . / - stay one token ("55/2015", "no.33") and are also split into parts
+TOKEN_PATTERN = re.compile(r"[a-z0-9]+(?:[./-][a-z0-9]+)*")
+TOKEN_SEPARATORS = re.compile(r"[./-]")
+
+# Very common Indonesian/English words that only add posting-list work
+STOPWORDS = {
+    "yang", "dan", "di", "ke", "dari", "untuk", "dengan", "dalam", "pada", "adalah",
+    "ini", "itu", "atau", "apa", "bagaimana", "oleh", "sebagai", "akan", "tidak",
+    "the", "of", "and", "to", "in", "is", "a", "an", "for", "on", "what", "how"
+}
+
+
+def tokenize(text: str) -> List[str]:
+    """Lowercase word tokens, keeping compound identifiers alongside their parts"""
+    tokens = []
+    for token in TOKEN_PATTERN.findall(text.lower()):
+        if token in STOPWORDS:
+            continue
+        tokens.append(token)
+        if TOKEN_SEPARATORS.search(token):
+            tokens.extend(part for part in TOKEN_SEPARATORS.split(token) if part)
+    return tokens
+
+
+def reciprocal_rank_fusion(
+    rankings: List[List[Dict[str, Any]]],
+    key: str = "id",
+    k: int = 60
+) -> List[Dict[str, Any]]:
+    """
+    Merge ranked result lists by summing 1 / (k + rank) per item
+    The first occurrence of each item is kept, with its fused score in "rrf_score"
+    """
+    fused: Dict[Hashable, Dict[str, Any]] = {}
+    for ranking in rankings:
+        for rank, item in enumerate(ranking, start=1):
+            entry = fused.setdefault(item[key], {**item, "rrf_score": 0.0})
+            entry["rrf_score"] += 1.0 / (k + rank)
+    return sorted(fused.values(), key=lambda item: item["rrf_score"], reverse=True)
+
+
+class KeywordIndex:
+    """
+    BM25 over chunk content, kept in sync with komite_audit_embeddings
+    Rows are identified by embedding id; only chunks of searchable documents are returned
+    """
+
+    def __init__(self, k1: float = 1.5, b: float = 0.75):
+        self.k1 = k1
+        self.b = b
+        self.loaded = False
+        self._lock = threading.Lock()
+        self._statuses: Dict[str, str] = {}
+        self._chunks: Dict[str, Dict[str, Any]] = {}
+        self._document_chunks: Dict[str, Set[str]] = {}
+        self._postings: Dict[str, Dict[str, int]] = {}
+        self._total_length = 0
+
+    @staticmethod
+    def _row_key(document_id: str, chunk: Dict[str, Any]) -> str:
+        return chunk.get("id") or f"{document_id}:{chunk['chunk_index']}"
+
+    def set_document(self, document_id: str, status: str = None, **_):
+        """Track document status (other document fields are not needed here)"""
+        with self._lock:
+            if status is not None:
+                self._statuses[document_id] = status
+
+    def _remove(self, key: str):
+        """Drop one chunk from the postings; caller holds the lock"""
+        chunk = self._chunks.pop(key, None)
+        if chunk is None:
+            return
+        for term in chunk["terms"]:
+            postings = self._postings.get(term)
+            if postings is not None:
+                postings.pop(key, None)
+                if not postings:
+                    del self._postings[term]
+        self._total_length -= chunk["length"]
+        self._document_chunks.get(chunk["document_id"], set()).discard(key)
+
+    def add_chunks(self, document_id: str, chunks: List[Dict[str, Any]]):
+        """Index (or re-index by id) chunks of a document"""
+        with self._lock:
+            for chunk in chunks:
+                key = self._row_key(document_id, chunk)
+                self._remove(key)
+
+                tokens = tokenize(chunk["content"])
+                frequencies: Dict[str, int] = {}
+                for token in tokens:
+                    frequencies[token] = frequencies.get(token, 0) + 1
+                for term, count in frequencies.items():
+                    self._postings.setdefault(term, {})[key] = count
+
+                self._chunks[key] = {
+                    "id": chunk.get("id"),
+                    "document_id": document_id,
+                    "chunk_index": chunk["chunk_index"],
+                    "content": chunk["content"],
+                    "metadata": chunk.get("metadata") or {},
+                    "terms": list(frequencies),
+                    "length": len(tokens)
+                }
+                self._total_length += len(tokens)
+                self._document_chunks.setdefault(document_id, set()).add(key)
+
+    def remove_chunks(self, document_id: str, chunk_ids: List[str]):
+        """Remove specific chunks of a document by id"""
+        with self._lock:
+            for key in chunk_ids:
+                self._remove(key)
+
+    def renumber_chunks(self, document_id: str, chunk_indexes: Dict[str, int]):
+        """Move kept chunks (by id) to their new chunk_index after a re-ingest"""
+        with self._lock:
+            for key, chunk_index in chunk_indexes.items():
+                if key in self._chunks:
+                    self._chunks[key]["chunk_index"] = chunk_index
+
+    def clear_document(self, document_id: str):
+        """Drop all chunks of a document but keep its status"""
+        with self._lock:
+            for key in list(self._document_chunks.pop(document_id, ())):
+                self._remove(key)
+
+    def remove_document(self, document_id: str):
+        """Drop a document and all its chunks"""
+        self.clear_document(document_id)
+        with self._lock:
+            self._statuses.pop(document_id, None)
+
+    def search(
+        self,
+        query: str,
+        match_count: int = 10,
+        filter_document_ids: List[str] = None
+    ) -> List[Dict]:
+        """Return chunks ordered by BM25 score (only chunks sharing a query term)"""
+        terms = list(dict.fromkeys(tokenize(query)))
+        allowed = set(filter_document_ids) if filter_document_ids else None
+
+        with self._lock:
+            total = len(self._chunks)
+            if not total or not terms:
+                return []
+            average_length = self._total_length / total or 1.0
+
+            scores: Dict[str, float] = {}
+            for term in terms:
+                postings = self._postings.get(term)
+                if not postings:
+                    continue
+                idf = math.log(1 + (total - len(postings) + 0.5) / (len(postings) + 0.5))
+                for key, frequency in postings.items():
+                    length = self._chunks[key]["length"]
+                    norm = frequency + self.k1 * (1 - self.b + self.b * length / average_length)
+                    scores[key] = scores.get(key, 0.0) + idf * frequency * (self.k1 + 1) / norm
+
+            results = []
+            for key, score in sorted(scores.items(), key=lambda item: item[1], reverse=True):
+                chunk = self._chunks[key]
+                document_id = chunk["document_id"]
+                if self._statuses.get(document_id) not in SEARCHABLE_STATUSES:
+                    continue
+                if allowed is not None and document_id not in allowed:
+                    continue
+                results.append({
+                    "id": chunk["id"] or key,
+                    "document_id": document_id,
+                    "chunk_index": chunk["chunk_index"],
+                    "content": chunk["content"],
+                    "metadata": chunk["metadata"],
+                    "bm25_score": score
+                })
+                if len(results) >= match_count:
+                    break
+            return results
+
+    def stats(self) -> Dict:
+        """Index size for monitoring"""
+        with self._lock:
+            return {
+                "loaded": self.loaded,
+                "documents": len(self._document_chunks),
+                "chunks": len(self._chunks),
+                "terms": len(self._postings)
+            }
+
+
+# Global keyword index instance
+keyword_index = KeywordIndex()
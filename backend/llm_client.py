@@ -2,11 +2,15 @@
 LLM Client for RAG Komite Audit System
 Handles communication with Groq API (responses) and GLM/Zhipu AI (routing)
 """
-from groq import AsyncGroq
+from groq import AsyncGroq, APIConnectionError, APIStatusError, RateLimitError
 import httpx
-from typing import List, Dict, Optional
+from typing import Any, AsyncIterator, List, Dict, Optional, Tuple
+import asyncio
 import json
 import logging
+from backend import context_packer
+from backend.rate_limiter import rate_limiter, retry_after_seconds, backoff_delay
+from backend.usage_tracker import usage_tracker
 from config.config import settings
 
 logging.basicConfig(level=getattr(logging, settings.LOG_LEVEL))
@@ -15,6 +19,18 @@ logger = logging.getLogger(__name__)
 # Zhipu AI API endpoint (OpenAI-compatible)
 ZHIPU_API_URL = "https://open.bigmodel.cn/api/paas/v4/chat/completions"
 
+# Groq status codes worth retrying besides 5xx
+RETRYABLE_STATUS_CODES = {408, 409, 429}
+
+
+def _is_retryable(error: Exception) -> bool:
+    """Rate limits, server errors, timeouts and dropped connections"""
+    if isinstance(error, APIConnectionError):
+        return True
+    return isinstance(error, APIStatusError) and (
+        error.status_code in RETRYABLE_STATUS_CODES or error.status_code >= 500
+    )
+
 
 class GLMClient:
     """Client for interacting with Zhipu AI (GLM) API - used for query routing"""
@@ -26,8 +42,55 @@ class GLMClient:
         else:
             self.api_key = settings.GLM_API_KEY
         self.model = settings.GLM_MODEL
+        self._http_client: Optional[httpx.AsyncClient] = None
+        self._connect_lock = asyncio.Lock()
         logger.info(f"GLM Client initialized with model: {self.model}")
 
+    async def connect(self) -> Optional[httpx.AsyncClient]:
+        """Create the long-lived HTTP client (keep-alive pool, HTTP/2 when available)"""
+        if not self.api_key:
+            return None
+        async with self._connect_lock:
+            if self._http_client is None:
+                http2 = settings.GLM_HTTP2
+                if http2:
+                    try:
+                        import h2  # noqa: F401
+                    except ImportError:
+                        logger.warning("h2 package not installed, GLM client falls back to HTTP/1.1")
+                        http2 = False
+                self._http_client = httpx.AsyncClient(
+                    http2=http2,
+                    timeout=settings.GLM_TIMEOUT_SECONDS,
+                    limits=httpx.Limits(
+                        max_connections=settings.GLM_POOL_MAX_CONNECTIONS,
+                        max_keepalive_connections=settings.GLM_POOL_MAX_KEEPALIVE,
+                        keepalive_expiry=settings.GLM_KEEPALIVE_EXPIRY_SECONDS
+                    ),
+                    headers={
+                        "Authorization": f"Bearer {self.api_key}",
+                        "Content-Type": "application/json"
+                    }
+                )
+                logger.info(
+                    f"GLM HTTP client connected "
+                    f"(pool size: {settings.GLM_POOL_MAX_CONNECTIONS}, HTTP/2: {http2})"
+                )
+        return self._http_client
+
+    async def close(self):
+        """Release pooled connections"""
+        if self._http_client is not None:
+            await self._http_client.aclose()
+        self._http_client = None
+        logger.info("GLM Client connections closed")
+
+    async def _get_client(self) -> httpx.AsyncClient:
+        """Return the pooled client, connecting lazily if needed"""
+        if self._http_client is None:
+            return await self.connect()
+        return self._http_client
+
     async def route_query(self, query: str, system_prompt: str) -> Dict:
         """Route query to appropriate agent using GLM"""
         if not self.api_key:
@@ -44,11 +107,6 @@ class GLMClient:
                 {"role": "user", "content": f"Pertanyaan: {query}"}
             ]
 
-            headers = {
-                "Authorization": f"Bearer {self.api_key}",
-                "Content-Type": "application/json"
-            }
-
             payload = {
                 "model": self.model,
                 "messages": messages,
@@ -57,10 +115,10 @@ class GLMClient:
                 "response_format": {"type": "json_object"}
             }
 
-            async with httpx.AsyncClient(timeout=30.0) as client:
-                response = await client.post(ZHIPU_API_URL, headers=headers, json=payload)
-                response.raise_for_status()
-                data = response.json()
+            client = await self._get_client()
+            response = await client.post(ZHIPU_API_URL, json=payload)
+            response.raise_for_status()
+            data = response.json()
 
             result = data["choices"][0]["message"]["content"]
             routing_decision = json.loads(result)
@@ -83,7 +141,8 @@ class LLMClient:
     """Client for interacting with Groq API"""
     
     def __init__(self):
-        self.client = AsyncGroq(api_key=settings.GROQ_API_KEY)
+        # Retries are done here so they go through the shared rate limiter
+        self.client = AsyncGroq(api_key=settings.GROQ_API_KEY, max_retries=0)
         self.model = settings.GROQ_MODEL
         self.temperature = settings.AGENT_TEMPERATURE
         self.max_tokens = settings.MAX_TOKENS
@@ -100,54 +159,161 @@ class LLMClient:
         try:
             response_format = {"type": "json_object"} if json_mode else None
             
-            chat_completion = await self.client.chat.completions.create(
+            chat_completion, reserved = await self._create(
                 messages=messages,
-                model=self.model,
-                temperature=temperature or self.temperature,
                 max_tokens=max_tokens or self.max_tokens,
+                temperature=temperature or self.temperature,
                 response_format=response_format
             )
             
             response = chat_completion.choices[0].message.content
+            counts = self._record_usage(messages, response, getattr(chat_completion, "usage", None))
+            await rate_limiter.settle(reserved, counts["total_tokens"])
             return response
             
         except Exception as e:
             logger.error(f"Error generating completion: {str(e)}")
             raise
     
-    async def generate_with_context(
+    async def stream_completion(
+        self,
+        messages: List[Dict[str, str]],
+        temperature: float = None,
+        max_tokens: int = None,
+        usage: Dict[str, int] = None
+    ) -> AsyncIterator[str]:
+        """
+        Stream completion tokens from Groq API as they arrive
+        If usage is given it is filled with the token counts once the stream ends
+        """
+        try:
+            stream, reserved = await self._create(
+                messages=messages,
+                max_tokens=max_tokens or self.max_tokens,
+                temperature=temperature or self.temperature,
+                stream=True
+            )
+
+            parts: List[str] = []
+            reported_usage = None
+            async for chunk in stream:
+                # Groq reports usage on the final chunk under x_groq
+                x_groq = getattr(chunk, "x_groq", None)
+                if x_groq is not None and getattr(x_groq, "usage", None) is not None:
+                    reported_usage = x_groq.usage
+                if not chunk.choices:
+                    continue
+                delta = chunk.choices[0].delta.content
+                if delta:
+                    parts.append(delta)
+                    yield delta
+
+            counts = self._record_usage(messages, "".join(parts), reported_usage)
+            await rate_limiter.settle(reserved, counts["total_tokens"])
+            if usage is not None:
+                usage.update(counts)
+
+        except Exception as e:
+            logger.error(f"Error streaming completion: {str(e)}")
+            raise
+
+    async def _create(
+        self,
+        messages: List[Dict[str, str]],
+        max_tokens: int,
+        **kwargs
+    ) -> Tuple[Any, int]:
+        """
+        Call chat.completions.create once the shared rate limiter grants capacity
+        Retries 429/5xx/connection errors with jittered backoff, honouring Retry-After.
+        Returns (response, tokens reserved with the limiter)
+        """
+        estimate = self._estimate_prompt_tokens(messages) + max_tokens
+        attempts = settings.GROQ_MAX_RETRIES + 1
+        for attempt in range(1, attempts + 1):
+            reserved = await rate_limiter.acquire(estimate)
+            try:
+                response = await self.client.chat.completions.create(
+                    messages=messages,
+                    model=self.model,
+                    max_tokens=max_tokens,
+                    **kwargs
+                )
+                return response, reserved
+            except Exception as e:
+                # A rejected call used its request slot but no tokens
+                await rate_limiter.settle(reserved, 0)
+                if attempt == attempts or not _is_retryable(e):
+                    raise
+                retry_after = retry_after_seconds(getattr(getattr(e, "response", None), "headers", None))
+                delay = backoff_delay(attempt, retry_after, settings.GROQ_RETRY_MAX_DELAY_SECONDS)
+                logger.warning(
+                    f"Groq call failed (attempt {attempt}): {str(e)}; retrying in {delay:.1f}s"
+                )
+                if isinstance(e, RateLimitError):
+                    # Hold back every queued call, not just this one
+                    await rate_limiter.penalize(delay)
+                else:
+                    await asyncio.sleep(delay)
+
+    def _estimate_prompt_tokens(self, messages: List[Dict[str, str]]) -> int:
+        """Prompt tokens by tokenizer count; chat formatting adds a few tokens per message"""
+        return sum(self.count_tokens(m.get("content") or "") + 4 for m in messages)
+
+    def _record_usage(self, messages: List[Dict[str, str]], response: str, usage) -> Dict[str, int]:
+        """Record exact API usage, or a tokenizer estimate when the API did not report it"""
+        if usage is not None and getattr(usage, "prompt_tokens", None) is not None:
+            prompt_tokens = usage.prompt_tokens
+            completion_tokens = usage.completion_tokens or 0
+            estimated = False
+        else:
+            prompt_tokens = self._estimate_prompt_tokens(messages)
+            completion_tokens = self.count_tokens(response or "")
+            estimated = True
+        usage_tracker.record(prompt_tokens, completion_tokens, estimated=estimated)
+        return {
+            "prompt_tokens": prompt_tokens,
+            "completion_tokens": completion_tokens,
+            "total_tokens": prompt_tokens + completion_tokens
+        }
+
+    def _build_context_messages(
         self,
         system_prompt: str,
         user_query: str,
         context: List[str] = None,
-        conversation_history: List[Dict] = None,
-        temperature: float = None
-    ) -> str:
-        """Generate completion with context and conversation history"""
-        try:
-            messages = [{"role": "system", "content": system_prompt}]
-            
-            # Add conversation history if available
-            if conversation_history:
-                for msg in conversation_history[-5:]:  # Last 5 messages
+        conversation_history: List[Dict] = None
+    ) -> List[Dict[str, str]]:
+        """Build chat messages from system prompt, history, context and query within the token budget"""
+        context, conversation_history = context_packer.pack_prompt(
+            system_prompt=system_prompt,
+            user_query=user_query,
+            context=context,
+            conversation_history=conversation_history
+        )
+        messages = [{"role": "system", "content": system_prompt}]
+        
+        # Add conversation history if available (already limited to recent turns)
+        if conversation_history:
+            for msg in conversation_history:
+                messages.append({
+                    "role": "user",
+                    "content": msg.get("user_query", "")
+                })
+                if msg.get("agent_response"):
                     messages.append({
-                        "role": "user",
-                        "content": msg.get("user_query", "")
+                        "role": "assistant",
+                        "content": msg.get("agent_response", "")
                     })
-                    if msg.get("agent_response"):
-                        messages.append({
-                            "role": "assistant",
-                            "content": msg.get("agent_response", "")
-                        })
-            
-            # Build user message with context
-            user_message = user_query
-            if context:
-                context_text = "\n\n---\n\n".join([
-                    f"[Context {i+1}]\n{ctx}" 
-                    for i, ctx in enumerate(context)
-                ])
-                user_message = f"""Konteks Referensi:
+        
+        # Build user message with context
+        user_message = user_query
+        if context:
+            context_text = "\n\n---\n\n".join([
+                f"[Context {i+1}]\n{ctx}" 
+                for i, ctx in enumerate(context)
+            ])
+            user_message = f"""Konteks Referensi:
 {context_text}
 
 ---
@@ -155,8 +321,26 @@ class LLMClient:
 Pertanyaan: {user_query}
 
 Jawab berdasarkan konteks di atas. Jika informasi tidak tersedia dalam konteks, jelaskan berdasarkan pengetahuan umum tentang Komite Audit dan sebutkan bahwa ini adalah pengetahuan umum."""
-            
-            messages.append({"role": "user", "content": user_message})
+        
+        messages.append({"role": "user", "content": user_message})
+        return messages
+    
+    async def generate_with_context(
+        self,
+        system_prompt: str,
+        user_query: str,
+        context: List[str] = None,
+        conversation_history: List[Dict] = None,
+        temperature: float = None
+    ) -> str:
+        """Generate completion with context and conversation history"""
+        try:
+            messages = self._build_context_messages(
+                system_prompt=system_prompt,
+                user_query=user_query,
+                context=context,
+                conversation_history=conversation_history
+            )
             
             response = await self.generate_completion(
                 messages=messages,
@@ -168,6 +352,25 @@ Jawab berdasarkan konteks di atas. Jika informasi tidak tersedia dalam konteks,
         except Exception as e:
             logger.error(f"Error generating with context: {str(e)}")
             raise
+
+    async def stream_with_context(
+        self,
+        system_prompt: str,
+        user_query: str,
+        context: List[str] = None,
+        conversation_history: List[Dict] = None,
+        temperature: float = None,
+        usage: Dict[str, int] = None
+    ) -> AsyncIterator[str]:
+        """Stream completion tokens with context and conversation history"""
+        messages = self._build_context_messages(
+            system_prompt=system_prompt,
+            user_query=user_query,
+            context=context,
+            conversation_history=conversation_history
+        )
+        async for token in self.stream_completion(messages=messages, temperature=temperature, usage=usage):
+            yield token
     
     async def route_query(
         self,
@@ -199,32 +402,40 @@ Jawab berdasarkan konteks di atas. Jika informasi tidak tersedia dalam konteks,
                 "reasoning": "Error in routing, using default agent"
             }
     
-    async def synthesize_responses(
+    def _build_synthesis_messages(
         self,
         query: str,
         agent_responses: Dict[str, str],
         system_prompt: str
-    ) -> str:
-        """Synthesize multiple agent responses into coherent answer"""
-        try:
-            # Build synthesis prompt
-            responses_text = "\n\n".join([
-                f"=== {agent_name} ===\n{response}"
-                for agent_name, response in agent_responses.items()
-            ])
-            
-            synthesis_prompt = f"""Berdasarkan insights dari berbagai expert agents berikut:
+    ) -> List[Dict[str, str]]:
+        """Build synthesis prompt from multiple agent responses"""
+        responses_text = "\n\n".join([
+            f"=== {agent_name} ===\n{response}"
+            for agent_name, response in agent_responses.items()
+        ])
+        
+        synthesis_prompt = f"""Berdasarkan insights dari berbagai expert agents berikut:
 
 {responses_text}
 
 Pertanyaan original: {query}
 
 Tugas Anda: Sintesiskan informasi di atas menjadi jawaban yang komprehensif, koheren, dan mudah dipahami."""
-            
-            messages = [
-                {"role": "system", "content": system_prompt},
-                {"role": "user", "content": synthesis_prompt}
-            ]
+        
+        return [
+            {"role": "system", "content": system_prompt},
+            {"role": "user", "content": synthesis_prompt}
+        ]
+
+    async def synthesize_responses(
+        self,
+        query: str,
+        agent_responses: Dict[str, str],
+        system_prompt: str
+    ) -> str:
+        """Synthesize multiple agent responses into coherent answer"""
+        try:
+            messages = self._build_synthesis_messages(query, agent_responses, system_prompt)
             
             synthesized_response = await self.generate_completion(messages=messages)
             logger.info("Responses synthesized successfully")
@@ -234,11 +445,21 @@ Tugas Anda: Sintesiskan informasi di atas menjadi jawaban yang komprehensif, koh
             logger.error(f"Error synthesizing responses: {str(e)}")
             # Return concatenated responses on error
             return "\n\n".join(agent_responses.values())
+
+    async def stream_synthesis(
+        self,
+        query: str,
+        agent_responses: Dict[str, str],
+        system_prompt: str
+    ) -> AsyncIterator[str]:
+        """Stream the synthesized answer token by token"""
+        messages = self._build_synthesis_messages(query, agent_responses, system_prompt)
+        async for token in self.stream_completion(messages=messages):
+            yield token
     
     def count_tokens(self, text: str) -> int:
-        """Estimate token count (rough approximation)"""
-        # Rough estimation: 1 token ≈ 4 characters for English/Indonesian mix
-        return len(text) // 4
+        """Count tokens with the configured tokenizer"""
+        return context_packer.count_tokens(text)
 
 # Global LLM client instance
 llm_client = LLMClient()
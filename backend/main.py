@@ -2,11 +2,13 @@
 FastAPI Backend for RAG Komite Audit System
 Provides REST API endpoints for the application
 """
-from fastapi import FastAPI, UploadFile, File, Form, HTTPException, BackgroundTasks
+from fastapi import FastAPI, UploadFile, File, Form, HTTPException, Request
 from fastapi.middleware.cors import CORSMiddleware
-from fastapi.responses import JSONResponse
+from fastapi.responses import JSONResponse, StreamingResponse
 from pydantic import BaseModel
 from typing import Optional, List
+from contextlib import asynccontextmanager
+import json
 import os
 import uuid
 import shutil
@@ -14,17 +16,46 @@ from pathlib import Path
 
 from config.config import settings, UPLOAD_DIR
 from agents.orchestrator import orchestrator
-from agents.financial_analyst import financial_analyst
-from agents.risk_audit_mapper import risk_audit_mapper
-from agents.executive_insight import executive_insight_analyzer
 from backend.document_processor import document_processor
 from backend.database import db
+from backend.job_queue import job_queue
+from backend.analysis_jobs import (
+    ANALYSIS_JOBS, cached_financial_analysis, cached_risk_mapping, cached_executive_insight
+)
+from backend.embeddings import embedding_service
+from backend.semantic_cache import semantic_cache
+from backend.analysis_cache import analysis_cache
+from backend.usage_tracker import usage_tracker
+from backend.llm_client import glm_client
+from backend.rate_limiter import rate_limiter
+from backend.keyword_index import keyword_index
+from backend.reranker import reranker
+from backend.vector_index import local_index
+
+@asynccontextmanager
+async def lifespan(app: FastAPI):
+    """Open pooled connections on startup and release them on shutdown"""
+    await db.connect()
+    await glm_client.connect()
+    await db.load_indexes()
+    job_queue.register("ingest_document", document_processor.run_ingestion_job)
+    for kind, handler in ANALYSIS_JOBS.items():
+        job_queue.register(kind, handler)
+    await job_queue.start()
+    yield
+    await job_queue.stop()
+    document_processor.close()
+    await embedding_service.close()
+    reranker.close()
+    await glm_client.close()
+    await db.close()
 
 # Initialize FastAPI app
 app = FastAPI(
     title=settings.APP_NAME,
     version=settings.APP_VERSION,
-    description="Multi-Agent RAG System for Komite Audit expertise"
+    description="Multi-Agent RAG System for Komite Audit expertise",
+    lifespan=lifespan
 )
 
 # Add CORS middleware
@@ -36,6 +67,12 @@ app.add_middleware(
     allow_headers=["*"],
 )
 
+@app.middleware("http")
+async def label_token_usage(request: Request, call_next):
+    """Attribute LLM token usage of each request to its endpoint"""
+    with usage_tracker.labels(endpoint=request.url.path):
+        return await call_next(request)
+
 # Pydantic models
 class QueryRequest(BaseModel):
     query: str
@@ -55,17 +92,20 @@ class AnalysisRequest(BaseModel):
     document_id: str
     session_id: Optional[str] = None
     analysis_type: str = "comprehensive"  # comprehensive, quick, ratio_only
+    force_refresh: bool = False
 
 class RiskMappingRequest(BaseModel):
     risk_register_document_id: str
     audit_plan_document_id: str
     session_id: Optional[str] = None
     mapping_type: str = "comprehensive"  # comprehensive, quick, gap_only
+    force_refresh: bool = False
 
 class ExecutiveInsightRequest(BaseModel):
     document_id: str
     session_id: Optional[str] = None
     analysis_type: str = "full"  # full, quick, risk_focus
+    force_refresh: bool = False
 
 class DocumentChatRequest(BaseModel):
     document_id: str
@@ -111,16 +151,46 @@ async def process_query(request: QueryRequest):
     except Exception as e:
         raise HTTPException(status_code=500, detail=str(e))
 
+def sse_response(events) -> StreamingResponse:
+    """Encode orchestrator events as a Server-Sent Events stream"""
+    async def encode():
+        async for event in events:
+            payload = json.dumps(event["data"], ensure_ascii=False)
+            yield f"event: {event['event']}\ndata: {payload}\n\n"
+
+    return StreamingResponse(
+        encode(),
+        media_type="text/event-stream",
+        headers={"Cache-Control": "no-cache", "X-Accel-Buffering": "no"}
+    )
+
+@app.post("/query/stream")
+async def stream_query(request: QueryRequest):
+    """
+    Stream query processing via Server-Sent Events
+    Events: routing, sources, token (repeated), done or error
+    """
+    return sse_response(orchestrator.stream_query(
+        query=request.query,
+        session_id=request.session_id,
+        use_context=request.use_context,
+        max_agents=request.max_agents
+    ))
+
 # Document upload endpoint
 @app.post("/upload")
 async def upload_document(
-    background_tasks: BackgroundTasks,
     file: UploadFile = File(...),
-    category: Optional[str] = Form(None)
+    category: Optional[str] = Form(None),
+    document_id: Optional[str] = Form(None),
+    replace_existing: bool = Form(False)
 ):
     """
     Upload and process document
-    Processing happens in background
+    Processing runs on the durable job queue; poll /jobs/{job_id} for progress.
+    A new version of an existing document (by document_id, or by filename with
+    replace_existing) is re-ingested incrementally: only changed chunks are embedded.
+    The previous version stays searchable until the new one is fully stored.
     """
     try:
         # Validate file type
@@ -140,26 +210,69 @@ async def upload_document(
             shutil.copyfileobj(file.file, buffer)
         
         file_size = os.path.getsize(file_path)
+        file_type = document_processor.SUPPORTED_FORMATS[file_ext]
+
+        # Resolve the document being replaced, if any
+        document = None
+        if document_id:
+            document = await db.get_document(document_id)
+            if not document:
+                raise HTTPException(status_code=404, detail="Document not found")
+        elif replace_existing:
+            document = await db.find_document_by_filename(file.filename)
+
+        # A new version is recorded on the document once it has been ingested
+        reingest = document is not None
+        if not reingest:
+            # Create the document entry up front so retries reuse it
+            document = await db.create_document(
+                filename=file.filename,
+                file_type=file_type,
+                file_size=file_size
+            )
         
-        # Add processing task to background
-        background_tasks.add_task(
-            document_processor.process_document,
-            file_path=str(file_path),
-            filename=file.filename,
-            file_type=document_processor.SUPPORTED_FORMATS[file_ext],
-            file_size=file_size
-        )
+        # Queue processing job
+        job_id = await job_queue.submit("ingest_document", {
+            "file_path": str(file_path),
+            "filename": file.filename,
+            "file_type": file_type,
+            "file_size": file_size,
+            "document_id": document["id"]
+        })
         
         return {
             "success": True,
             "message": "Document uploaded successfully. Processing in background.",
             "filename": file.filename,
-            "file_size": file_size
+            "file_size": file_size,
+            "document_id": document["id"],
+            "job_id": job_id,
+            "reingest": reingest
         }
     
+    except HTTPException:
+        raise
     except Exception as e:
         raise HTTPException(status_code=500, detail=str(e))
 
+# Job status endpoints
+@app.get("/jobs")
+async def list_jobs(
+    kind: Optional[str] = None,
+    status: Optional[str] = None,
+    limit: int = 50
+):
+    """List background jobs with optional filters"""
+    return {"jobs": job_queue.list(kind=kind, status=status, limit=limit)}
+
+@app.get("/jobs/{job_id}")
+async def get_job(job_id: str):
+    """Get background job status, progress and result"""
+    job = job_queue.get(job_id)
+    if not job:
+        raise HTTPException(status_code=404, detail="Job not found")
+    return job
+
 # List documents endpoint
 @app.get("/documents")
 async def list_documents(
@@ -201,6 +314,8 @@ async def delete_document(document_id: str):
         if not success:
             raise HTTPException(status_code=404, detail="Document not found")
         
+        semantic_cache.invalidate(f"after deleting {document_id}")
+        
         return {
             "success": True,
             "message": "Document deleted successfully",
@@ -270,6 +385,52 @@ async def get_agent_statistics():
     except Exception as e:
         raise HTTPException(status_code=500, detail=str(e))
 
+@app.get("/statistics/embeddings")
+async def get_embedding_statistics():
+    """Get embedding cache hit/miss counters"""
+    return {"statistics": embedding_service.manager.cache_stats()}
+
+@app.get("/statistics/vector-index")
+async def get_vector_index_statistics():
+    """Get local vector index status"""
+    return {
+        "backend": settings.VECTOR_SEARCH_BACKEND,
+        "statistics": local_index.stats()
+    }
+
+@app.get("/statistics/reranker")
+async def get_reranker_statistics():
+    """Get cross-encoder rerank latency and cache statistics"""
+    return {"statistics": reranker.stats()}
+
+@app.get("/statistics/keyword-index")
+async def get_keyword_index_statistics():
+    """Get BM25 keyword index status"""
+    return {
+        "enabled": settings.HYBRID_SEARCH_ENABLED,
+        "statistics": keyword_index.stats()
+    }
+
+@app.get("/statistics/cache")
+async def get_cache_statistics():
+    """Get semantic answer cache hit/miss counters"""
+    return {"statistics": semantic_cache.stats()}
+
+@app.get("/statistics/analysis-cache")
+async def get_analysis_cache_statistics():
+    """Hit/miss counts of the analysis result cache"""
+    return {"statistics": analysis_cache.stats()}
+
+@app.get("/statistics/token-usage")
+async def get_token_usage_statistics():
+    """Get LLM prompt/completion token usage per endpoint, agent and session"""
+    return {"statistics": usage_tracker.stats()}
+
+@app.get("/statistics/rate-limiter")
+async def get_rate_limiter_statistics():
+    """Get Groq rate limiter bucket levels and queueing statistics"""
+    return {"statistics": rate_limiter.stats()}
+
 # Agent info endpoint
 @app.get("/agents")
 async def list_agents():
@@ -278,10 +439,14 @@ async def list_agents():
     return {"agents": AGENT_ROLES}
 
 # Financial Analysis endpoints
+# Document analyses run as jobs at batch priority (see backend.analysis_jobs)
 @app.post("/analyze")
 async def analyze_document(request: AnalysisRequest):
     """
     Analyze a financial document using AI Senior Financial Analyst
+    A stored result for unchanged content is returned directly (cached: true);
+    otherwise the analysis runs on the job queue; poll /jobs/{job_id} for
+    progress, partial sections and the final result.
     """
     try:
         # Get document metadata
@@ -295,40 +460,25 @@ async def analyze_document(request: AnalysisRequest):
                 detail="Document not yet processed. Please wait for processing to complete."
             )
 
-        # Reconstruct full document text from chunks
-        document_text = await db.get_document_full_text(request.document_id)
-        if not document_text:
-            raise HTTPException(
-                status_code=404,
-                detail="Document text not found. Document may not have been processed correctly."
-            )
-
-        # Run financial analysis
-        analysis_result, execution_time, tokens_used = await financial_analyst.analyze_document(
-            document_text=document_text,
-            document_metadata=document,
-            analysis_type=request.analysis_type
-        )
+        payload = {
+            "document_id": request.document_id,
+            "session_id": request.session_id,
+            "analysis_type": request.analysis_type,
+            "force_refresh": request.force_refresh
+        }
+        cached = await cached_financial_analysis(payload, document)
+        if cached:
+            return cached
 
-        # Save analysis to database
-        saved_analysis = await db.create_analysis(
-            document_id=request.document_id,
-            session_id=request.session_id,
-            analysis_type=request.analysis_type,
-            analysis_result=analysis_result,
-            processing_time_ms=execution_time,
-            tokens_used=tokens_used
-        )
+        job_id = await job_queue.submit("financial_analysis", payload)
 
         return {
             "success": True,
+            "message": "Analysis queued. Poll /jobs/{job_id} for progress and result.",
             "document_id": request.document_id,
             "document_name": document.get("filename"),
             "analysis_type": request.analysis_type,
-            "analysis": analysis_result,
-            "processing_time_ms": execution_time,
-            "tokens_used": tokens_used,
-            "analysis_id": saved_analysis.get("id") if saved_analysis else None
+            "job_id": job_id
         }
 
     except HTTPException:
@@ -361,6 +511,9 @@ async def get_analyses_by_document(document_id: str, limit: int = 10):
 async def create_risk_mapping(request: RiskMappingRequest):
     """
     Map risk register against audit plan (PKPT) to identify coverage gaps
+    A stored result for unchanged content is returned directly (cached: true);
+    otherwise the mapping runs on the job queue; poll /jobs/{job_id} for
+    progress, partial sections and the final result.
     """
     try:
         # Validate risk register document
@@ -383,52 +536,28 @@ async def create_risk_mapping(request: RiskMappingRequest):
                 detail="Audit plan document not yet processed."
             )
 
-        # Get full text for both documents
-        risk_text = await db.get_document_full_text(request.risk_register_document_id)
-        if not risk_text:
-            raise HTTPException(
-                status_code=404,
-                detail="Risk register text not found."
-            )
-
-        audit_text = await db.get_document_full_text(request.audit_plan_document_id)
-        if not audit_text:
-            raise HTTPException(
-                status_code=404,
-                detail="Audit plan text not found."
-            )
+        payload = {
+            "risk_register_document_id": request.risk_register_document_id,
+            "audit_plan_document_id": request.audit_plan_document_id,
+            "session_id": request.session_id,
+            "mapping_type": request.mapping_type,
+            "force_refresh": request.force_refresh
+        }
+        cached = await cached_risk_mapping(payload, risk_doc, audit_doc)
+        if cached:
+            return cached
 
-        # Run risk-audit mapping
-        mapping_result, execution_time, tokens_used = await risk_audit_mapper.analyze_mapping(
-            risk_register_text=risk_text,
-            audit_plan_text=audit_text,
-            risk_register_metadata=risk_doc,
-            audit_plan_metadata=audit_doc,
-            mapping_type=request.mapping_type
-        )
-
-        # Save to database
-        saved_mapping = await db.create_risk_mapping(
-            risk_register_document_id=request.risk_register_document_id,
-            audit_plan_document_id=request.audit_plan_document_id,
-            session_id=request.session_id,
-            mapping_type=request.mapping_type,
-            mapping_result=mapping_result,
-            processing_time_ms=execution_time,
-            tokens_used=tokens_used
-        )
+        job_id = await job_queue.submit("risk_mapping", payload)
 
         return {
             "success": True,
+            "message": "Risk mapping queued. Poll /jobs/{job_id} for progress and result.",
             "risk_register_document_id": request.risk_register_document_id,
             "risk_register_name": risk_doc.get("filename"),
             "audit_plan_document_id": request.audit_plan_document_id,
             "audit_plan_name": audit_doc.get("filename"),
             "mapping_type": request.mapping_type,
-            "mapping": mapping_result,
-            "processing_time_ms": execution_time,
-            "tokens_used": tokens_used,
-            "mapping_id": saved_mapping.get("id") if saved_mapping else None
+            "job_id": job_id
         }
 
     except HTTPException:
@@ -464,6 +593,8 @@ async def create_executive_insight(request: ExecutiveInsightRequest):
     """
     Create executive insight analysis for an audit document
     Extracts: Top 3 Critical Risks, Financial Exposure, Management Sentiment
+    A stored result is returned directly (cached: true); otherwise the analysis
+    runs on the job queue; poll /jobs/{job_id} for progress and the final result.
     """
     try:
         # Validate document exists and is processed
@@ -477,40 +608,25 @@ async def create_executive_insight(request: ExecutiveInsightRequest):
                 detail="Document not yet processed. Please wait for processing to complete."
             )
 
-        # Get full document text
-        document_text = await db.get_document_full_text(request.document_id)
-        if not document_text:
-            raise HTTPException(
-                status_code=404,
-                detail="Document text not found. Document may not have been processed correctly."
-            )
-
-        # Run executive insight analysis
-        insight_result, execution_time, tokens_used = await executive_insight_analyzer.analyze_document(
-            document_text=document_text,
-            document_metadata=document,
-            analysis_type=request.analysis_type
-        )
+        payload = {
+            "document_id": request.document_id,
+            "session_id": request.session_id,
+            "analysis_type": request.analysis_type,
+            "force_refresh": request.force_refresh
+        }
+        cached = await cached_executive_insight(payload, document)
+        if cached:
+            return cached
 
-        # Save to database
-        saved_insight = await db.create_executive_insight(
-            document_id=request.document_id,
-            session_id=request.session_id,
-            analysis_type=request.analysis_type,
-            insight_result=insight_result,
-            processing_time_ms=execution_time,
-            tokens_used=tokens_used
-        )
+        job_id = await job_queue.submit("executive_insight", payload)
 
         return {
             "success": True,
+            "message": "Executive insight queued. Poll /jobs/{job_id} for progress and result.",
             "document_id": request.document_id,
             "document_name": document.get("filename"),
             "analysis_type": request.analysis_type,
-            "insight": insight_result,
-            "processing_time_ms": execution_time,
-            "tokens_used": tokens_used,
-            "insight_id": saved_insight.get("id") if saved_insight else None
+            "job_id": job_id
         }
 
     except HTTPException:
@@ -596,6 +712,29 @@ async def chat_with_document(request: DocumentChatRequest):
     except Exception as e:
         raise HTTPException(status_code=500, detail=str(e))
 
+@app.post("/chat-document/stream")
+async def stream_chat_with_document(request: DocumentChatRequest):
+    """
+    Stream a chat with a specific document via Server-Sent Events
+    """
+    document = await db.get_document(request.document_id)
+    if not document:
+        raise HTTPException(status_code=404, detail="Document not found")
+
+    if document.get("status") != "processed":
+        raise HTTPException(
+            status_code=400,
+            detail="Document not yet processed."
+        )
+
+    return sse_response(orchestrator.stream_query(
+        query=request.query,
+        session_id=request.session_id,
+        use_context=True,
+        max_agents=1,
+        filter_document_ids=[request.document_id]
+    ))
+
 if __name__ == "__main__":
     import uvicorn
     uvicorn.run(
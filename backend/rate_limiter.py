@@ -0,0 +1,221 @@
+"""
+Rate Limiter for RAG Komite Audit System
+Token buckets for Groq requests-per-minute and tokens-per-minute limits, with a
+priority queue so interactive queries are served ahead of batch analyses
+"""
+from contextlib import contextmanager
+from contextvars import ContextVar
+from email.utils import parsedate_to_datetime
+from typing import Dict, Iterator, List, Optional, Tuple
+import asyncio
+import heapq
+import itertools
+import random
+import time
+import logging
+from config.config import settings
+
+logging.basicConfig(level=getattr(logging, settings.LOG_LEVEL))
+logger = logging.getLogger(__name__)
+
+PRIORITY_INTERACTIVE = 0
+PRIORITY_BATCH = 1
+PRIORITY_NAMES = {PRIORITY_INTERACTIVE: "interactive", PRIORITY_BATCH: "batch"}
+
+# Priority of LLM calls made by the current request/task
+_priority: ContextVar[int] = ContextVar("llm_priority", default=PRIORITY_INTERACTIVE)
+
+
+def retry_after_seconds(headers) -> Optional[float]:
+    """Parse retry-after-ms / retry-after (seconds or HTTP date) response headers"""
+    if not headers:
+        return None
+    value = headers.get("retry-after-ms")
+    if value:
+        try:
+            return max(0.0, float(value) / 1000)
+        except ValueError:
+            pass
+    value = headers.get("retry-after")
+    if not value:
+        return None
+    try:
+        return max(0.0, float(value))
+    except ValueError:
+        pass
+    try:
+        return max(0.0, parsedate_to_datetime(value).timestamp() - time.time())
+    except (TypeError, ValueError):
+        return None
+
+
+def backoff_delay(attempt: int, retry_after: Optional[float] = None, max_delay: float = 60.0) -> float:
+    """
+    Delay before retry number attempt (1-based): the server's Retry-After when given,
+    otherwise exponential backoff; jittered so concurrent callers do not retry in lockstep
+    """
+    base = retry_after if retry_after is not None else 0.5 * 2 ** (attempt - 1)
+    return min(max_delay, base) * (1 + 0.25 * random.random())
+
+
+class RateLimiter:
+    """
+    Requests-per-minute and tokens-per-minute token buckets shared by all LLM calls
+    Waiters are granted strictly in (priority, arrival) order; a limit of 0 disables it
+    """
+
+    def __init__(self, requests_per_minute: int = None, tokens_per_minute: int = None):
+        self.requests_per_minute = settings.GROQ_RPM_LIMIT if requests_per_minute is None else requests_per_minute
+        self.tokens_per_minute = settings.GROQ_TPM_LIMIT if tokens_per_minute is None else tokens_per_minute
+        self._requests = float(self.requests_per_minute)
+        self._tokens = float(self.tokens_per_minute)
+        self._updated = time.monotonic()
+        self._blocked_until = 0.0
+        self._condition = asyncio.Condition()
+        self._waiters: List[Tuple[int, int, int]] = []
+        self._sequence = itertools.count()
+
+        self.granted = 0
+        self.throttled = 0
+        self.rate_limited = 0
+        self.total_wait_seconds = 0.0
+        logger.info(
+            f"Rate limiter initialized ({self.requests_per_minute or 'unlimited'} RPM, "
+            f"{self.tokens_per_minute or 'unlimited'} TPM)"
+        )
+
+    @property
+    def enabled(self) -> bool:
+        return bool(self.requests_per_minute or self.tokens_per_minute)
+
+    @contextmanager
+    def priority(self, priority: int) -> Iterator[None]:
+        """Run LLM calls made inside the block at this priority"""
+        token = _priority.set(priority)
+        try:
+            yield
+        finally:
+            _priority.reset(token)
+
+    def set_priority(self, priority: int):
+        """Set the priority for the rest of the current task (for async generators)"""
+        _priority.set(priority)
+
+    def _refill(self, now: float):
+        elapsed = now - self._updated
+        self._updated = now
+        if self.requests_per_minute:
+            self._requests = min(
+                self.requests_per_minute,
+                self._requests + elapsed * self.requests_per_minute / 60.0
+            )
+        if self.tokens_per_minute:
+            self._tokens = min(
+                self.tokens_per_minute,
+                self._tokens + elapsed * self.tokens_per_minute / 60.0
+            )
+
+    def _delay(self, entry: Tuple[int, int, int], now: float) -> Optional[float]:
+        """Seconds until entry can be granted; None while another waiter is ahead of it"""
+        if self._waiters[0] is not entry:
+            return None
+        tokens = entry[2]
+        delay = self._blocked_until - now
+        if self.requests_per_minute and self._requests < 1:
+            delay = max(delay, (1 - self._requests) * 60.0 / self.requests_per_minute)
+        if self.tokens_per_minute and self._tokens < tokens:
+            delay = max(delay, (tokens - self._tokens) * 60.0 / self.tokens_per_minute)
+        return max(0.0, delay)
+
+    async def acquire(self, tokens: int, priority: int = None) -> int:
+        """
+        Wait for capacity for one request of about this many tokens
+        Returns the tokens reserved, to be passed to settle() once actual usage is known
+        """
+        if not self.enabled:
+            return 0
+        priority = _priority.get() if priority is None else priority
+        if self.tokens_per_minute:
+            # A request larger than the whole bucket still has to be let through eventually
+            tokens = max(1, min(tokens, self.tokens_per_minute))
+        else:
+            tokens = 0
+        entry = (priority, next(self._sequence), tokens)
+        start = time.monotonic()
+
+        async with self._condition:
+            heapq.heappush(self._waiters, entry)
+            try:
+                while True:
+                    now = time.monotonic()
+                    self._refill(now)
+                    delay = self._delay(entry, now)
+                    if delay == 0:
+                        break
+                    try:
+                        await asyncio.wait_for(self._condition.wait(), timeout=delay)
+                    except asyncio.TimeoutError:
+                        pass
+            except BaseException:
+                self._waiters.remove(entry)
+                heapq.heapify(self._waiters)
+                self._condition.notify_all()
+                raise
+
+            heapq.heappop(self._waiters)
+            if self.requests_per_minute:
+                self._requests -= 1
+            self._tokens -= tokens
+            self._condition.notify_all()
+
+            waited = time.monotonic() - start
+            self.granted += 1
+            if waited > 0.01:
+                self.throttled += 1
+                self.total_wait_seconds += waited
+                logger.debug(
+                    f"LLM call ({PRIORITY_NAMES.get(priority, priority)}, {tokens} tokens) "
+                    f"waited {waited:.2f}s for rate limit capacity"
+                )
+        return tokens
+
+    async def settle(self, reserved: int, used: int):
+        """Return over-reserved tokens to the bucket (or charge the shortfall)"""
+        if not self.tokens_per_minute or reserved == used:
+            return
+        async with self._condition:
+            self._refill(time.monotonic())
+            self._tokens = min(self.tokens_per_minute, self._tokens + reserved - used)
+            self._condition.notify_all()
+
+    async def penalize(self, retry_after: float):
+        """Pause all grants after the API answered 429"""
+        async with self._condition:
+            self.rate_limited += 1
+            self._blocked_until = max(self._blocked_until, time.monotonic() + retry_after)
+            self._condition.notify_all()
+
+    def stats(self) -> Dict:
+        """Bucket levels and queueing counters for monitoring"""
+        self._refill(time.monotonic())
+        waiting: Dict[str, int] = {}
+        for priority, _, _ in self._waiters:
+            name = PRIORITY_NAMES.get(priority, str(priority))
+            waiting[name] = waiting.get(name, 0) + 1
+        return {
+            "enabled": self.enabled,
+            "requests_per_minute": self.requests_per_minute,
+            "tokens_per_minute": self.tokens_per_minute,
+            "available_requests": round(self._requests, 2) if self.requests_per_minute else None,
+            "available_tokens": int(self._tokens) if self.tokens_per_minute else None,
+            "blocked_for_seconds": round(max(0.0, self._blocked_until - time.monotonic()), 2),
+            "waiting": waiting,
+            "granted": self.granted,
+            "throttled": self.throttled,
+            "rate_limited": self.rate_limited,
+            "avg_wait_seconds": round(self.total_wait_seconds / self.throttled, 3) if self.throttled else 0.0
+        }
+
+
+# Global rate limiter instance
+rate_limiter = RateLimiter()
@@ -0,0 +1,168 @@
+"""
+Reranker for RAG Komite Audit System
+Scores (query, chunk) pairs with a local cross-encoder to reorder retrieved candidates
+"""
+from sentence_transformers import CrossEncoder
+from collections import OrderedDict
+from concurrent.futures import ThreadPoolExecutor
+from typing import Any, Callable, Dict, List, Optional
+import asyncio
+import hashlib
+import logging
+import threading
+import time
+from config.config import settings
+
+logging.basicConfig(level=getattr(logging, settings.LOG_LEVEL))
+logger = logging.getLogger(__name__)
+
+
+class Reranker:
+    """
+    Cross-encoder reranking with batched CPU inference on a dedicated thread,
+    an LRU cache of pair scores and latency counters
+    """
+
+    def __init__(
+        self,
+        model_name: str = None,
+        batch_size: int = None,
+        max_cache_items: int = None
+    ):
+        self.model_name = model_name or settings.RERANK_MODEL
+        self.batch_size = batch_size or settings.RERANK_BATCH_SIZE
+        self.max_cache_items = max_cache_items or settings.RERANK_CACHE_ITEMS
+        self._model = None
+        self._executor = ThreadPoolExecutor(max_workers=1, thread_name_prefix="rerank")
+        self._cache: "OrderedDict[str, float]" = OrderedDict()
+        self._lock = threading.Lock()
+
+        self.calls = 0
+        self.pairs_scored = 0
+        self.cache_hits = 0
+        self.total_latency_ms = 0.0
+        self.last_latency_ms = 0.0
+        logger.info(f"Reranker initialized (model: {self.model_name}, loads on first use)")
+
+    @property
+    def model(self):
+        """Lazy load the cross-encoder on first access"""
+        if self._model is None:
+            logger.info(f"Loading rerank model: {self.model_name}")
+            self._model = CrossEncoder(self.model_name)
+        return self._model
+
+    def _key(self, query: str, content: str) -> str:
+        payload = f"{self.model_name}\0{query}\0{content}".encode("utf-8")
+        return hashlib.sha256(payload).hexdigest()
+
+    def score_pairs(self, query: str, contents: List[str]) -> List[float]:
+        """Score each content against the query, running the model only on cache misses"""
+        keys = [self._key(query, content) for content in contents]
+        scores: List[Optional[float]] = [None] * len(contents)
+        missing: Dict[str, List[int]] = {}
+
+        with self._lock:
+            for i, key in enumerate(keys):
+                if key in self._cache:
+                    self._cache.move_to_end(key)
+                    scores[i] = self._cache[key]
+                    self.cache_hits += 1
+                else:
+                    missing.setdefault(key, []).append(i)
+
+        if missing:
+            positions = [indices[0] for indices in missing.values()]
+            predicted = self.model.predict(
+                [(query, contents[i]) for i in positions],
+                batch_size=self.batch_size,
+                show_progress_bar=False
+            )
+            with self._lock:
+                for (key, indices), score in zip(missing.items(), predicted):
+                    score = float(score)
+                    self._cache[key] = score
+                    self._cache.move_to_end(key)
+                    for i in indices:
+                        scores[i] = score
+                while len(self._cache) > self.max_cache_items:
+                    self._cache.popitem(last=False)
+                self.pairs_scored += len(positions)
+
+        return scores
+
+    async def rerank(
+        self,
+        query: str,
+        candidates: List[Dict[str, Any]],
+        top_n: int,
+        max_tokens: int = None,
+        count_tokens: Callable[[str], int] = None
+    ) -> List[Dict[str, Any]]:
+        """
+        Reorder candidates by cross-encoder score (added as "rerank_score") and keep
+        the best top_n whose content fits within max_tokens
+        """
+        if not candidates:
+            return []
+
+        start = time.time()
+        loop = asyncio.get_running_loop()
+        scores = await loop.run_in_executor(
+            self._executor,
+            self.score_pairs,
+            query,
+            [candidate["content"] for candidate in candidates]
+        )
+        latency_ms = (time.time() - start) * 1000
+        with self._lock:
+            self.calls += 1
+            self.total_latency_ms += latency_ms
+            self.last_latency_ms = latency_ms
+
+        ranked = sorted(
+            ({**candidate, "rerank_score": score} for candidate, score in zip(candidates, scores)),
+            key=lambda candidate: candidate["rerank_score"],
+            reverse=True
+        )
+
+        count_tokens = count_tokens or (lambda text: len(text) // 4)
+        selected, used_tokens = [], 0
+        for candidate in ranked:
+            if len(selected) >= top_n:
+                break
+            tokens = count_tokens(candidate["content"])
+            if max_tokens and selected and used_tokens + tokens > max_tokens:
+                continue
+            selected.append(candidate)
+            used_tokens += tokens
+
+        logger.info(
+            f"Reranked {len(candidates)} candidates in {latency_ms:.0f}ms, "
+            f"kept {len(selected)} ({used_tokens} tokens)"
+        )
+        return selected
+
+    def stats(self) -> Dict:
+        """Latency and cache counters for monitoring"""
+        with self._lock:
+            lookups = self.cache_hits + self.pairs_scored
+            return {
+                "enabled": settings.RERANK_ENABLED,
+                "model": self.model_name,
+                "calls": self.calls,
+                "pairs_scored": self.pairs_scored,
+                "cache_hits": self.cache_hits,
+                "cache_items": len(self._cache),
+                "cache_hit_rate": round(self.cache_hits / lookups, 4) if lookups else 0.0,
+                "avg_latency_ms": round(self.total_latency_ms / self.calls, 1) if self.calls else 0.0,
+                "last_latency_ms": round(self.last_latency_ms, 1)
+            }
+
+    def close(self):
+        """Release the inference thread"""
+        self._executor.shutdown(wait=False, cancel_futures=True)
+
+
+# Global reranker instance
+reranker = Reranker()
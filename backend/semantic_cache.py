@@ -0,0 +1,132 @@
+"""
+Semantic Answer Cache for RAG Komite Audit System
+Serves answers to near-identical questions by query embedding similarity
+"""
+from typing import Dict, List, Optional
+import logging
+import time
+import numpy as np
+from config.config import settings
+
+logging.basicConfig(level=getattr(logging, settings.LOG_LEVEL))
+logger = logging.getLogger(__name__)
+
+
+class SemanticCache:
+    """
+    In-process cache of answered queries
+    Entries are scoped by request options (document filter, context, agent count)
+    and by corpus version, which is bumped whenever documents change
+    """
+
+    def __init__(
+        self,
+        threshold: float = None,
+        ttl_seconds: float = None,
+        max_entries: int = None
+    ):
+        self.threshold = threshold if threshold is not None else settings.SEMANTIC_CACHE_THRESHOLD
+        self.ttl_seconds = ttl_seconds if ttl_seconds is not None else settings.SEMANTIC_CACHE_TTL_SECONDS
+        self.max_entries = max_entries or settings.SEMANTIC_CACHE_MAX_ENTRIES
+        self.corpus_version = 0
+        self._entries: List[Dict] = []
+        self.hits = 0
+        self.misses = 0
+        logger.info(
+            f"SemanticCache initialized (threshold: {self.threshold}, ttl: {self.ttl_seconds}s)"
+        )
+
+    @staticmethod
+    def scope_key(
+        filter_document_ids: Optional[List[str]],
+        use_context: bool,
+        max_agents: int
+    ) -> str:
+        """Build the scope a cached answer is valid for"""
+        documents = ",".join(sorted(filter_document_ids)) if filter_document_ids else "*"
+        return f"{documents}|context={int(use_context)}|agents={max_agents}"
+
+    @staticmethod
+    def _normalize(embedding: List[float]) -> np.ndarray:
+        vector = np.asarray(embedding, dtype=np.float32)
+        norm = np.linalg.norm(vector)
+        return vector / norm if norm > 0 else vector
+
+    def _evict_expired(self):
+        cutoff = time.time() - self.ttl_seconds
+        self._entries = [entry for entry in self._entries if entry["created_at"] >= cutoff]
+
+    def lookup(self, query_embedding: List[float], scope: str) -> Optional[Dict]:
+        """Return the cached result of the most similar query above threshold"""
+        self._evict_expired()
+        candidates = [entry for entry in self._entries if entry["scope"] == scope]
+
+        if not candidates:
+            self.misses += 1
+            return None
+
+        query_vector = self._normalize(query_embedding)
+        similarities = np.stack([entry["vector"] for entry in candidates]) @ query_vector
+        best = int(np.argmax(similarities))
+
+        if similarities[best] < self.threshold:
+            self.misses += 1
+            return None
+
+        self.hits += 1
+        entry = candidates[best]
+        logger.info(
+            f"Semantic cache hit (similarity {similarities[best]:.3f}): {entry['query'][:80]}"
+        )
+        return {
+            **entry["result"],
+            "cache": {
+                "hit": True,
+                "similarity": float(similarities[best]),
+                "cached_query": entry["query"],
+                "age_seconds": int(time.time() - entry["created_at"])
+            }
+        }
+
+    def store(
+        self,
+        query: str,
+        query_embedding: List[float],
+        scope: str,
+        result: Dict,
+        corpus_version: int
+    ):
+        """Cache an answer unless the corpus changed while it was being produced"""
+        if corpus_version != self.corpus_version:
+            return
+
+        self._entries.append({
+            "query": query,
+            "vector": self._normalize(query_embedding),
+            "scope": scope,
+            "result": result,
+            "created_at": time.time()
+        })
+        if len(self._entries) > self.max_entries:
+            self._entries = self._entries[-self.max_entries:]
+
+    def invalidate(self, reason: str = ""):
+        """Drop all cached answers after documents are uploaded or deleted"""
+        self.corpus_version += 1
+        self._entries = []
+        logger.info(f"Semantic cache invalidated (version {self.corpus_version}) {reason}".strip())
+
+    def stats(self) -> Dict:
+        """Hit/miss counters for monitoring"""
+        lookups = self.hits + self.misses
+        return {
+            "entries": len(self._entries),
+            "corpus_version": self.corpus_version,
+            "hits": self.hits,
+            "misses": self.misses,
+            "hit_rate": round(self.hits / lookups, 4) if lookups else 0.0
+        }
+
+
+# Global semantic cache instance
+semantic_cache = SemanticCache()
@@ -0,0 +1,257 @@
+"""
+Text Extraction Workers for RAG Komite Audit System
+CPU-bound parsers run inside a process pool; kept free of app imports so
+worker processes start quickly
+"""
+from datetime import date, datetime
+from typing import Any, Dict, List, Optional
+import logging
+import re
+import PyPDF2
+from docx import Document
+import openpyxl
+
+logger = logging.getLogger(__name__)
+
+
+def count_pdf_pages(file_path: str) -> int:
+    """Return the number of pages in a PDF"""
+    with open(file_path, 'rb') as file:
+        return len(PyPDF2.PdfReader(file).pages)
+
+
+def extract_pdf_pages(file_path: str, start: int, end: int) -> List[str]:
+    """Extract text of pages [start, end) from a PDF"""
+    pages = []
+    with open(file_path, 'rb') as file:
+        pdf_reader = PyPDF2.PdfReader(file)
+        for page_number in range(start, min(end, len(pdf_reader.pages))):
+            pages.append(pdf_reader.pages[page_number].extract_text() or "")
+    return pages
+
+
+def extract_docx(file_path: str) -> str:
+    """Extract paragraph text from a DOCX file"""
+    doc = Document(file_path)
+    return "\n".join([paragraph.text for paragraph in doc.paragraphs])
+
+
+def extract_txt(file_path: str) -> str:
+    """Read a text file, ignoring undecodable bytes"""
+    with open(file_path, 'r', encoding='utf-8', errors='ignore') as file:
+        return file.read()
+
+
+def extract_excel(file_path: str) -> str:
+    """Flatten every sheet of a workbook into pipe-delimited lines"""
+    workbook = openpyxl.load_workbook(file_path, data_only=True)
+    text_parts = []
+
+    for sheet_name in workbook.sheetnames:
+        sheet = workbook[sheet_name]
+        text_parts.append(f"\n=== Sheet: {sheet_name} ===\n")
+
+        for row in sheet.iter_rows(values_only=True):
+            row_text = " | ".join([str(cell) if cell is not None else "" for cell in row])
+            if row_text.strip():
+                text_parts.append(row_text)
+
+    return "\n".join(text_parts)
+
+
+# Header aliases (normalized: lowercase, punctuation stripped) per table kind
+TABLE_COLUMNS = {
+    "risk_register": {
+        "risk_id": ["risk id", "id risiko", "kode risiko", "no risiko", "nomor risiko", "risk no", "risk code", "kode",
+                    "no", "nomor"],
+        "risk_name": ["risk", "risk name", "nama risiko", "risiko", "uraian risiko", "deskripsi risiko",
+                      "risk description", "peristiwa risiko", "risk event"],
+        "risk_category": ["kategori", "kategori risiko", "risk category", "jenis risiko", "category"],
+        "likelihood": ["likelihood", "kemungkinan", "probabilitas", "probability", "tingkat kemungkinan"],
+        "impact": ["impact", "dampak", "tingkat dampak", "konsekuensi"],
+        "inherent_risk_level": ["risk level", "level risiko", "tingkat risiko", "inherent risk", "risiko inheren",
+                                "risk rating", "rating", "peringkat risiko", "skor risiko", "risk score"],
+        "risk_owner": ["owner", "risk owner", "pemilik risiko", "unit", "unit kerja", "penanggung jawab", "pic"],
+        "existing_controls": ["control", "controls", "existing controls", "existing control", "kontrol",
+                              "kontrol yang ada", "pengendalian", "pengendalian yang ada", "mitigasi"]
+    },
+    "audit_plan": {
+        "audit_id": ["audit id", "id audit", "kode audit", "no audit", "nomor audit", "kode penugasan", "kode",
+                     "no", "nomor"],
+        "audit_name": ["audit", "audit name", "nama audit", "program audit", "nama program", "penugasan",
+                       "nama penugasan", "kegiatan", "judul audit"],
+        "audit_type": ["audit type", "jenis audit", "tipe audit", "jenis penugasan"],
+        "auditable_entity": ["auditee", "auditable entity", "objek audit", "obyek audit", "entitas", "area",
+                             "unit kerja", "unit"],
+        "planned_period": ["period", "periode", "jadwal", "waktu pelaksanaan", "quarter", "triwulan", "bulan",
+                           "timeline", "planned period"],
+        "audit_objective": ["objective", "tujuan", "tujuan audit", "ruang lingkup", "scope", "audit objective"],
+        "estimated_days": ["days", "hari", "jumlah hari", "hari audit", "estimated days", "man days", "mandays",
+                           "anggaran hari", "hari kerja"]
+    }
+}
+# A header row must contain the kind's name column and MIN_HEADER_MATCHES known columns
+NAME_COLUMNS = {"risk_register": "risk_name", "audit_plan": "audit_name"}
+ID_COLUMNS = {"risk_register": "risk_id", "audit_plan": "audit_id"}
+MIN_HEADER_MATCHES = 2
+HEADER_SCAN_ROWS = 15
+
+SCALE_LEVELS = {
+    "sangat rendah": "LOW", "rendah": "LOW", "low": "LOW", "very low": "LOW",
+    "sedang": "MEDIUM", "menengah": "MEDIUM", "medium": "MEDIUM", "moderate": "MEDIUM",
+    "tinggi": "HIGH", "high": "HIGH",
+    "sangat tinggi": "VERY_HIGH", "very high": "VERY_HIGH", "ekstrem": "VERY_HIGH", "extreme": "VERY_HIGH"
+}
+RISK_LEVELS = {
+    **{alias: level for alias, level in SCALE_LEVELS.items() if level != "VERY_HIGH"},
+    "sangat tinggi": "CRITICAL", "very high": "CRITICAL", "ekstrem": "CRITICAL", "extreme": "CRITICAL",
+    "kritis": "CRITICAL", "critical": "CRITICAL"
+}
+
+
+def _normalize_header(value: Any) -> str:
+    return re.sub(r"\s+", " ", re.sub(r"[^a-z0-9 ]", " ", str(value).lower())).strip()
+
+
+def _match_columns(row: tuple, kind: str) -> Dict[str, int]:
+    """Canonical field -> column index for the header cells that match a kind's aliases"""
+    matched: Dict[str, int] = {}
+    for position, cell in enumerate(row):
+        if not isinstance(cell, str):
+            continue
+        header = _normalize_header(cell)
+        for field, aliases in TABLE_COLUMNS[kind].items():
+            if field not in matched and header in aliases:
+                matched[field] = position
+                break
+    return matched
+
+
+def _text(value: Any) -> str:
+    if value is None:
+        return ""
+    if isinstance(value, float) and value.is_integer():
+        return str(int(value))
+    if isinstance(value, (datetime, date)):
+        return value.date().isoformat() if isinstance(value, datetime) else value.isoformat()
+    return str(value).strip()
+
+
+def _scale(value: Any, levels: Dict[str, str], numeric: List[str]) -> str:
+    """Map a level label or a 1-5 score onto canonical levels (unknown labels are kept)"""
+    if isinstance(value, (int, float)) and not isinstance(value, bool):
+        score = int(round(value))
+        if score > 5:
+            # Likelihood x impact score on a 5x5 matrix
+            score = 5 if value >= 15 else 4 if value >= 10 else 3 if value >= 5 else 2
+        return numeric[max(1, min(score, 5)) - 1]
+    label = _text(value)
+    try:
+        return _scale(float(label.replace(",", ".")), levels, numeric)
+    except ValueError:
+        pass
+    return levels.get(_normalize_header(label), label.upper())
+
+
+def _days(value: Any) -> Optional[int]:
+    if isinstance(value, (int, float)) and not isinstance(value, bool):
+        return int(round(value))
+    digits = re.search(r"\d+", _text(value))
+    return int(digits.group()) if digits else None
+
+
+def _typed_value(field: str, value: Any) -> Any:
+    if field in ("likelihood", "impact"):
+        return _scale(value, SCALE_LEVELS, ["LOW", "LOW", "MEDIUM", "HIGH", "VERY_HIGH"]) if value is not None else ""
+    if field == "inherent_risk_level":
+        return _scale(value, RISK_LEVELS, ["LOW", "LOW", "MEDIUM", "HIGH", "CRITICAL"]) if value is not None else ""
+    if field == "estimated_days":
+        return _days(value)
+    return _text(value)
+
+
+def _sheet_table(sheet_name: str, rows: List[tuple]) -> Optional[Dict[str, Any]]:
+    """Detect the header row of one sheet and read the rows below it as typed records"""
+    best = None
+    for row_number, row in enumerate(rows[:HEADER_SCAN_ROWS]):
+        for kind, name_column in NAME_COLUMNS.items():
+            matched = _match_columns(row, kind)
+            if name_column in matched and len(matched) >= MIN_HEADER_MATCHES:
+                if best is None or len(matched) > len(best[2]):
+                    best = (row_number, kind, matched)
+    if best is None:
+        return None
+
+    header_row, kind, columns = best
+    header = rows[header_row]
+    extra_columns = {
+        position: _text(cell) for position, cell in enumerate(header)
+        if position not in columns.values() and _text(cell)
+    }
+    records = []
+    for row in rows[header_row + 1:]:
+        name = _text(row[columns[NAME_COLUMNS[kind]]]) if columns[NAME_COLUMNS[kind]] < len(row) else ""
+        if not name:
+            # Blank, subtotal or section rows
+            continue
+        record: Dict[str, Any] = {
+            field: _typed_value(field, row[position] if position < len(row) else None)
+            for field, position in columns.items()
+        }
+        extra = {
+            label: _text(row[position]) for position, label in extra_columns.items()
+            if position < len(row) and _text(row[position])
+        }
+        if extra:
+            record["extra"] = extra
+        records.append(record)
+
+    return {
+        "sheet_name": sheet_name,
+        "kind": kind,
+        "header_row": header_row + 1,
+        "columns": {field: _text(header[position]) for field, position in columns.items()},
+        "rows": records
+    }
+
+
+def merge_table_rows(tables: List[Dict[str, Any]], kind: str) -> List[Dict[str, Any]]:
+    """
+    Rows of several sheets of one kind, in sheet order
+    Sheets are often numbered independently ("No" 1, 2, 3...), so ids that
+    occur in more than one sheet are qualified with the sheet name
+    """
+    id_column = ID_COLUMNS[kind]
+    sheets_per_id: Dict[str, set] = {}
+    for index, table in enumerate(tables):
+        for row in table["rows"]:
+            if row.get(id_column):
+                sheets_per_id.setdefault(row[id_column].upper(), set()).add(index)
+
+    rows = []
+    for index, table in enumerate(tables):
+        for row in table["rows"]:
+            record_id = row.get(id_column)
+            if record_id and len(sheets_per_id[record_id.upper()]) > 1:
+                row = {**row, id_column: f"{table['sheet_name']}-{record_id}"}
+            rows.append(row)
+    return rows
+
+
+def extract_excel_tables(file_path: str) -> List[Dict[str, Any]]:
+    """
+    Read risk register / audit plan sheets as typed records
+    Header rows are found by column aliases (Indonesian and English); sheets
+    without a recognisable header are skipped
+    """
+    workbook = openpyxl.load_workbook(file_path, data_only=True, read_only=True)
+    tables = []
+    try:
+        for sheet_name in workbook.sheetnames:
+            rows = [row for row in workbook[sheet_name].iter_rows(values_only=True)]
+            table = _sheet_table(sheet_name, rows)
+            if table and table["rows"]:
+                tables.append(table)
+    finally:
+        workbook.close()
+    return tables
@@ -0,0 +1,122 @@
+"""
+Token Usage Tracker for RAG Komite Audit System
+Records prompt/completion tokens of every LLM call and aggregates them per
+endpoint, agent and session for capacity planning against Groq rate limits
+"""
+from collections import OrderedDict, deque
+from contextlib import contextmanager
+from contextvars import ContextVar
+from typing import Dict, Iterator, List, Optional, Tuple
+import threading
+import time
+import logging
+from config.config import settings
+
+logging.basicConfig(level=getattr(logging, settings.LOG_LEVEL))
+logger = logging.getLogger(__name__)
+
+# Attribution labels (endpoint, agent, session_id) of the current request/task
+_labels: ContextVar[Dict[str, str]] = ContextVar("usage_labels", default={})
+# Accumulators opened with collect() that every recorded call adds to
+_collectors: ContextVar[Tuple[Dict[str, int], ...]] = ContextVar("usage_collectors", default=())
+
+LABEL_DIMENSIONS = ("endpoint", "agent", "session_id")
+WINDOW_SECONDS = 60.0
+
+
+def empty_usage() -> Dict[str, int]:
+    """Zeroed usage counters"""
+    return {"calls": 0, "prompt_tokens": 0, "completion_tokens": 0, "total_tokens": 0, "estimated_calls": 0}
+
+
+class UsageTracker:
+    """Thread-safe token usage aggregates with a one-minute sliding window"""
+
+    def __init__(self, max_sessions: int = 1000):
+        self.max_sessions = max_sessions
+        self._lock = threading.Lock()
+        self._totals = empty_usage()
+        self._by_label: Dict[str, "OrderedDict[str, Dict[str, int]]"] = {
+            dimension: OrderedDict() for dimension in LABEL_DIMENSIONS
+        }
+        self._window: deque = deque()
+
+    @contextmanager
+    def labels(self, **labels: Optional[str]) -> Iterator[None]:
+        """Attribute LLM calls made inside the block to these labels"""
+        token = _labels.set({**_labels.get(), **{k: v for k, v in labels.items() if v}})
+        try:
+            yield
+        finally:
+            _labels.reset(token)
+
+    def set_labels(self, **labels: Optional[str]):
+        """
+        Set labels for the rest of the current task without a block
+        For async generators, whose context cannot be reset safely across yields
+        """
+        _labels.set({**_labels.get(), **{k: v for k, v in labels.items() if v}})
+
+    @contextmanager
+    def collect(self) -> Iterator[Dict[str, int]]:
+        """Sum the usage of every LLM call made inside the block (including subtasks)"""
+        usage = empty_usage()
+        token = _collectors.set(_collectors.get() + (usage,))
+        try:
+            yield usage
+        finally:
+            _collectors.reset(token)
+
+    @staticmethod
+    def _add(counters: Dict[str, int], prompt_tokens: int, completion_tokens: int, estimated: bool):
+        counters["calls"] += 1
+        counters["prompt_tokens"] += prompt_tokens
+        counters["completion_tokens"] += completion_tokens
+        counters["total_tokens"] += prompt_tokens + completion_tokens
+        counters["estimated_calls"] += int(estimated)
+
+    def record(self, prompt_tokens: int, completion_tokens: int, estimated: bool = False):
+        """Record one LLM call under the current labels and open collectors"""
+        labels = _labels.get()
+        for usage in _collectors.get():
+            self._add(usage, prompt_tokens, completion_tokens, estimated)
+
+        now = time.time()
+        with self._lock:
+            self._add(self._totals, prompt_tokens, completion_tokens, estimated)
+            for dimension in LABEL_DIMENSIONS:
+                value = labels.get(dimension)
+                if not value:
+                    continue
+                bucket = self._by_label[dimension]
+                counters = bucket.setdefault(value, empty_usage())
+                bucket.move_to_end(value)
+                self._add(counters, prompt_tokens, completion_tokens, estimated)
+                if dimension == "session_id" and len(bucket) > self.max_sessions:
+                    bucket.popitem(last=False)
+
+            self._window.append((now, prompt_tokens + completion_tokens))
+            while self._window and self._window[0][0] < now - WINDOW_SECONDS:
+                self._window.popleft()
+
+    def stats(self, top_sessions: int = 20) -> Dict:
+        """Aggregated usage plus requests/tokens in the last minute"""
+        with self._lock:
+            now = time.time()
+            recent = [tokens for timestamp, tokens in self._window if timestamp >= now - WINDOW_SECONDS]
+            sessions: List[Tuple[str, Dict[str, int]]] = sorted(
+                self._by_label["session_id"].items(),
+                key=lambda item: item[1]["total_tokens"],
+                reverse=True
+            )[:top_sessions]
+            return {
+                "totals": dict(self._totals),
+                "last_minute": {"requests": len(recent), "tokens": sum(recent)},
+                "by_endpoint": {k: dict(v) for k, v in self._by_label["endpoint"].items()},
+                "by_agent": {k: dict(v) for k, v in self._by_label["agent"].items()},
+                "top_sessions": {k: dict(v) for k, v in sessions}
+            }
+
+
+# Global usage tracker instance
+usage_tracker = UsageTracker()
@@ -0,0 +1,234 @@
+"""
+Local Vector Index for RAG Komite Audit System
+In-process mirror of komite_audit_embeddings for retrieval without a database round-trip
+"""
+from typing import Any, Dict, List
+import json
+import logging
+import threading
+import numpy as np
+from config.config import settings
+
+logging.basicConfig(level=getattr(logging, settings.LOG_LEVEL))
+logger = logging.getLogger(__name__)
+
+# Documents still ingesting are searchable so early chunks are available sooner
+# (a re-ingested version stays pending, out of the index, until it is complete)
+SEARCHABLE_STATUSES = ("processing", "processed")
+
+
+def parse_vector(value: Any) -> np.ndarray:
+    """Convert a pgvector value (text '[...]' or list) to float32"""
+    if isinstance(value, str):
+        value = json.loads(value)
+    return np.asarray(value, dtype=np.float32)
+
+
+# Significant digits that round-trip each transport precision closely enough for cosine search
+_TRANSPORT_FORMATS = {"float32": "%.7g", "float16": "%.4g"}
+
+
+def format_vectors(vectors: Any, dtype: str = None) -> List[str]:
+    """
+    Encode a (n, dim) or (dim,) float matrix as pgvector text literals
+    Values are formatted at float32/float16 precision in one vectorized pass,
+    instead of repr() of every Python float (17 digits each)
+    """
+    dtype = dtype or settings.EMBEDDING_TRANSPORT_DTYPE
+    matrix = np.atleast_2d(np.asarray(vectors, dtype=np.float32))
+    if dtype == "float16":
+        matrix = matrix.astype(np.float16)
+    text = np.char.mod(_TRANSPORT_FORMATS.get(dtype, "%.7g"), matrix)
+    return ["[" + ",".join(row) + "]" for row in text]
+
+
+class LocalVectorIndex:
+    """
+    Flat float32 index with pre-normalized rows (cosine similarity = dot product)
+    Mirrors search_komite_audit_embeddings: only chunks of processing/processed documents are
+    returned, optionally restricted to a set of document ids
+    """
+
+    def __init__(self, dimension: int = None):
+        self.dimension = dimension or settings.VECTOR_DIMENSION
+        self.loaded = False
+        self._lock = threading.RLock()
+        self._documents: Dict[str, Dict] = {}
+        self._matrix = np.empty((0, self.dimension), dtype=np.float32)
+        self._row_documents = np.empty(0, dtype=object)
+        self._rows: List[Dict] = []
+        self._dirty = False
+
+    @staticmethod
+    def _normalize(vectors: np.ndarray) -> np.ndarray:
+        norms = np.linalg.norm(vectors, axis=1, keepdims=True)
+        norms[norms == 0] = 1.0
+        return vectors / norms
+
+    def set_document(
+        self,
+        document_id: str,
+        filename: str = None,
+        category: str = None,
+        status: str = None
+    ):
+        """Register or update document info used for filtering and results"""
+        with self._lock:
+            document = self._documents.setdefault(document_id, {
+                "filename": None,
+                "category": None,
+                "status": None,
+                "rows": [],
+                "vectors": np.empty((0, self.dimension), dtype=np.float32)
+            })
+            if filename is not None:
+                document["filename"] = filename
+            if category is not None:
+                document["category"] = category
+            if status is not None:
+                document["status"] = status
+            self._dirty = True
+
+    @staticmethod
+    def _row_key(row: Dict[str, Any]) -> Any:
+        """Rows are identified by id; rows without one fall back to chunk_index"""
+        return row.get("id") or ("chunk_index", row["chunk_index"])
+
+    def add_chunks(self, document_id: str, chunks: List[Dict[str, Any]]):
+        """Add (or replace by id) chunks of a document"""
+        if not chunks:
+            return
+
+        with self._lock:
+            self.set_document(document_id)
+            document = self._documents[document_id]
+
+            incoming = {self._row_key(chunk) for chunk in chunks}
+            keep = [i for i, row in enumerate(document["rows"]) if self._row_key(row) not in incoming]
+
+            rows = [document["rows"][i] for i in keep]
+            vectors = [document["vectors"][keep]]
+            for chunk in chunks:
+                rows.append({
+                    "id": chunk.get("id"),
+                    "document_id": document_id,
+                    "chunk_index": chunk["chunk_index"],
+                    "content": chunk["content"],
+                    "metadata": chunk.get("metadata") or {}
+                })
+            vectors.append(self._normalize(np.stack([
+                parse_vector(chunk["embedding"]) for chunk in chunks
+            ])))
+
+            document["rows"] = rows
+            document["vectors"] = np.concatenate(vectors)
+            self._dirty = True
+
+    def remove_chunks(self, document_id: str, chunk_ids: List[str]):
+        """Remove specific chunks of a document by id"""
+        with self._lock:
+            document = self._documents.get(document_id)
+            if not document:
+                return
+            stale = set(chunk_ids)
+            keep = [i for i, row in enumerate(document["rows"]) if row.get("id") not in stale]
+            document["rows"] = [document["rows"][i] for i in keep]
+            document["vectors"] = document["vectors"][keep]
+            self._dirty = True
+
+    def renumber_chunks(self, document_id: str, chunk_indexes: Dict[str, int]):
+        """Move kept chunks (by id) to their new chunk_index after a re-ingest"""
+        with self._lock:
+            document = self._documents.get(document_id)
+            if not document:
+                return
+            for row in document["rows"]:
+                if row.get("id") in chunk_indexes:
+                    row["chunk_index"] = chunk_indexes[row["id"]]
+            self._dirty = True
+
+    def clear_document(self, document_id: str):
+        """Drop all chunks of a document but keep its info"""
+        with self._lock:
+            document = self._documents.get(document_id)
+            if document:
+                document["rows"] = []
+                document["vectors"] = np.empty((0, self.dimension), dtype=np.float32)
+                self._dirty = True
+
+    def remove_document(self, document_id: str):
+        """Drop a document and all its chunks"""
+        with self._lock:
+            if self._documents.pop(document_id, None) is not None:
+                self._dirty = True
+
+    def _rebuild(self):
+        """Concatenate per-document blocks into one searchable matrix"""
+        matrices, owners, rows = [], [], []
+        for document_id, document in self._documents.items():
+            if document["status"] not in SEARCHABLE_STATUSES or not document["rows"]:
+                continue
+            matrices.append(document["vectors"])
+            owners.extend([document_id] * len(document["rows"]))
+            for row in document["rows"]:
+                rows.append({
+                    **row,
+                    "filename": document["filename"],
+                    "category": document["category"]
+                })
+
+        self._matrix = np.concatenate(matrices) if matrices else np.empty((0, self.dimension), dtype=np.float32)
+        self._row_documents = np.asarray(owners, dtype=object)
+        self._rows = rows
+        self._dirty = False
+        logger.info(f"Local vector index rebuilt with {len(rows)} chunks")
+
+    def search(
+        self,
+        query_embedding: List[float],
+        match_threshold: float = 0.7,
+        match_count: int = 10,
+        filter_document_ids: List[str] = None
+    ) -> List[Dict]:
+        """Return chunks ordered by cosine similarity, like the search RPC"""
+        with self._lock:
+            if self._dirty:
+                self._rebuild()
+            matrix, owners, rows = self._matrix, self._row_documents, self._rows
+
+        if not rows:
+            return []
+
+        query = parse_vector(query_embedding)
+        norm = np.linalg.norm(query)
+        if norm > 0:
+            query = query / norm
+
+        similarities = matrix @ query
+        eligible = similarities > match_threshold
+        if filter_document_ids:
+            eligible &= np.isin(owners, list(filter_document_ids))
+
+        candidates = np.flatnonzero(eligible)
+        if candidates.size > match_count:
+            top = np.argpartition(-similarities[candidates], match_count - 1)[:match_count]
+            candidates = candidates[top]
+        candidates = candidates[np.argsort(-similarities[candidates])]
+
+        return [
+            {**rows[i], "similarity": float(similarities[i])}
+            for i in candidates
+        ]
+
+    def stats(self) -> Dict:
+        """Index size for monitoring"""
+        with self._lock:
+            return {
+                "loaded": self.loaded,
+                "documents": len(self._documents),
+                "chunks": sum(len(document["rows"]) for document in self._documents.values())
+            }
+
+
+# Global local vector index instance
+local_index = LocalVectorIndex()
@@ -15,11 +15,20 @@ class Settings(BaseSettings):
     # Groq Configuration (for agent responses)
     GROQ_API_KEY: str
     GROQ_MODEL: str = "llama-3.3-70b-versatile"
+    GROQ_RPM_LIMIT: int = 30  # requests per minute allowed by the Groq plan (0 = no client-side limit)
+    GROQ_TPM_LIMIT: int = 12000  # tokens per minute allowed by the Groq plan (0 = no client-side limit)
+    GROQ_MAX_RETRIES: int = 5  # retries on 429/5xx/connection errors
+    GROQ_RETRY_MAX_DELAY_SECONDS: float = 60.0
 
     # GLM/Zhipu AI Configuration (for query routing)
     GLM_API_KEY: str = ""
     GLM_MODEL: str = "glm-4-plus"
     GLM_BASE_URL: str = "https://open.bigmodel.cn/api/paas/v4/"
+    GLM_TIMEOUT_SECONDS: float = 30.0
+    GLM_POOL_MAX_CONNECTIONS: int = 10
+    GLM_POOL_MAX_KEEPALIVE: int = 5
+    GLM_KEEPALIVE_EXPIRY_SECONDS: float = 60.0
+    GLM_HTTP2: bool = True  # needs the h2 package (httpx[http2])
 
     # Supabase Configuration
     SUPABASE_URL: str
@@ -31,6 +40,28 @@ class Settings(BaseSettings):
     VECTOR_DIMENSION: int = 384
     CHUNK_SIZE: int = 500
     CHUNK_OVERLAP: int = 50
+    EMBEDDING_WORKERS: int = 1
+    EXTRACTION_WORKERS: int = 0  # 0 = one process per CPU core
+    PDF_PAGES_PER_TASK: int = 20
+    INGEST_BATCH_SIZE: int = 64  # chunks per embed/insert batch
+    INGEST_QUEUE_SIZE: int = 4  # batches buffered between pipeline stages
+    EMBEDDING_MAX_BATCH_SIZE: int = 32
+    EMBEDDING_BATCH_WINDOW_MS: float = 5.0
+    EMBEDDING_CACHE_ENABLED: bool = True
+    EMBEDDING_CACHE_MEMORY_ITEMS: int = 10000
+    EMBEDDING_CACHE_PERSIST: bool = True
+    EMBEDDING_TRANSPORT_DTYPE: str = "float32"  # float32 or float16 precision for pgvector payloads
+    VECTOR_SEARCH_BACKEND: str = "remote"  # remote (pgvector RPC) or local (in-process index)
+    HYBRID_SEARCH_ENABLED: bool = False  # fuse BM25 keyword hits with vector hits (keeps all chunk text in memory)
+    HYBRID_CANDIDATES: int = 20  # candidates fetched from each retriever before fusion
+    HYBRID_RRF_K: int = 60
+    RERANK_ENABLED: bool = False  # cross-encoder rerank of over-fetched candidates
+    RERANK_MODEL: str = "cross-encoder/mmarco-mMiniLMv2-L12-H384-v1"
+    RERANK_CANDIDATES: int = 50
+    RERANK_MIN_SIMILARITY: float = 0.5  # looser vector threshold while over-fetching
+    RERANK_BATCH_SIZE: int = 16
+    RERANK_CACHE_ITEMS: int = 5000
+    RERANK_MAX_CONTEXT_TOKENS: int = 1500
 
     # Application Configuration
     APP_NAME: str = "RAG Komite Audit System"
@@ -42,12 +73,50 @@ class Settings(BaseSettings):
     MAX_AGENT_ITERATIONS: int = 3
     AGENT_TEMPERATURE: float = 0.7
     MAX_TOKENS: int = 2000
+    AGENT_TIMEOUT_SECONDS: float = 60.0
+    PROMPT_TOKEN_BUDGET: int = 6000  # system prompt + history + context per request
+    HISTORY_TOKEN_BUDGET: int = 1200
+    HISTORY_TURN_MAX_TOKENS: int = 300  # longer past answers are truncated
+    TOKENIZER_ENCODING: str = "cl100k_base"
+    FINANCIAL_ANALYSIS_WINDOW_TOKENS: int = 4000  # longer documents are analysed per section window
+    FINANCIAL_ANALYSIS_WINDOW_MAX_TOKENS: int = 2000  # completion tokens per window
+    FINANCIAL_ANALYSIS_CONCURRENCY: int = 4  # windows in flight per analysis
+    RISK_MAPPING_WINDOW_TOKENS: int = 2500  # document window per record extraction call
+    RISK_MAPPING_EXTRACT_MAX_TOKENS: int = 3000
+    RISK_MAPPING_CANDIDATES_PER_RISK: int = 5  # most similar audit programs judged per risk
+    RISK_MAPPING_MIN_SIMILARITY: float = 0.25
+    RISK_MAPPING_BATCH_RISKS: int = 10  # risks judged per coverage call
+    RISK_MAPPING_JUDGE_MAX_TOKENS: int = 2000
+    RISK_MAPPING_CONCURRENCY: int = 4
+
+    # Semantic Answer Cache
+    SEMANTIC_CACHE_ENABLED: bool = True
+    SEMANTIC_CACHE_THRESHOLD: float = 0.95
+    SEMANTIC_CACHE_TTL_SECONDS: float = 3600.0
+    SEMANTIC_CACHE_MAX_ENTRIES: int = 1000
+
+    # Analysis Result Cache
+    ANALYSIS_CACHE_ENABLED: bool = True
+
+    # Background Jobs
+    JOB_WORKERS: int = 2
+    JOB_MAX_ATTEMPTS: int = 3
 
     # Database Tables
     DOCUMENTS_TABLE: str = "komite_audit_documents"
     EMBEDDINGS_TABLE: str = "komite_audit_embeddings"
+    DOCUMENT_TABLES_TABLE: str = "komite_audit_document_tables"
     CONVERSATIONS_TABLE: str = "komite_audit_conversations"
 
+    # Database Connection Pool
+    DB_POOL_MAX_CONNECTIONS: int = 20
+    DB_POOL_MAX_KEEPALIVE: int = 10
+    DB_TIMEOUT_SECONDS: float = 30.0
+    DB_INSERT_WRITERS: int = 4  # concurrent embedding write batches
+    DB_INSERT_MAX_BATCH_BYTES: int = 1_000_000
+    DB_INSERT_MAX_BATCH_ROWS: int = 500
+    DB_INSERT_RETRIES: int = 3
+
 # Initialize settings
 settings = Settings()
 
@@ -56,9 +125,10 @@ BASE_DIR = Path(__file__).parent
 DATA_DIR = BASE_DIR / "data"
 UPLOAD_DIR = DATA_DIR / "uploads"
 PROCESSED_DIR = DATA_DIR / "processed"
+CACHE_DIR = DATA_DIR / "cache"
 
 # Create directories if they don't exist
-for directory in [DATA_DIR, UPLOAD_DIR, PROCESSED_DIR]:
+for directory in [DATA_DIR, UPLOAD_DIR, PROCESSED_DIR, CACHE_DIR]:
     directory.mkdir(parents=True, exist_ok=True)
 
 # Agent definitions
@@ -32,6 +32,28 @@ CREATE TABLE IF NOT EXISTS komite_audit_embeddings (
     created_at TIMESTAMP WITH TIME ZONE DEFAULT NOW()
 );
 
+-- Content hash per chunk, used to diff chunks when a document is re-uploaded
+ALTER TABLE komite_audit_embeddings ADD COLUMN IF NOT EXISTS content_hash VARCHAR(64);
+
+-- Chunks of a re-uploaded version stay pending (not searchable) until every chunk is stored
+ALTER TABLE komite_audit_embeddings ADD COLUMN IF NOT EXISTS pending BOOLEAN NOT NULL DEFAULT FALSE;
+
+-- Structured tables - typed rows read from risk register / PKPT spreadsheets
+CREATE TABLE IF NOT EXISTS komite_audit_document_tables (
+    id UUID PRIMARY KEY DEFAULT gen_random_uuid(),
+    document_id UUID REFERENCES komite_audit_documents(id) ON DELETE CASCADE,
+    table_index INTEGER NOT NULL,
+    sheet_name VARCHAR(255),
+    kind VARCHAR(50),              -- risk_register / audit_plan
+    header_row INTEGER,
+    columns JSONB,                 -- canonical field -> original header
+    rows JSONB NOT NULL,
+    row_count INTEGER DEFAULT 0,
+    created_at TIMESTAMP WITH TIME ZONE DEFAULT NOW()
+);
+
+CREATE INDEX IF NOT EXISTS idx_document_tables_document_id ON komite_audit_document_tables(document_id, kind);
+
 -- Conversations table - menyimpan history conversations
 CREATE TABLE IF NOT EXISTS komite_audit_conversations (
     id UUID PRIMARY KEY DEFAULT gen_random_uuid(),
@@ -66,6 +88,7 @@ CREATE TABLE IF NOT EXISTS agent_logs (
 CREATE INDEX IF NOT EXISTS idx_documents_category ON komite_audit_documents(category);
 CREATE INDEX IF NOT EXISTS idx_documents_status ON komite_audit_documents(status);
 CREATE INDEX IF NOT EXISTS idx_documents_upload_date ON komite_audit_documents(upload_date);
+CREATE INDEX IF NOT EXISTS idx_documents_filename ON komite_audit_documents(filename);
 
 CREATE INDEX IF NOT EXISTS idx_embeddings_document_id ON komite_audit_embeddings(document_id);
 CREATE INDEX IF NOT EXISTS idx_embeddings_chunk_index ON komite_audit_embeddings(chunk_index);
@@ -132,7 +155,9 @@ BEGIN
     WHERE 
         1 - (e.embedding <=> query_embedding) > match_threshold
         AND (filter_document_ids IS NULL OR e.document_id = ANY(filter_document_ids))
-        AND d.status = 'processed'
+        -- Chunks of a new document are searchable while ingestion is still streaming them in
+        AND d.status IN ('processing', 'processed')
+        AND NOT e.pending
     ORDER BY e.embedding <=> query_embedding
     LIMIT match_count;
 END;
@@ -285,3 +310,12 @@ JOIN komite_audit_documents d ON ei.document_id = d.id
 GROUP BY d.category;
 
 COMMENT ON TABLE executive_insights IS 'Stores executive-level insight analysis from AI CRO/CFO Advisor';
+
+-- Analysis result cache - hash of (document content hashes, analysis type, prompt version, model)
+ALTER TABLE financial_analyses ADD COLUMN IF NOT EXISTS cache_key VARCHAR(64);
+ALTER TABLE risk_audit_mappings ADD COLUMN IF NOT EXISTS cache_key VARCHAR(64);
+ALTER TABLE executive_insights ADD COLUMN IF NOT EXISTS cache_key VARCHAR(64);
+
+CREATE INDEX IF NOT EXISTS idx_analyses_cache_key ON financial_analyses(cache_key, created_at DESC);
+CREATE INDEX IF NOT EXISTS idx_risk_mappings_cache_key ON risk_audit_mappings(cache_key, created_at DESC);
+CREATE INDEX IF NOT EXISTS idx_exec_insights_cache_key ON executive_insights(cache_key, created_at DESC);
@@ -5,6 +5,8 @@ Professional minimalist interface
 import streamlit as st
 import requests
 import uuid
+import json
+import time
 from datetime import datetime
 import plotly.express as px
 import plotly.graph_objects as go
@@ -1082,6 +1084,58 @@ def call_api(endpoint: str, method: str = "GET", timeout: int = 120, **kwargs):
         st.error(f"Error: {str(e)}")
         return None
 
+def run_job(endpoint: str, payload: dict, max_wait: int = 1800, poll_interval: float = 2.0):
+    """Submit an analysis job and poll it until done, showing its progress; returns the job result"""
+    submitted = call_api(endpoint, method="POST", json=payload)
+    if not submitted or not submitted.get("job_id"):
+        return submitted
+
+    progress_bar = st.progress(0.0, text="Menunggu antrian...")
+    deadline = time.time() + max_wait
+    try:
+        while time.time() < deadline:
+            job = call_api(f"jobs/{submitted['job_id']}", timeout=30)
+            if job is None:
+                return None
+            progress_bar.progress(min(float(job.get("progress") or 0.0), 1.0), text=job.get("stage") or job["status"])
+            if job["status"] == "completed":
+                return job.get("result")
+            if job["status"] == "failed":
+                return {"success": False, "detail": job.get("error")}
+            time.sleep(poll_interval)
+    finally:
+        progress_bar.empty()
+
+    st.error("Analisis masih berjalan. Periksa kembali nanti.")
+    return None
+
+def stream_api(endpoint: str, payload: dict, timeout: int = 120):
+    """Call a Server-Sent Events endpoint and yield (event, data) pairs"""
+    url = f"{API_BASE_URL}/{endpoint}"
+    with requests.post(url, json=payload, stream=True, timeout=timeout) as response:
+        response.raise_for_status()
+        event = None
+        for line in response.iter_lines(decode_unicode=True):
+            if line.startswith("event: "):
+                event = line[len("event: "):]
+            elif line.startswith("data: "):
+                yield event, json.loads(line[len("data: "):])
+
+def stream_answer(endpoint: str, payload: dict, events: dict, timeout: int = 120):
+    """Yield answer tokens from a streaming endpoint, collecting other events"""
+    try:
+        for event, data in stream_api(endpoint, payload, timeout=timeout):
+            if event == "token":
+                yield data.get("text", "")
+            else:
+                events[event] = data
+    except requests.exceptions.Timeout:
+        events["error"] = {"error": "Request timeout. Server mungkin sedang sibuk, coba lagi."}
+    except requests.exceptions.ConnectionError:
+        events["error"] = {"error": "Tidak dapat terhubung ke server. Periksa koneksi."}
+    except Exception as e:
+        events["error"] = {"error": str(e)}
+
 def format_bytes(size):
     """Format bytes to human readable"""
     for unit in ['B', 'KB', 'MB', 'GB']:
@@ -1532,27 +1586,30 @@ elif selected == "Konsultasi":
 
     # Process query
     if submit_button and user_query:
-        with st.spinner("Memproses pertanyaan Anda..."):
-            result = call_api(
-                "query",
-                method="POST",
-                json={
-                    "query": user_query,
-                    "session_id": st.session_state.session_id,
-                    "use_context": use_context,
-                    "max_agents": max_agents
-                }
-            )
-
-            if result and result.get("success"):
-                st.session_state.conversation_history.append({
-                    "query": user_query,
-                    "response": result.get("response"),
-                    "agents_used": result.get("agents_used", []),
-                    "processing_time": result.get("processing_time_ms"),
-                    "context_count": result.get("context_count", 0),
-                    "timestamp": datetime.now()
-                })
+        stream_events = {}
+        response_text = st.write_stream(stream_answer(
+            "query/stream",
+            {
+                "query": user_query,
+                "session_id": st.session_state.session_id,
+                "use_context": use_context,
+                "max_agents": max_agents
+            },
+            stream_events
+        ))
+
+        if "done" in stream_events:
+            st.session_state.conversation_history.append({
+                "query": user_query,
+                "response": response_text,
+                "agents_used": stream_events["done"].get("agents_used", []),
+                "processing_time": stream_events["done"].get("processing_time_ms"),
+                "context_count": stream_events.get("sources", {}).get("context_count", 0),
+                "timestamp": datetime.now()
+            })
+            st.rerun()
+        elif "error" in stream_events:
+            st.error(f"Error: {stream_events['error'].get('error')}")
 
     # Conversation History
     if st.session_state.conversation_history:
@@ -1693,29 +1750,28 @@ elif selected == "Dokumen":
 
                     if st.button("Kirim", key=f"chat_btn_{doc['id']}"):
                         if chat_query:
-                            with st.spinner("Mencari jawaban..."):
-                                chat_result = call_api(
-                                    "chat-document",
-                                    method="POST",
-                                    timeout=120,
-                                    json={
-                                        "document_id": doc['id'],
-                                        "query": chat_query,
-                                        "session_id": st.session_state.session_id
-                                    }
-                                )
-
-                                if chat_result and chat_result.get("success"):
-                                    # Store in session state
-                                    if doc['id'] not in st.session_state.document_chat_history:
-                                        st.session_state.document_chat_history[doc['id']] = []
-                                    st.session_state.document_chat_history[doc['id']].append({
-                                        "query": chat_query,
-                                        "response": chat_result.get("response", ""),
-                                        "agents": chat_result.get("agents_used", [])
-                                    })
-                                else:
-                                    st.error("Gagal mendapatkan jawaban. Silakan coba lagi.")
+                            chat_events = {}
+                            chat_response = st.write_stream(stream_answer(
+                                "chat-document/stream",
+                                {
+                                    "document_id": doc['id'],
+                                    "query": chat_query,
+                                    "session_id": st.session_state.session_id
+                                },
+                                chat_events
+                            ))
+
+                            if "done" in chat_events:
+                                # Store in session state
+                                if doc['id'] not in st.session_state.document_chat_history:
+                                    st.session_state.document_chat_history[doc['id']] = []
+                                st.session_state.document_chat_history[doc['id']].append({
+                                    "query": chat_query,
+                                    "response": chat_response,
+                                    "agents": chat_events["done"].get("agents_used", [])
+                                })
+                            else:
+                                st.error("Gagal mendapatkan jawaban. Silakan coba lagi.")
 
                     # Display chat history for this document
                     if doc['id'] in st.session_state.document_chat_history:
@@ -1827,11 +1883,9 @@ elif selected == "Analisis":
         # Analyze button
         if st.button("🔍 Mulai Analisis", type="primary", use_container_width=True):
             with st.spinner("Menganalisis dokumen... Ini mungkin memakan waktu beberapa menit."):
-                result = call_api(
+                result = run_job(
                     "analyze",
-                    method="POST",
-                    timeout=300,  # 5 minutes timeout for analysis
-                    json={
+                    {
                         "document_id": selected_doc_id,
                         "session_id": st.session_state.session_id,
                         "analysis_type": analysis_type
@@ -2106,7 +2160,6 @@ elif selected == "Analisis":
 
             # Download JSON
             st.markdown("---")
-            import json
             analysis_json = json.dumps(analysis, indent=2, ensure_ascii=False)
             st.download_button(
                 label="📥 Download Hasil Analisis (JSON)",
@@ -2229,11 +2282,9 @@ elif selected == "Analisis":
         # Analyze button for Executive Insight
         if st.button("🎯 Generate Executive Insight", type="primary", use_container_width=True, key="exec_insight_btn"):
             with st.spinner("Generating executive insight... Ini mungkin memakan waktu beberapa menit."):
-                exec_result = call_api(
+                exec_result = run_job(
                     "executive-insight",
-                    method="POST",
-                    timeout=300,
-                    json={
+                    {
                         "document_id": exec_selected_doc_id,
                         "session_id": st.session_state.session_id,
                         "analysis_type": exec_analysis_type
@@ -2609,11 +2660,9 @@ elif selected == "Risk Mapping":
             if st.button("Mulai Pemetaan Risiko", type="primary",
                          use_container_width=True, disabled=map_disabled):
                 with st.spinner("Memetakan risiko terhadap program audit..."):
-                    result = call_api(
+                    result = run_job(
                         "risk-mapping",
-                        method="POST",
-                        timeout=300,
-                        json={
+                        {
                             "risk_register_document_id": risk_doc_id,
                             "audit_plan_document_id": audit_doc_id,
                             "session_id": st.session_state.session_id,
@@ -2863,6 +2912,17 @@ elif selected == "Risk Mapping":
                     else:
                         st.info("Tidak ada area yang over-audited.")
 
+                    # Risks whose coverage could not be assessed (not counted as gaps)
+                    not_assessed = gap.get('not_assessed_risks', [])
+                    if not_assessed:
+                        st.markdown("---")
+                        st.markdown("**Risiko Belum Dinilai (perlu review manual)**")
+                        for risk in not_assessed:
+                            st.markdown(
+                                f"- **{risk.get('risk_id', '')}** [{risk.get('risk_level', '')}] "
+                                f"{risk.get('risk_name', '')}"
+                            )
+
                 # --- Tab 4: Rekomendasi ---
                 with tab4:
                     recs = mapping.get('recommendations', {})
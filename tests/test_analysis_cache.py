@@ -0,0 +1,42 @@
+"""
+Tests for analysis result cache keys
+Run with: pytest tests/
+"""
+from backend.analysis_cache import AnalysisCache
+
+def test_key_changes_with_content_prompt_version_and_model():
+    """Any change to content, analysis type, prompt version or model yields a new key"""
+    document = AnalysisCache.document_hash(["a1", "b2"])
+    base = AnalysisCache.make_key([document], "comprehensive", "2", "llama-3.3-70b-versatile")
+
+    assert AnalysisCache.make_key([document], "comprehensive", "2", "llama-3.3-70b-versatile") == base
+    assert AnalysisCache.make_key([AnalysisCache.document_hash(["a1", "c3"])], "comprehensive", "2",
+                                  "llama-3.3-70b-versatile") != base
+    assert AnalysisCache.make_key([document], "quick", "2", "llama-3.3-70b-versatile") != base
+    assert AnalysisCache.make_key([document], "comprehensive", "3", "llama-3.3-70b-versatile") != base
+    assert AnalysisCache.make_key([document], "comprehensive", "2", "other-model") != base
+    assert AnalysisCache.document_hash(["a1", None]) is None
+    assert AnalysisCache.document_hash([]) is None
+
+def test_only_complete_results_are_cacheable():
+    """Fallback responses and partially failed runs are not reused"""
+    assert AnalysisCache.is_cacheable({"executive_summary": {}})
+    assert not AnalysisCache.is_cacheable({"executive_summary": {}, "error": "timeout"})
+    assert not AnalysisCache.is_cacheable({"analysis_coverage": {"windows": 4, "windows_analyzed": 3,
+                                                                 "partial_failure": True}})
+    assert AnalysisCache.is_cacheable({"analysis_coverage": {"windows": 4, "windows_analyzed": 4,
+                                                             "partial_failure": False}})
+
+def test_llm_reported_data_issues_do_not_block_caching():
+    """A normal financial analysis lists data limitations written by the LLM and is still cached"""
+    result = {
+        "executive_summary": {"overview": "Kinerja stabil", "overall_assessment": "MODERATE"},
+        "financial_ratios": {"liquidity": {"current_ratio": {"value": "1.20", "trend": "STABLE"}}},
+        "risk_assessment": {"overall_risk_level": "MEDIUM", "red_flags": []},
+        "data_quality_notes": {
+            "completeness": "MEDIUM",
+            "issues": ["Laporan arus kas tidak tersedia", "Data segmen tidak lengkap"],
+            "assumptions": ["Angka dalam jutaan Rupiah"]
+        }
+    }
+    assert AnalysisCache.is_cacheable(result)
@@ -0,0 +1,62 @@
+"""
+Tests for token-budgeted prompt packing and document windowing
+Run with: pytest tests/
+"""
+from backend.context_packer import (
+    build_windows, count_tokens, dedupe_chunks, pack_context, pack_history, split_sections
+)
+
+def test_dedupe_chunks_removes_overlap_sentences():
+    """Overlapping sentences are kept once; fully duplicated chunks are dropped"""
+    chunks = [
+        "Komite audit dibentuk oleh dewan komisaris. Anggota paling sedikit tiga orang.",
+        "Anggota paling sedikit tiga orang. Ketua adalah komisaris independen.",
+        "Komite audit dibentuk oleh dewan komisaris."
+    ]
+    assert dedupe_chunks(chunks) == [
+        chunks[0],
+        "Ketua adalah komisaris independen."
+    ]
+
+def test_pack_context_respects_budget():
+    """Chunks are kept in rank order until the budget is used"""
+    chunks = [f"Kalimat nomor {i} tentang pengawasan audit internal." for i in range(20)]
+    packed, used = pack_context(chunks, budget=40, min_partial_tokens=1000)
+
+    assert packed == chunks[:len(packed)]
+    assert 0 < len(packed) < len(chunks)
+    assert used <= 40
+
+def test_pack_history_keeps_recent_turns_and_truncates_answers():
+    """Newest turns win and long answers are shortened; input is newest-first as the DB returns it"""
+    history = [
+        {"user_query": f"Pertanyaan {i}", "agent_response": "jawaban panjang " * 200,
+         "created_at": f"2024-05-01T10:0{i}:00+00:00"}
+        for i in reversed(range(8))
+    ]
+    packed, used = pack_history(history, budget=200, turn_max_tokens=50)
+
+    assert packed
+    assert packed[-1]["user_query"] == "Pertanyaan 7"
+    assert [turn["user_query"] for turn in packed] == sorted(turn["user_query"] for turn in packed)
+    assert all(count_tokens(turn["agent_response"]) <= 55 for turn in packed)
+    assert used <= 200
+
+def test_windows_follow_sections_and_cover_whole_document():
+    """Sections are split at inline headings and packed whole into bounded windows"""
+    notes = " ".join(
+        f"{i}. CATATAN NOMOR {i} ATAS LAPORAN KEUANGAN Saldo akun nomor {i} adalah Rp {i}00 juta. " * 3
+        for i in range(1, 31)
+    )
+    text = "LAPORAN POSISI KEUANGAN KONSOLIDASIAN Total aset Rp 10 triliun. " + notes
+
+    sections = split_sections(text)
+    windows = build_windows(text, max_tokens=200)
+
+    assert sections[0].startswith("LAPORAN POSISI KEUANGAN")
+    assert sections[1].startswith("1. CATATAN NOMOR 1")
+    assert len(windows) > 1
+    assert all(count_tokens(window) <= 200 for window in windows)
+    # Nothing is dropped: every note's figure appears in some window
+    assert all(any(f"Rp {i}00 juta" in window for window in windows) for i in range(1, 31))
+    assert build_windows("Laba bersih naik.", max_tokens=200) == ["Laba bersih naik."]
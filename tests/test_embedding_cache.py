@@ -0,0 +1,33 @@
+"""
+Tests for the content-addressed embedding cache
+Run with: pytest tests/
+"""
+import numpy as np
+from backend.embedding_cache import EmbeddingCache
+
+def test_cache_roundtrip_and_counters(tmp_path):
+    """Test hits, misses and whitespace-normalized keys"""
+    cache = EmbeddingCache("test-model", path=tmp_path / "cache.sqlite3", max_memory_items=10)
+    vector = np.arange(4, dtype=np.float32)
+
+    assert cache.get_many(["Komite Audit"]) == [None]
+    cache.put_many(["Komite Audit"], [vector])
+
+    hit = cache.get_many(["  Komite   Audit "])[0]
+    assert np.array_equal(hit, vector)
+
+    stats = cache.stats()
+    assert stats["misses"] == 1
+    assert stats["memory_hits"] == 1
+
+def test_cache_persists_to_disk(tmp_path):
+    """Test a fresh cache instance reads embeddings written by another"""
+    path = tmp_path / "cache.sqlite3"
+    EmbeddingCache("test-model", path=path).put_many(["PSAK 71"], [np.ones(4, dtype=np.float32)])
+
+    cache = EmbeddingCache("test-model", path=path)
+    assert np.array_equal(cache.get_many(["PSAK 71"])[0], np.ones(4, dtype=np.float32))
+    assert cache.stats()["disk_hits"] == 1
+
+    other_model = EmbeddingCache("other-model", path=path)
+    assert other_model.get_many(["PSAK 71"]) == [None]
@@ -2,8 +2,9 @@
 Tests for RAG Komite Audit System
 Run with: pytest tests/
 """
+import asyncio
 import pytest
-from backend.embeddings import embedding_manager
+from backend.embeddings import embedding_manager, ChunkBuilder, EmbeddingService
 
 def test_embedding_generation():
     """Test embedding generation"""
@@ -27,6 +28,23 @@ def test_text_chunking():
     assert all('chunk_index' in chunk for chunk in chunks)
     assert all('content' in chunk for chunk in chunks)
 
+def test_chunk_builder_matches_chunk_text():
+    """Feeding text page by page gives the same chunks as chunking it whole"""
+    pages = [
+        "Komite Audit mereview laporan keuangan. Auditor eksternal menyampaikan",
+        "temuan audit. Manajemen menanggapi temuan tersebut. Risiko kredit dipantau",
+        "secara berkala. Kepatuhan terhadap peraturan OJK dievaluasi."
+    ]
+    text = "".join(page + "\n" for page in pages)
+    
+    builder = ChunkBuilder(chunk_size=12, chunk_overlap=4)
+    streamed = []
+    for page in pages:
+        streamed.extend(builder.add_text(page + "\n"))
+    streamed.extend(builder.finish())
+    
+    assert streamed == embedding_manager.chunk_text(text, chunk_size=12, chunk_overlap=4)
+
 def test_cosine_similarity():
     """Test cosine similarity calculation"""
     text1 = "Audit Committee"
@@ -40,4 +58,23 @@ def test_cosine_similarity():
     assert 0 <= similarity <= 1
     assert similarity > 0.4  # Should be reasonably similar (cross-lingual)
 
+def test_embedding_service_micro_batching():
+    """Test concurrent embed() calls match direct embeddings"""
+    texts = ["Komite Audit", "Audit Internal", "Laporan Keuangan"]
+
+    async def run():
+        service = EmbeddingService(embedding_manager, batch_window_ms=20)
+        try:
+            single = await asyncio.gather(*(service.embed(text) for text in texts))
+            many = await service.embed_many(texts)
+        finally:
+            await service.close()
+        return single, many
+
+    single, many = asyncio.run(run())
+
+    assert len(single) == len(texts)
+    for emb1, emb2 in zip(single, many):
+        assert embedding_manager.cosine_similarity(emb1, emb2) > 0.999
+
 # Add more tests as needed
@@ -0,0 +1,96 @@
+"""
+Tests for merging map-reduce financial analyses
+Run with: pytest tests/
+"""
+from agents.financial_analyst import merge_partial_analyses
+
+def test_partial_analyses_merge_into_single_schema():
+    """First reported figure wins, lists are deduplicated and the highest risk level is kept"""
+    partials = [
+        {
+            "executive_summary": {"overview": "Bagian 1", "key_findings": ["Likuiditas ketat"],
+                                  "overall_assessment": "MODERATE", "confidence_level": "HIGH"},
+            "financial_ratios": {"liquidity": {
+                "current_ratio": {"value": "N/A - Data tidak tersedia"},
+                "quick_ratio": {"value": "0.80", "trend": "DOWN"}
+            }},
+            "risk_assessment": {"overall_risk_level": "MEDIUM", "red_flags": [
+                {"severity": "MEDIUM", "description": "Kas menurun"}
+            ]},
+            "recommendations": {"immediate_actions": ["Review arus kas"]}
+        },
+        {
+            "executive_summary": {"overview": "Bagian 2", "key_findings": ["likuiditas ketat", "Litigasi pajak"],
+                                  "overall_assessment": "MODERATE"},
+            "financial_ratios": {"liquidity": {
+                "current_ratio": {"value": "1.10", "trend": "STABLE"},
+                "quick_ratio": {"value": "0.90"}
+            }},
+            "risk_assessment": {"overall_risk_level": "HIGH", "red_flags": [
+                {"severity": "HIGH", "description": "Sengketa pajak"},
+                {"severity": "MEDIUM", "description": "kas menurun"}
+            ]},
+            "recommendations": {"immediate_actions": ["Review arus kas", "Konsultasi pajak"]}
+        }
+    ]
+
+    merged = merge_partial_analyses(partials)
+
+    liquidity = merged["financial_ratios"]["liquidity"]
+    assert liquidity["current_ratio"]["value"] == "1.10"
+    assert liquidity["quick_ratio"]["value"] == "0.80"
+    assert merged["executive_summary"]["key_findings"] == ["Likuiditas ketat", "Litigasi pajak"]
+    assert merged["executive_summary"]["overall_assessment"] == "MODERATE"
+    assert merged["risk_assessment"]["overall_risk_level"] == "HIGH"
+    assert [f["description"] for f in merged["risk_assessment"]["red_flags"]] == ["Sengketa pajak", "Kas menurun"]
+    assert merged["recommendations"]["immediate_actions"] == ["Review arus kas", "Konsultasi pajak"]
+    assert set(merged["financial_ratios"]) >= {"profitability", "liquidity", "solvency", "efficiency"}
+
+def test_window_progress_reports_merged_partials(monkeypatch):
+    """Each finished window reports progress with the merge of the windows analysed so far"""
+    import asyncio
+    import json
+    from backend.llm_client import llm_client
+    from agents.financial_analyst import financial_analyst
+
+    async def fake_completion(messages, **kwargs):
+        parts = messages[-1]["content"].split("---")
+        if len(parts) < 3:
+            # Reduce call over the merged result
+            return json.dumps({"overview": "Ringkasan"})
+        return json.dumps({"executive_summary": {"key_findings": [f"Temuan {parts[1].strip()}"]}})
+
+    monkeypatch.setattr(llm_client, "generate_completion", fake_completion)
+    reports = []
+
+    async def progress(stage, fraction=None, partial=None):
+        reports.append((stage, fraction, partial))
+
+    asyncio.run(financial_analyst._analyze_windows(["A", "B", "C"], {}, "comprehensive", progress))
+
+    window_reports = [r for r in reports if r[0].startswith("analyzing window")]
+    assert [r[0] for r in window_reports] == [f"analyzing window {i}/3" for i in (1, 2, 3)]
+    assert [r[1] for r in window_reports] == sorted(r[1] for r in window_reports)
+    assert sorted(window_reports[-1][2]["executive_summary"]["key_findings"]) == ["Temuan A", "Temuan B", "Temuan C"]
+    assert reports[-1][0] == "summarizing"
+
+def test_summary_cannot_lower_the_merged_risk_level(monkeypatch):
+    """A window rated CRITICAL stays CRITICAL even if the reduce call reports a lower level"""
+    import asyncio
+    import json
+    from backend.llm_client import llm_client
+    from agents.financial_analyst import financial_analyst
+
+    async def fake_completion(messages, **kwargs):
+        parts = messages[-1]["content"].split("---")
+        if len(parts) < 3:
+            return json.dumps({"overview": "Ringkasan", "overall_risk_level": "MEDIUM"})
+        level = "CRITICAL" if parts[1].strip() == "B" else "LOW"
+        return json.dumps({"risk_assessment": {"overall_risk_level": level}})
+
+    monkeypatch.setattr(llm_client, "generate_completion", fake_completion)
+
+    result = asyncio.run(financial_analyst._analyze_windows(["A", "B"], {}, "comprehensive", None))
+
+    assert result["risk_assessment"]["overall_risk_level"] == "CRITICAL"
+    assert result["executive_summary"]["overview"] == "Ringkasan"
@@ -0,0 +1,85 @@
+"""
+Tests for the durable job queue
+Run with: pytest tests/
+"""
+import asyncio
+from backend.job_queue import JobQueue, PermanentJobError, COMPLETED, FAILED, QUEUED
+
+def test_job_queue_runs_jobs_and_records_progress(tmp_path):
+    """Test completion, progress reporting and failure after max attempts"""
+    queue = JobQueue(tmp_path / "jobs.sqlite3", workers=2, max_attempts=1)
+
+    async def succeed(payload, progress):
+        await progress("working", 0.5, partial={"seen": payload["value"]})
+        return {"doubled": payload["value"] * 2}
+
+    async def fail(payload, progress):
+        raise RuntimeError("boom")
+
+    queue.register("succeed", succeed)
+    queue.register("fail", fail)
+
+    async def run():
+        await queue.start()
+        ok_id = await queue.submit("succeed", {"value": 21})
+        bad_id = await queue.submit("fail", {})
+        await queue._queue.join()
+        await queue.stop()
+        return ok_id, bad_id
+
+    ok_id, bad_id = asyncio.run(run())
+
+    ok = queue.get(ok_id)
+    assert ok["status"] == COMPLETED
+    assert ok["result"] == {"doubled": 42}
+    assert ok["partial"] == {"seen": 21}
+
+    bad = queue.get(bad_id)
+    assert bad["status"] == FAILED
+    assert bad["error"] == "boom"
+
+def test_job_queue_resumes_unfinished_jobs(tmp_path):
+    """Test jobs queued before a restart run when the queue starts again"""
+    path = tmp_path / "jobs.sqlite3"
+    first = JobQueue(path)
+    first.register("echo", lambda payload, progress: asyncio.sleep(0, result=payload))
+    job_id = asyncio.run(first.submit("echo", {"a": 1}))
+    assert first.get(job_id)["status"] == QUEUED
+
+    second = JobQueue(path)
+
+    async def echo(payload, progress):
+        return payload
+
+    second.register("echo", echo)
+
+    async def run():
+        await second.start()
+        await second._queue.join()
+        await second.stop()
+
+    asyncio.run(run())
+    assert second.get(job_id)["status"] == COMPLETED
+
+def test_permanent_errors_are_not_retried(tmp_path):
+    """A PermanentJobError fails the job on its first attempt despite max_attempts"""
+    queue = JobQueue(tmp_path / "jobs.sqlite3", workers=1, max_attempts=3)
+    calls = []
+
+    async def missing_input(payload, progress):
+        calls.append(payload)
+        raise PermanentJobError("Document text not found")
+
+    queue.register("analyze", missing_input)
+
+    async def run():
+        await queue.start()
+        job_id = await queue.submit("analyze", {})
+        await queue._queue.join()
+        await queue.stop()
+        return job_id
+
+    job = queue.get(asyncio.run(run()))
+    assert job["status"] == FAILED
+    assert job["attempts"] == 1
+    assert len(calls) == 1
@@ -0,0 +1,49 @@
+"""
+Tests for the BM25 keyword index and rank fusion
+Run with: pytest tests/
+"""
+from backend.keyword_index import KeywordIndex, reciprocal_rank_fusion, tokenize
+
+def test_tokenize_keeps_regulation_identifiers():
+    """Compound identifiers are kept whole and split into parts"""
+    tokens = tokenize("Sesuai POJK 55/2015 dan PSAK 71")
+    assert "55/2015" in tokens
+    assert "2015" in tokens
+    assert "psak" in tokens and "71" in tokens
+    assert "dan" not in tokens
+
+def test_keyword_index_ranks_exact_terms():
+    """Exact regulation references outrank generic chunks; status and filter apply"""
+    index = KeywordIndex()
+    index.set_document("doc-a", status="processed")
+    index.set_document("doc-b", status="processed")
+    index.set_document("doc-c", status="error")
+    index.add_chunks("doc-a", [
+        {"id": "a0", "chunk_index": 0, "content": "Komite audit mengawasi audit internal."},
+        {"id": "a1", "chunk_index": 1, "content": "POJK 55/2015 mengatur pembentukan komite audit."}
+    ])
+    index.add_chunks("doc-b", [
+        {"id": "b0", "chunk_index": 0, "content": "PSAK 71 mengatur instrumen keuangan."}
+    ])
+    index.add_chunks("doc-c", [
+        {"id": "c0", "chunk_index": 0, "content": "POJK 55/2015 salinan rusak."}
+    ])
+
+    results = index.search("Apa isi POJK 55/2015 tentang komite audit?")
+    assert results[0]["id"] == "a1"
+    assert "c0" not in [r["id"] for r in results]
+
+    assert [r["id"] for r in index.search("PSAK 71", filter_document_ids=["doc-a"])] == []
+
+    index.remove_chunks("doc-a", ["a1"])
+    assert "a1" not in [r["id"] for r in index.search("POJK 55/2015")]
+
+def test_reciprocal_rank_fusion():
+    """Items ranked well by both retrievers come first and keep first-seen fields"""
+    vector = [{"id": "x", "similarity": 0.9}, {"id": "y", "similarity": 0.8}]
+    keyword = [{"id": "y", "bm25_score": 3.0}, {"id": "z", "bm25_score": 1.0}]
+
+    fused = reciprocal_rank_fusion([vector, keyword], k=60)
+    assert [item["id"] for item in fused] == ["y", "x", "z"]
+    assert fused[0]["similarity"] == 0.8
+    assert "similarity" not in fused[2]
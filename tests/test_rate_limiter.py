@@ -0,0 +1,56 @@
+"""
+Tests for the Groq rate limiter and priority scheduling
+Run with: pytest tests/
+"""
+import asyncio
+from backend.rate_limiter import (
+    RateLimiter, PRIORITY_BATCH, PRIORITY_INTERACTIVE, retry_after_seconds, backoff_delay
+)
+
+def test_interactive_calls_are_granted_before_queued_batch_calls():
+    """With an empty bucket, a later interactive call overtakes waiting batch calls"""
+    limiter = RateLimiter(requests_per_minute=6000, tokens_per_minute=0)
+    order = []
+
+    async def call(name, priority):
+        await limiter.acquire(10, priority=priority)
+        order.append(name)
+
+    async def run():
+        limiter._requests = 0
+        batch = [asyncio.create_task(call(f"batch{i}", PRIORITY_BATCH)) for i in range(3)]
+        await asyncio.sleep(0)
+        with limiter.priority(PRIORITY_INTERACTIVE):
+            interactive = asyncio.create_task(call("interactive", None))
+        await asyncio.gather(*batch, interactive)
+
+    asyncio.run(run())
+
+    assert order[0] == "interactive"
+    assert order[1:] == ["batch0", "batch1", "batch2"]
+    assert limiter.stats()["throttled"] == 4
+
+def test_token_reservations_are_settled_against_actual_usage():
+    """Over-reserved tokens return to the bucket; oversized requests are capped to the bucket"""
+    limiter = RateLimiter(requests_per_minute=0, tokens_per_minute=1000)
+
+    async def run():
+        reserved = await limiter.acquire(600)
+        await limiter.settle(reserved, 200)
+        oversized = await limiter.acquire(5000)
+        return reserved, oversized
+
+    reserved, oversized = asyncio.run(run())
+
+    assert reserved == 600
+    assert oversized == 1000
+    assert limiter.stats()["available_tokens"] < 100
+
+def test_retry_after_parsing_and_backoff():
+    """Retry-After headers win over exponential backoff and are jittered upwards only"""
+    assert retry_after_seconds({"retry-after": "7"}) == 7.0
+    assert retry_after_seconds({"retry-after-ms": "1500"}) == 1.5
+    assert retry_after_seconds({}) is None
+    assert 7.0 <= backoff_delay(1, 7.0) <= 7.0 * 1.25
+    assert 2.0 <= backoff_delay(3) <= 2.5
+    assert backoff_delay(20, max_delay=10.0) <= 12.5
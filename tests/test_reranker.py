@@ -0,0 +1,44 @@
+"""
+Tests for the cross-encoder reranking stage
+Run with: pytest tests/
+"""
+import asyncio
+from backend.reranker import Reranker
+
+class FakeCrossEncoder:
+    """Scores a pair by how often the query's first word occurs in the content"""
+
+    def __init__(self):
+        self.pairs_seen = 0
+
+    def predict(self, pairs, batch_size=32, show_progress_bar=False):
+        self.pairs_seen += len(pairs)
+        return [content.lower().count(query.split()[0].lower()) for query, content in pairs]
+
+def test_rerank_orders_caches_and_respects_budget():
+    """Best-scored candidates are kept within the token budget; repeat pairs hit the cache"""
+    reranker = Reranker(model_name="fake", batch_size=4, max_cache_items=10)
+    model = FakeCrossEncoder()
+    reranker._model = model
+    candidates = [
+        {"id": "a", "content": "audit"},
+        {"id": "b", "content": "audit audit audit " + "x" * 400},
+        {"id": "c", "content": "audit audit"},
+        {"id": "d", "content": "laporan"}
+    ]
+
+    async def run():
+        first = await reranker.rerank("audit internal", candidates, top_n=3, max_tokens=105)
+        second = await reranker.rerank("audit internal", candidates, top_n=2)
+        return first, second
+
+    try:
+        first, second = asyncio.run(run())
+    finally:
+        reranker.close()
+
+    # "b" (104 tokens) scores highest; "c" no longer fits the budget but "a" does
+    assert [c["id"] for c in first] == ["b", "a"]
+    assert [c["id"] for c in second] == ["b", "c"]
+    assert model.pairs_seen == 4
+    assert reranker.stats()["cache_hits"] == 4
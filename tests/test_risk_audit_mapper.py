@@ -0,0 +1,91 @@
+"""
+Tests for risk/audit record handling and candidate pair selection
+Run with: pytest tests/
+"""
+import numpy as np
+from agents.risk_audit_mapper import (
+    NOT_ASSESSED, candidate_pairs, normalize_records, risk_audit_mapper, risk_level, similarity_matrix
+)
+
+def test_records_are_deduplicated_and_given_ids():
+    """Records repeated across windows are kept once; missing ids do not clash with given ones"""
+    records = normalize_records(
+        [
+            {"risk_id": "R-001", "risk_name": "Risiko likuiditas"},
+            {"risk_id": "r-001", "risk_name": "Risiko likuiditas"},
+            {"risk_id": "", "risk_name": "Risiko fraud"},
+            {"risk_name": "risiko FRAUD"},
+            {"risk_name": "Risiko siber"},
+            {"risk_id": "R-002", "risk_name": ""}
+        ],
+        "risk_id", "risk_name", "R"
+    )
+    assert [(r["risk_id"], r["risk_name"]) for r in records] == [
+        ("R-001", "Risiko likuiditas"),
+        ("R-002", "Risiko fraud"),
+        ("R-003", "Risiko siber")
+    ]
+
+def test_records_sharing_an_id_are_renumbered_not_dropped():
+    """Windows or sheets that restart numbering keep all their distinct records"""
+    records = normalize_records(
+        [
+            {"risk_id": "R-001", "risk_name": "Risiko likuiditas"},
+            {"risk_id": "R-002", "risk_name": "Risiko kredit"},
+            {"risk_id": "R-001", "risk_name": "Risiko  likuiditas"},
+            {"risk_id": "R-001", "risk_name": "Risiko siber"},
+            {"risk_id": "R-002", "risk_name": "Risiko fraud"}
+        ],
+        "risk_id", "risk_name", "R"
+    )
+    assert [(r["risk_id"], r["risk_name"]) for r in records] == [
+        ("R-001", "Risiko likuiditas"),
+        ("R-002", "Risiko kredit"),
+        ("R-003", "Risiko siber"),
+        ("R-004", "Risiko fraud")
+    ]
+
+def test_risk_level_falls_back_to_likelihood_times_impact():
+    assert risk_level({"inherent_risk_level": "critical"}) == "CRITICAL"
+    assert risk_level({"likelihood": "VERY_HIGH", "impact": "HIGH"}) == "CRITICAL"
+    assert risk_level({"likelihood": "MEDIUM", "impact": "HIGH"}) == "HIGH"
+    assert risk_level({"likelihood": "LOW", "impact": "LOW"}) == "LOW"
+    assert risk_level({}) == "MEDIUM"
+
+def test_candidate_pairs_keep_top_k_above_threshold():
+    """Each risk keeps its most similar audits, best first, dropping weak matches"""
+    risks = np.array([[1.0, 0.0], [0.0, 1.0], [-1.0, 0.0]], dtype=np.float32)
+    audits = np.array([[2.0, 0.0], [1.0, 1.0], [0.0, 3.0]], dtype=np.float32)
+
+    similarity = similarity_matrix(risks, audits)
+    pairs = candidate_pairs(similarity, top_k=2, min_similarity=0.5)
+
+    assert similarity.shape == (3, 3)
+    assert np.isclose(similarity[0, 1], np.sqrt(0.5))
+    assert [j for j, _ in pairs[0]] == [0, 1]
+    assert [j for j, _ in pairs[1]] == [2, 1]
+    assert pairs[2] == []
+    assert candidate_pairs(similarity_matrix(risks, np.empty((0, 2))), 3, 0.0) == [[], [], []]
+
+def test_unassessed_risks_are_not_reported_as_gaps():
+    """Risks whose judgment failed are listed separately and left out of coverage and gap figures"""
+    risks = [
+        {"risk_id": "R-001", "risk_name": "Risiko likuiditas", "inherent_risk_level": "HIGH"},
+        {"risk_id": "R-002", "risk_name": "Risiko fraud", "inherent_risk_level": "CRITICAL"},
+        {"risk_id": "R-003", "risk_name": "Risiko siber", "inherent_risk_level": "CRITICAL"}
+    ]
+    audits = [{"audit_id": "A-001", "audit_name": "Audit treasury"}]
+    judgments = {
+        "R-001": {"mapped_audit_ids": ["A-001"], "coverage_status": "FULLY_COVERED"},
+        "R-002": {"mapped_audit_ids": [], "coverage_status": "NOT_COVERED", "coverage_gap": "Tidak ada audit"},
+        "R-003": {"mapped_audit_ids": [], "coverage_status": NOT_ASSESSED}
+    }
+
+    result = risk_audit_mapper._assemble(risks, audits, risks, judgments, "comprehensive", ["batch gagal"])
+
+    gaps = result["gap_analysis"]
+    assert [item["risk_id"] for item in gaps["uncovered_risks"]] == ["R-002"]
+    assert [item["risk_id"] for item in gaps["not_assessed_risks"]] == ["R-003"]
+    assert result["executive_summary"]["coverage_percentage"] == "50%"
+    assert result["executive_summary"]["critical_gaps_count"] == 1
+    assert [a["target_risk"] for a in result["recommendations"]["immediate_actions"]] == ["R-002"]
@@ -0,0 +1,27 @@
+"""
+Tests for the semantic answer cache
+Run with: pytest tests/
+"""
+from backend.semantic_cache import SemanticCache
+
+def test_semantic_cache_hit_scope_and_invalidation():
+    """Test similar queries hit, other scopes miss, and invalidation clears entries"""
+    cache = SemanticCache(threshold=0.9, ttl_seconds=60, max_entries=10)
+    scope = SemanticCache.scope_key(None, True, 2)
+    result = {"success": True, "response": "Tugas Komite Audit ..."}
+
+    cache.store("apa tugas komite audit?", [1.0, 0.0, 0.0], scope, result, cache.corpus_version)
+
+    hit = cache.lookup([0.99, 0.05, 0.0], scope)
+    assert hit["response"] == result["response"]
+    assert hit["cache"]["hit"] is True
+
+    assert cache.lookup([0.0, 1.0, 0.0], scope) is None
+    assert cache.lookup([1.0, 0.0, 0.0], SemanticCache.scope_key(["doc-1"], True, 1)) is None
+
+    stale_version = cache.corpus_version
+    cache.invalidate()
+    assert cache.lookup([1.0, 0.0, 0.0], scope) is None
+
+    cache.store("apa tugas komite audit?", [1.0, 0.0, 0.0], scope, result, stale_version)
+    assert cache.stats()["entries"] == 0
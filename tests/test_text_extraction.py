@@ -0,0 +1,54 @@
+"""
+Tests for structured risk register / PKPT table extraction
+Run with: pytest tests/
+"""
+from backend.text_extraction import _sheet_table, merge_table_rows
+
+def test_risk_register_header_is_detected_below_title_rows():
+    """Title rows are skipped, levels are normalized and unmapped columns land in extra"""
+    rows = [
+        ("PT Contoh Tbk - Risk Register 2024", None, None, None, None, None),
+        (None, None, None, None, None, None),
+        ("No", "Uraian Risiko", "Kemungkinan", "Dampak", "Tingkat Risiko", "Keterangan"),
+        (1.0, "Gangguan sistem core banking", 4, "Tinggi", "Sangat Tinggi", "Prioritas"),
+        (None, None, None, None, None, None),
+        ("R-02", "Fraud pengadaan", "sedang", 2, 16, None),
+    ]
+
+    table = _sheet_table("Risk Register", rows)
+
+    assert table["kind"] == "risk_register"
+    assert table["header_row"] == 3
+    assert table["rows"] == [
+        {"risk_id": "1", "risk_name": "Gangguan sistem core banking", "likelihood": "HIGH",
+         "impact": "HIGH", "inherent_risk_level": "CRITICAL", "extra": {"Keterangan": "Prioritas"}},
+        {"risk_id": "R-02", "risk_name": "Fraud pengadaan", "likelihood": "MEDIUM",
+         "impact": "LOW", "inherent_risk_level": "CRITICAL"},
+    ]
+
+def test_audit_plan_days_are_typed_and_unknown_sheets_skipped():
+    """PKPT day budgets become integers; sheets without a known header are ignored"""
+    rows = [
+        ("Kode Audit", "Nama Penugasan", "Objek Audit", "Triwulan", "Jumlah Hari"),
+        ("A-01", "Audit Pengadaan", "Divisi Logistik", "Q2", "20 hari"),
+    ]
+
+    table = _sheet_table("PKPT", rows)
+
+    assert table["kind"] == "audit_plan"
+    assert table["rows"][0]["estimated_days"] == 20
+    assert table["rows"][0]["planned_period"] == "Q2"
+    assert _sheet_table("Catatan", [("Tanggal", "Keterangan"), ("2024-01-01", "Rapat")]) is None
+
+def test_ids_numbered_per_sheet_are_qualified_with_the_sheet_name():
+    """Sheets numbered 1, 2, ... each keep their risks when joined; unique ids are left as they are"""
+    header = ("No", "Uraian Risiko", "Tingkat Risiko")
+    operational = _sheet_table("Operasional", [header, (1, "Gangguan sistem", "Tinggi"), (2, "Fraud kas", "Sedang")])
+    credit = _sheet_table("Kredit", [header, (1, "Kredit macet", "Tinggi"), ("K-9", "Konsentrasi debitur", "Rendah")])
+
+    rows = merge_table_rows([operational, credit], "risk_register")
+
+    assert [row["risk_id"] for row in rows] == ["Operasional-1", "2", "Kredit-1", "K-9"]
+    assert [row["risk_name"] for row in rows] == ["Gangguan sistem", "Fraud kas", "Kredit macet",
+                                                  "Konsentrasi debitur"]
+    assert operational["rows"][0]["risk_id"] == "1"
@@ -0,0 +1,33 @@
+"""
+Tests for LLM token usage aggregation
+Run with: pytest tests/
+"""
+import asyncio
+from backend.usage_tracker import UsageTracker
+
+def test_usage_is_aggregated_by_labels_and_collected():
+    """Calls are attributed to endpoint/agent/session and summed by collectors across subtasks"""
+    tracker = UsageTracker()
+
+    async def agent_call(agent):
+        with tracker.labels(agent=agent):
+            tracker.record(100, 20)
+
+    async def run():
+        with tracker.labels(endpoint="/query", session_id="s1"), tracker.collect() as usage:
+            await asyncio.gather(agent_call("charter_expert"), agent_call("banking_expert"))
+            tracker.record(50, 10, estimated=True)
+        return usage
+
+    usage = asyncio.run(run())
+    tracker.record(5, 5)
+
+    assert usage["total_tokens"] == 300
+    assert usage["calls"] == 3
+    stats = tracker.stats()
+    assert stats["totals"]["total_tokens"] == 310
+    assert stats["totals"]["estimated_calls"] == 1
+    assert stats["by_endpoint"]["/query"]["prompt_tokens"] == 250
+    assert stats["by_agent"]["banking_expert"]["completion_tokens"] == 20
+    assert stats["top_sessions"]["s1"]["calls"] == 3
+    assert stats["last_minute"]["requests"] == 4
@@ -0,0 +1,59 @@
+"""
+Tests for the local in-process vector index
+Run with: pytest tests/
+"""
+import numpy as np
+from backend.vector_index import LocalVectorIndex, format_vectors, parse_vector
+
+def _chunk(index, embedding):
+    return {"chunk_index": index, "content": f"chunk {index}", "embedding": embedding}
+
+def test_local_index_search_filters_and_sync():
+    """Test ordering, threshold, document filter and searchable-status results"""
+    index = LocalVectorIndex(dimension=3)
+    index.set_document("doc-a", filename="a.pdf", category="Regulatory", status="processed")
+    index.set_document("doc-b", filename="b.pdf", category="Banking", status="uploaded")
+    index.add_chunks("doc-a", [_chunk(0, [1, 0, 0]), _chunk(1, [1, 1, 0])])
+    index.add_chunks("doc-b", [_chunk(0, "[1, 0, 0]")])
+
+    results = index.search([1, 0, 0], match_threshold=0.5, match_count=5)
+    assert [r["chunk_index"] for r in results] == [0, 1]
+    assert results[0]["filename"] == "a.pdf"
+    assert results[0]["similarity"] > results[1]["similarity"]
+
+    index.set_document("doc-b", status="processing")
+    results = index.search([1, 0, 0], match_threshold=0.5, match_count=5, filter_document_ids=["doc-b"])
+    assert [r["document_id"] for r in results] == ["doc-b"]
+
+    index.remove_document("doc-a")
+    assert all(r["document_id"] == "doc-b" for r in index.search([1, 0, 0], match_threshold=0.0))
+
+def test_local_index_reingest_by_id():
+    """Re-ingest keeps rows by id: renumbered, removed and new chunks coexist"""
+    index = LocalVectorIndex(dimension=3)
+    index.set_document("doc-a", filename="a.pdf", status="processed")
+    index.add_chunks("doc-a", [
+        {**_chunk(0, [1, 0, 0]), "id": "e0"},
+        {**_chunk(1, [0, 1, 0]), "id": "e1"}
+    ])
+
+    # New version: a chunk inserted at 0 shifts the kept chunk e0 to index 1
+    index.add_chunks("doc-a", [{**_chunk(0, [0, 0, 1]), "id": "e2"}])
+    index.renumber_chunks("doc-a", {"e0": 1})
+    index.remove_chunks("doc-a", ["e1"])
+
+    results = index.search([1, 1, 1], match_threshold=0.0, match_count=5)
+    assert sorted((r["id"], r["chunk_index"]) for r in results) == [("e0", 1), ("e2", 0)]
+
+def test_format_vectors_round_trip():
+    """pgvector literals round-trip at transport precision and float16 is smaller"""
+    vectors = np.random.default_rng(0).standard_normal((3, 384)).astype(np.float32)
+
+    full = format_vectors(vectors, dtype="float32")
+    half = format_vectors(vectors, dtype="float16")
+
+    assert len(full) == 3
+    assert np.allclose(parse_vector(full[0]), vectors[0], rtol=1e-6)
+    assert np.allclose(parse_vector(half[1]), vectors[1], rtol=1e-3, atol=1e-3)
+    assert len(half[0]) < len(full[0])
+    assert format_vectors(vectors[2], dtype="float32") == [full[2]]